@@ -28,28 +28,84 @@ let latestState = {
     }
 };
 
+// version -> anchors, do Python broadcast khi anchor set thay đổi.
+// Chỉ giữ version mới nhất của mỗi zone (+ chặn tổng số) -> không phình theo thời gian chạy
+const MAX_ANCHOR_SETS = 64;
+const anchorSets = new Map();
+const zoneVersions = new Map();   // zone -> version mới nhất
+
+function storeAnchorSet(zone, version, anchors) {
+    const prev = zoneVersions.get(zone);
+    if (prev !== undefined && prev !== version) anchorSets.delete(prev);
+    zoneVersions.set(zone, version);
+    anchorSets.delete(version);   // đưa về cuối thứ tự chèn
+    anchorSets.set(version, anchors);
+    while (anchorSets.size > MAX_ANCHOR_SETS) {
+        anchorSets.delete(anchorSets.keys().next().value);
+    }
+}
+
+// Vị trí mang anchor version khác version hiện tại -> chuyển sang anchor set tương ứng.
+// Trả về true nếu anchor set đổi (cần phát lại anchors cho FE)
+function applyAnchorVersion(av) {
+    if (av === undefined || av === latestState.anchorVersion || !anchorSets.has(av)) return false;
+    latestState.anchorVersion = av;
+    latestState.anchors = anchorSets.get(av);
+    return true;
+}
+
+// Anchor chỉ phát khi đổi (anchors-update / đổi version) và lúc client connect;
+// mỗi frame chỉ phát vị trí + anchorVersion
+function emitAnchors() {
+    io.emit("full-state-update", { anchors: latestState.anchors, anchorVersion: latestState.anchorVersion });
+}
+
+function emitPositions() {
+    io.emit("full-state-update", {
+        tag: latestState.tag,
+        tags: latestState.tags,
+        anchorVersion: latestState.anchorVersion,
+    });
+}
+
 io.on("connection", (socket) => {
     console.log(`Client connected: ${socket.id}`);
     socket.emit("full-state-update", latestState);
 
     socket.on("anchors-update", (anchorsData) => {
-        // ... (giữ nguyên logic cũ của bạn)
         if (anchorsData && typeof anchorsData === "object") {
             let updated = false;
-            ["A0", "A1", "A2", "A3"].forEach(key => {
-                if (anchorsData[key]) {
-                    latestState.anchors[key] = {
-                        x: anchorsData[key].x,
-                        y: anchorsData[key].y,
-                        z: anchorsData[key].z
-                    };
-                    updated = true;
-                }
+            const anchors = {};
+            Object.keys(anchorsData).filter(key => /^A\d+$/.test(key)).forEach(key => {
+                anchors[key] = {
+                    x: anchorsData[key].x,
+                    y: anchorsData[key].y,
+                    z: anchorsData[key].z
+                };
+                updated = true;
             });
-            if (updated) io.emit("full-state-update", latestState);
+            if (!updated) return;
+
+            // Anchor set có version (AnchorBroadcaster): lưu lại để vị trí tag chỉ cần gửi "av"
+            if (anchorsData.version !== undefined) {
+                storeAnchorSet(anchorsData.zone ?? "default", anchorsData.version, anchors);
+                latestState.anchorVersion = anchorsData.version;
+            }
+            latestState.anchors = anchors;
+            emitAnchors();
         }
     });
 
+    // Batch vị trí qua Socket.IO (AsyncRealtimeRunner)
+    socket.on("tags-update", (data) => {
+        applyPositions(data && data.positions);
+    });
+
+    socket.on("tags-bin", (buf) => {
+        const positions = decodeWireFrame(Buffer.isBuffer(buf) ? buf : Buffer.from(buf));
+        if (positions) applyPositions(positions);
+    });
+
     socket.on("disconnect", () => {
         console.log(`Client disconnected: ${socket.id}`);
     });
@@ -69,11 +125,81 @@ app.get("/push", (req, res) => {
         timestamp: ts ? parseFloat(ts) : Date.now() / 1000,
     };
 
-    io.emit("full-state-update", latestState);
+    emitPositions();
     console.log(`Tag updated: ${x}, ${y}, ${z}`);
     res.sendStatus(200);
 });
 
+// Batch vị trí { positions: [{ id, x, y, z, ts, av }, ...] } -> cập nhật state + phát 1 lần
+function applyPositions(positions) {
+    if (!Array.isArray(positions) || positions.length === 0) return false;
+
+    latestState.tags = latestState.tags || {};
+    positions.forEach(p => {
+        latestState.tags[p.id] = {
+            x: parseFloat(p.x),
+            y: parseFloat(p.y),
+            z: parseFloat(p.z),
+            timestamp: p.ts ? parseFloat(p.ts) : Date.now() / 1000,
+        };
+    });
+    // Giữ tương thích LiveTracking: tag = vị trí cuối cùng trong batch
+    const last = positions[positions.length - 1];
+    latestState.tag = latestState.tags[last.id];
+    if (applyAnchorVersion(last.av)) emitAnchors();
+
+    emitPositions();
+    return true;
+}
+
+// Frame nhị phân (kalman_test/simulation/wire.py), little-endian:
+// header 12B: "UW" | version u8 | flags u8 | count u32 | av u32
+// record 24B: tag u32 | ts f64 | x,y,z i32 (mm)  (+ std x,y,z u16 mm nếu flags & 1)
+function decodeWireFrame(buf) {
+    if (!Buffer.isBuffer(buf) || buf.length < 12 || buf.toString("latin1", 0, 2) !== "UW" || buf.readUInt8(2) !== 1) {
+        return null;
+    }
+    const hasStd = (buf.readUInt8(3) & 1) !== 0;
+    const count = buf.readUInt32LE(4);
+    const av = buf.readUInt32LE(8);
+    const recSize = hasStd ? 30 : 24;
+    if (buf.length !== 12 + count * recSize) return null;
+
+    const positions = new Array(count);
+    for (let i = 0, off = 12; i < count; i++, off += recSize) {
+        const p = {
+            id: buf.readUInt32LE(off),
+            ts: buf.readDoubleLE(off + 4),
+            x: buf.readInt32LE(off + 12) / 1000,
+            y: buf.readInt32LE(off + 16) / 1000,
+            z: buf.readInt32LE(off + 20) / 1000,
+            av: av,
+        };
+        if (hasStd) {
+            p.std = [buf.readUInt16LE(off + 24) / 1000, buf.readUInt16LE(off + 26) / 1000, buf.readUInt16LE(off + 28) / 1000];
+        }
+        positions[i] = p;
+    }
+    return positions;
+}
+
+// HTTP push batch từ Python (PositionPublisher)
+app.post("/push-batch", (req, res) => {
+    if (!applyPositions(req.body && req.body.positions)) {
+        return res.status(400).send("Missing positions");
+    }
+    res.sendStatus(200);
+});
+
+// HTTP push batch nhị phân (PUSH_FORMAT = "binary")
+app.post("/push-bin", express.raw({ type: "application/octet-stream", limit: "4mb" }), (req, res) => {
+    const positions = decodeWireFrame(req.body);
+    if (!positions || !applyPositions(positions)) {
+        return res.status(400).send("Bad wire frame");
+    }
+    res.sendStatus(200);
+});
+
 const PORT = process.env.PORT || 3000;
 server.listen(PORT, "0.0.0.0", () => {
     console.log(`BE running on http://localhost:${PORT}`);
@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import asyncio
+
+from publisher import AnchorBroadcaster
+from scheduler import FrameScheduler
+
+
+def make_async_client():
+    """socketio.AsyncClient, tự reconnect bị tắt: AsyncRealtimeRunner tự lo backoff."""
+    import socketio
+
+    return socketio.AsyncClient(reconnection=False)
+
+
+# ---------- Asyncio realtime runner ----------
+class AsyncRealtimeRunner:
+    """
+    Vòng realtime dạng asyncio, các việc chạy thành task độc lập:
+    - frame loop : bám deadline (FrameScheduler.wait_async), đo -> solve (executor) -> lọc -> enqueue
+    - emitter    : gom hàng đợi, mỗi lần emit 1 batch vị trí ("tags-update") + anchor set khi đổi
+    - reconnector: connect lại với backoff mũ, KHÔNG nằm trong frame loop
+
+    Backend chết -> emitter chỉ đếm message bỏ (offline_dropped), frame loop không bị chờ.
+    Anchor set chưa emit được (offline / bị bỏ khỏi hàng đợi / emit lỗi) -> zone được đánh dấu gửi lại
+    (AnchorBroadcaster.mark_dirty), frame kế tiếp gửi lại.
+
+    measure_fn(step, t) -> (scenario_idx, seg_t, anchors, s, gt)   (như scenarios.get_measure)
+    solve_fn(anchors, s, prior) -> (est, it, ok, cost)               (chạy trong executor)
+    kf: bộ lọc có predict(dt) / update(meas, hybrid_cost=) / get_state_vec3()
+    """
+
+    def __init__(
+            self,
+            measure_fn: Callable,
+            solve_fn: Callable,
+            kf,
+            url: str = "http://localhost:3000",
+            make_client: Callable = make_async_client,
+            frame_hz: float = 10.0,
+            tag_id: str = "T0",
+            queue_size: int = 64,
+            connect_timeout: float = 2.0,
+            backoff_min: float = 0.5,
+            backoff_max: float = 10.0,
+            on_frame: Optional[Callable] = None,
+    ):
+        self.measure_fn = measure_fn
+        self.solve_fn = solve_fn
+        self.kf = kf
+        self.url = url
+        self.make_client = make_client
+        self.frame_hz = float(frame_hz)
+        self.tag_id = tag_id
+        self.queue_size = int(queue_size)
+        self.connect_timeout = float(connect_timeout)
+        self.backoff_min = float(backoff_min)
+        self.backoff_max = float(backoff_max)
+        self.on_frame = on_frame
+
+        self.client = None
+        self.sched: Optional[FrameScheduler] = None
+        self.anchors = AnchorBroadcaster(self._emit_control)
+        self._queue: Optional[asyncio.Queue] = None
+        # 1 thread: solve tuần tự -> giữ thứ tự frame, vẫn không chặn event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lm-solve")
+
+        self.frames = 0
+        self.solve_failures = 0
+        self.sent = 0
+        self.emit_errors = 0
+        self.offline_dropped = 0
+        self.queue_dropped = 0
+        self.control_lost = 0
+        self.connects = 0
+        self.connect_failures = 0
+
+    # ----- Hàng đợi emit (vị trí + anchor) -----
+    def _enqueue(self, msg) -> None:
+        if self._queue.full():
+            self._lost(self._queue.get_nowait())        # bỏ message cũ nhất
+            self.queue_dropped += 1
+        self._queue.put_nowait(msg)
+
+    def _lost(self, msg) -> None:
+        kind, _, payload = msg
+        if kind == "control":
+            self.control_lost += 1
+            self.anchors.mark_dirty(payload.get("zone"), payload.get("version"))
+
+    def _emit_control(self, event: str, payload: dict) -> None:
+        # Offline -> raise để AnchorBroadcaster giữ cờ dirty và gửi lại sau
+        if self.client is None or not self.client.connected:
+            raise ConnectionError("Socket.IO not connected")
+        self._enqueue(("control", event, payload))
+
+    # ----- Tasks -----
+    async def _frame_loop(self, n_frames: Optional[int]):
+        loop = asyncio.get_running_loop()
+        self.sched = FrameScheduler(period=1.0 / self.frame_hz, clock=loop.time)
+        step = 0
+        while n_frames is None or self.frames < n_frames:
+            tick = await self.sched.wait_async()
+            step += 1
+            scenario_idx, _, anchors, s, _ = self.measure_fn(step, tick.t)
+
+            self.kf.predict(tick.dt)
+            est, _, ok, cost = await loop.run_in_executor(
+                self._executor, self.solve_fn, anchors, s, self.kf.get_state_vec3()
+            )
+            if ok:
+                pos = self.kf.update(est, hybrid_cost=cost)
+            else:
+                self.solve_failures += 1
+                pos = self.kf.get_state_vec3()
+
+            av = self.anchors.update(anchors, zone=f"S{scenario_idx}")
+            self._enqueue(("pos", self.tag_id, {
+                "id": self.tag_id,
+                "x": round(pos.x, 3), "y": round(pos.y, 3), "z": round(pos.z, 3),
+                "ts": round(tick.t, 3), "av": av,
+            }))
+            self.frames += 1
+            if self.on_frame is not None:
+                self.on_frame(self, tick, pos)
+
+    async def _emitter(self):
+        while True:
+            msgs = [await self._queue.get()]
+            while not self._queue.empty():
+                msgs.append(self._queue.get_nowait())
+
+            if self.client is None or not self.client.connected:
+                self.offline_dropped += len(msgs)
+                for msg in msgs:
+                    self._lost(msg)
+                continue
+
+            latest = {}
+            for msg in msgs:
+                kind, key, payload = msg
+                if kind == "control":
+                    if not await self._safe_emit(key, payload):
+                        self._lost(msg)
+                else:
+                    latest[key] = payload      # coalesce: mỗi tag giữ vị trí mới nhất
+            if latest:
+                await self._safe_emit("tags-update", {"positions": list(latest.values())})
+
+    async def _safe_emit(self, event: str, payload: dict) -> bool:
+        try:
+            await self.client.emit(event, payload)
+            self.sent += 1
+            return True
+        except Exception:
+            self.emit_errors += 1
+            return False
+
+    async def _reconnector(self):
+        backoff = self.backoff_min
+        while True:
+            if self.client is not None and self.client.connected:
+                backoff = self.backoff_min
+                await asyncio.sleep(self.backoff_min)
+                continue
+            try:
+                if self.client is None:
+                    self.client = self.make_client()
+                await asyncio.wait_for(self.client.connect(self.url), timeout=self.connect_timeout)
+                self.connects += 1
+                self.anchors.resend_all()          # BE có thể vừa restart
+            except Exception:
+                self.connect_failures += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2.0, self.backoff_max)
+
+    async def run(self, n_frames: Optional[int] = None):
+        """Chạy tới khi đủ n_frames (None = mãi mãi). Các task nền bị hủy khi frame loop kết thúc."""
+        self._queue = asyncio.Queue(self.queue_size)
+        background = [
+            asyncio.create_task(self._emitter(), name="emitter"),
+            asyncio.create_task(self._reconnector(), name="reconnector"),
+        ]
+        try:
+            await self._frame_loop(n_frames)
+            await asyncio.sleep(0)           # cho emitter gửi nốt frame cuối nếu đang online
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            if self.client is not None and self.client.connected:
+                try:
+                    await self.client.disconnect()
+                except Exception:
+                    pass
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        st = {
+            "frames": self.frames,
+            "solve_failures": self.solve_failures,
+            "sent": self.sent,
+            "emit_errors": self.emit_errors,
+            "offline_dropped": self.offline_dropped,
+            "queue_dropped": self.queue_dropped,
+            "control_lost": self.control_lost,
+            "connects": self.connects,
+            "connect_failures": self.connect_failures,
+        }
+        if self.sched is not None:
+            st.update(self.sched.stats())
+        return st
@@ -0,0 +1,506 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+import http.client
+import json
+import math
+import platform
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+import hybrid_scalable as hs
+import gmc_kalman_filter as gmc
+
+
+# ---------- Đo thời gian ----------
+def _lat_summary(ns: np.ndarray, prefix: str) -> Dict[str, float]:
+    """ns: (n,) nano giây / lần gọi -> {prefix_p50_us, prefix_p99_us, prefix_mean_us}."""
+    us = np.asarray(ns, dtype=float) * 1e-3
+    return {
+        f"{prefix}_p50_us": float(np.percentile(us, 50)),
+        f"{prefix}_p99_us": float(np.percentile(us, 99)),
+        f"{prefix}_mean_us": float(us.mean()),
+    }
+
+
+def _best_of(fn: Callable, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _scene(n: int, seed: int, noise: float = 0.05):
+    """Anchor 6x6 m (1 anchor cao hơn) + n tag ngẫu nhiên -> (anchors Vec3, A (4,3), P (n,3), S (n,5))."""
+    anchors = [hs.Vec3(0, 0, 2.0), hs.Vec3(6, 0, 2.0), hs.Vec3(0, 6, 2.0), hs.Vec3(6, 6, 2.7)]
+    A = hs.anchors_to_array(anchors)
+    rng = np.random.default_rng(seed)
+    P = np.column_stack([rng.uniform(0.6, 5.4, (n, 2)), rng.uniform(0.6, 2.0, n)])
+    S = hs.s_from_groundtruth_batch(A, P, noise, rng=rng)
+    return anchors, A, P, S
+
+
+# ---------- Solver ----------
+def bench_lm(n: int = 2000, seed: int = 0) -> Dict[str, float]:
+    """hybrid_solve_LM từng tag (cold start): độ trễ / lần giải + phân bố số vòng lặp."""
+    anchors, _, _, S = _scene(n, seed)
+    rows = S.tolist()
+    ns = np.empty(n)
+    its = np.empty(n, dtype=int)
+    ok_cnt = 0
+    for i, s in enumerate(rows):
+        t0 = time.perf_counter_ns()
+        _, it, ok, _ = hs.hybrid_solve_LM(anchors, s)
+        ns[i] = time.perf_counter_ns() - t0
+        its[i] = it
+        ok_cnt += ok
+    out = _lat_summary(ns, "lm_solve")
+    out.update({
+        "lm_iters_mean": float(its.mean()),
+        "lm_iters_p95": float(np.percentile(its, 95)),
+        "lm_iters_max": float(its.max()),
+        "lm_ok_rate": ok_cnt / n,
+    })
+    return out
+
+
+def bench_lm_tracking(n: int = 2000, seed: int = 0) -> Dict[str, float]:
+    """hybrid_solve_tracking với prior cách nghiệm ~5 cm (như warm start từ Kalman)."""
+    anchors, _, P, S = _scene(n, seed)
+    rng = np.random.default_rng(seed + 1)
+    priors = (P + rng.normal(0, 0.05, P.shape)).tolist()
+    rows = S.tolist()
+    ns = np.empty(n)
+    its = np.empty(n, dtype=int)
+    for i, s in enumerate(rows):
+        prior = hs.Vec3(*priors[i])
+        t0 = time.perf_counter_ns()
+        _, it, _, _, _ = hs.hybrid_solve_tracking(anchors, s, prior=prior)
+        ns[i] = time.perf_counter_ns() - t0
+        its[i] = it
+    out = _lat_summary(ns, "lm_track")
+    out["lm_track_iters_mean"] = float(its.mean())
+    return out
+
+
+# ---------- So sánh trust-region strategy (hybrid_solve_LM strategy= / geodesic=) ----------
+# Hình học như các kịch bản trong t.py; "far" = khởi tạo cố định xa vùng tag (mất linear init).
+STRATEGY_SCENES = {
+    "coplanar_5x5": [(0, 0, 2.0), (5, 0, 2.0), (0, 5, 2.0), (5, 5, 2.0)],
+    "noncoplanar_5x5": [(0, 0, 2.0), (5, 0, 2.0), (0, 5, 2.0), (5, 5, 2.6)],
+    "hall_8": [(0, 0, 2.8), (5, 0, 2.4), (10, 0, 2.8), (0, 10, 2.8),
+               (5, 10, 2.4), (10, 10, 2.8), (0, 5, 2.2), (10, 5, 2.6)],
+}
+STRATEGY_VARIANTS = (("lm", False), ("lm", True), ("nielsen", False), ("nielsen", True), ("dogleg", False))
+
+
+def bench_strategies(n: int = 300, seed: int = 0, noise: float = 0.05, variants=STRATEGY_VARIANTS,
+                     tol_m: float = 0.5) -> List[dict]:
+    """
+    Mỗi (strategy, geodesic) x scene x start (cold / far) -> 1 row (dict).
+    Thành công = ok và cách ground truth < tol_m (nghiệm gương / kẹt không tính);
+    số vòng lặp mean / p99 / max chỉ tính trên các lần thành công. Kèm ok_rate (cờ của solver),
+    sai số median và µs / lần giải.
+    """
+    rows = []
+    for scene, pts in STRATEGY_SCENES.items():
+        anchors = [hs.Vec3(*a) for a in pts]
+        A = hs.anchors_to_array(anchors)
+        hi = A.max(axis=0)
+        rng = np.random.default_rng(seed)
+        P = np.column_stack([rng.uniform(0.5, hi[0] - 0.5, (n, 2)), rng.uniform(0.5, 1.8, n)])
+        S = hs.s_from_groundtruth_batch(A, P, noise, rng=rng).tolist()
+        # xa theo phương ngang nhưng cùng phía tag (dưới mặt phẳng anchor) -> không rơi vào nghiệm gương
+        far = hs.Vec3(2.0 * hi[0], -hi[1], 0.5)
+        for start, init in (("cold", None), ("far", far)):
+            for strategy, geodesic in variants:
+                its = np.empty(n, dtype=int)
+                err = np.empty(n)
+                ok = np.empty(n, dtype=bool)
+                t0 = time.perf_counter_ns()
+                for i, s in enumerate(S):
+                    est, its[i], ok[i], _ = hs.hybrid_solve_LM(anchors, s, init=init, strategy=strategy,
+                                                               geodesic=geodesic)
+                    err[i] = math.dist((est.x, est.y, est.z), P[i])
+                el = time.perf_counter_ns() - t0
+                hit = ok & (err < tol_m)
+                its_hit = its[hit] if hit.any() else np.array([np.nan])
+                rows.append({
+                    "scene": scene, "start": start,
+                    "strategy": strategy + ("+geo" if geodesic else ""),
+                    "success_rate": float(hit.mean()),
+                    "iters_mean": float(np.mean(its_hit)),
+                    "iters_p99": float(np.percentile(its_hit, 99)),
+                    "iters_max": float(np.max(its_hit)),
+                    "ok_rate": float(ok.mean()),
+                    "err_p50_m": float(np.median(err)),
+                    "us": el / n * 1e-3,
+                })
+    return rows
+
+
+def rank_strategies(rows: List[dict]) -> List[tuple]:
+    """
+    Gộp mọi scene/start -> [(strategy, success_rate, mean iters, mean p99 iters, µs)],
+    xếp theo tỉ lệ thành công (giảm dần, làm tròn 1%) rồi (mean, p99) số vòng của các lần thành công.
+    """
+    agg: Dict[str, list] = {}
+    for r in rows:
+        agg.setdefault(r["strategy"], []).append(r)
+    out = []
+    for name, rs in agg.items():
+        out.append((name,
+                    float(np.mean([r["success_rate"] for r in rs])),
+                    float(np.mean([r["iters_mean"] for r in rs])),
+                    float(np.mean([r["iters_p99"] for r in rs])),
+                    float(np.mean([r["us"] for r in rs]))))
+    return sorted(out, key=lambda r: (-round(r[1], 2), r[2], r[3]))
+
+
+def format_strategies(rows: List[dict]) -> str:
+    lines = [f"{'scene':<16} {'start':<5} {'strategy':<12} {'succ':>6} {'mean':>6} {'p99':>5} {'max':>4} "
+             f"{'ok':>6} {'err50':>7} {'µs':>7}"]
+    for r in rows:
+        lines.append(f"{r['scene']:<16} {r['start']:<5} {r['strategy']:<12} {r['success_rate']:6.3f} "
+                     f"{r['iters_mean']:6.2f} {r['iters_p99']:5.0f} {r['iters_max']:4.0f} {r['ok_rate']:6.3f} "
+                     f"{r['err_p50_m']:7.3f} {r['us']:7.0f}")
+    lines.append("ranking (success, mean iters, p99 iters, µs):")
+    for name, succ, mean, p99, us in rank_strategies(rows):
+        lines.append(f"  {name:<12} {succ:6.3f} {mean:6.2f} {p99:6.1f} {us:7.0f}")
+    return "\n".join(lines)
+
+
+# ---------- Filter ----------
+def bench_kf(n: int = 5000, seed: int = 0) -> Dict[str, float]:
+    """AdaptiveGMCKalman3D.predict / update (đường fast và đường đầy đủ) trên 1 quỹ đạo nhiễu."""
+    rng = np.random.default_rng(seed)
+    meas = (np.array([3.0, 3.0, 1.4]) + rng.normal(0, 0.05, (n, 3))).tolist()
+    out = {}
+    for name, fast in (("fast", True), ("full", False)):
+        kf = gmc.AdaptiveGMCKalman3D(process_var=0.8, meas_var=0.7, fast_update=fast)
+        kf.reset(gmc.Vec3(3.0, 3.0, 1.4))
+        ns_p = np.empty(n)
+        ns_u = np.empty(n)
+        for i, m in enumerate(meas):
+            z = gmc.Vec3(*m)
+            t0 = time.perf_counter_ns()
+            kf.predict(0.1)
+            t1 = time.perf_counter_ns()
+            kf.update(z, hybrid_cost=0.01)
+            t2 = time.perf_counter_ns()
+            ns_p[i] = t1 - t0
+            ns_u[i] = t2 - t1
+        if fast:
+            out.update(_lat_summary(ns_p, "kf_predict"))
+        out.update(_lat_summary(ns_u, f"kf_update_{name}"))
+    return out
+
+
+# ---------- Batched paths: throughput theo số tag ----------
+def bench_batch(tag_counts=(1, 10, 100, 1000, 10000), repeat: int = 5, seed: int = 0) -> Dict[str, float]:
+    """
+    1 frame cho N tag: hybrid_solve_LM_batch + GMCKalmanBank.predict/update.
+    Trả về tag/s của từng phần và của cả frame cho mỗi N.
+    """
+    out = {}
+    for n in tag_counts:
+        _, A, _, S = _scene(n, seed)
+        X, _, ok, cost = hs.hybrid_solve_LM_batch(A, S)
+        bank = gmc.GMCKalmanBank(n, process_var=0.8, meas_var=0.7)
+        bank.reset(X)
+
+        t_lm = _best_of(lambda: hs.hybrid_solve_LM_batch(A, S), repeat)
+
+        def kf_step():
+            bank.predict(0.1)
+            bank.update(X, hybrid_cost=cost, mask=ok)
+
+        t_kf = _best_of(kf_step, repeat)
+        out[f"batch_lm_{n}_tags_per_s"] = n / t_lm
+        out[f"batch_kf_{n}_tags_per_s"] = n / t_kf
+        out[f"batch_frame_{n}_tags_per_s"] = n / (t_lm + t_kf)
+    return out
+
+
+# ---------- Local stand-in cho BE (/push, /push-batch, /push-bin) ----------
+class PushStandIn:
+    """
+    HTTP server cục bộ (thread nền) nhận giống be-uwb: GET /push?x=&y=&z=&ts=,
+    POST /push-batch {"positions": [...]}, POST /push-bin (wire.py).
+    Ghi độ trễ giao (thời điểm nhận - ts) cho mỗi vị trí; ts là time.time() phía gửi.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.latencies: List[float] = []
+        self.requests = 0
+        self.positions = 0
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"     # keep-alive như requests.Session
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code=200):
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path != "/push":
+                    return self._reply(404)
+                q = dict(parse_qsl(url.query))
+                stand_in._record([float(q["ts"])] if "ts" in q else [])
+                self._reply()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = urlsplit(self.path).path
+                if path == "/push-batch":
+                    ts = [float(p["ts"]) for p in json.loads(body)["positions"] if "ts" in p]
+                elif path == "/push-bin":
+                    from wire import decode_positions
+                    ts = decode_positions(body)["ts"].tolist()
+                else:
+                    return self._reply(404)
+                stand_in._record(ts)
+                self._reply()
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="push-stand-in", daemon=True)
+
+    def _record(self, ts: List[float]) -> None:
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            self.positions += len(ts)
+            self.latencies.extend(now - t for t in ts)
+
+    def start(self) -> "PushStandIn":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def stdlib_batch_sender(url: str, timeout: float = 0.25) -> Callable[[List[dict]], None]:
+    """Như publisher.http_batch_sender nhưng dùng http.client keep-alive (khi chưa cài requests)."""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    headers = {"Content-Type": "application/json"}
+
+    def send(batch: List[dict]) -> None:
+        try:
+            conn.request("POST", parts.path, body=json.dumps({"positions": batch}), headers=headers)
+            r = conn.getresponse()
+            r.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()     # lần sau tự mở lại kết nối
+            raise
+        if r.status >= 400:
+            raise ConnectionError(f"HTTP {r.status}")
+
+    return send
+
+
+# ---------- End-to-end frame (vòng main.py) ----------
+def bench_e2e(n_frames: int = 300, frame_hz: float = 100.0, seed: int = 0) -> Dict[str, float]:
+    """
+    Vòng main.main() (bám deadline frame_hz bằng FrameScheduler): get_measure -> hybrid_solve_tracking
+    -> Kalman -> publish tới PushStandIn qua PositionPublisher.
+    Đo độ trễ frame (tới lúc enqueue xong) và độ trễ giao (đầu frame -> server nhận, độ phân giải 1 ms
+    do ts được làm tròn).
+    Đo + tham số lấy từ scenarios, policy "skip" và tag "T0" như main (không import main: tránh
+    Socket.IO client / Kalman toàn cục của main).
+    """
+    import scenarios
+    from publisher import PositionPublisher
+    from scheduler import FrameScheduler
+
+    random.seed(seed)
+    with PushStandIn() as server:
+        try:
+            from publisher import http_batch_sender
+            send = http_batch_sender(server.url + "/push-batch", timeout=1.0)
+        except ImportError:
+            send = stdlib_batch_sender(server.url + "/push-batch", timeout=1.0)
+        publisher = PositionPublisher(send, max_queue=scenarios.PUBLISH_QUEUE).start()
+
+        kf = gmc.AdaptiveGMCKalman3D(**scenarios.KF_KW, fast_update=True)
+        _, _, anchors, s, _ = scenarios.get_measure(1, 0.0)
+        est, _, ok, _ = hs.hybrid_solve_LM(anchors, s, **scenarios.LM_KW)
+        kf.reset(est if ok else hs.Vec3(6.0, 1.6, 6.0))
+
+        ns = np.empty(n_frames)
+        sched = FrameScheduler(period=1.0 / frame_hz, policy="skip")
+        for k in range(n_frames):
+            tick = sched.wait()
+            t_wall = time.time()
+            t0 = time.perf_counter_ns()
+            _, _, anchors, s, _ = scenarios.get_measure(k + 2, tick.t)
+            kf.predict(tick.dt)
+            est, _, ok, cost, _ = hs.hybrid_solve_tracking(
+                anchors, s, prior=kf.get_state_vec3(), max_cost=scenarios.WARM_MAX_COST, **scenarios.LM_KW
+            )
+            pos = kf.update(est, hybrid_cost=cost) if ok else kf.get_state_vec3()
+            publisher.publish("T0", pos.x, pos.y, pos.z, ts=t_wall)
+            ns[k] = time.perf_counter_ns() - t0
+        publisher.stop()
+        st = publisher.stats()
+        lat = np.array(server.latencies) * 1e3
+
+    out = _lat_summary(ns, "e2e_frame")
+    out.update({
+        "e2e_frames_per_s": float(1e9 / ns.mean()),
+        "e2e_delivery_p50_ms": float(np.percentile(lat, 50)) if lat.size else float("nan"),
+        "e2e_delivery_p99_ms": float(np.percentile(lat, 99)) if lat.size else float("nan"),
+        "e2e_sched_jitter_p95_ms": sched.stats()["jitter_p95_ms"],
+        # 1 tag: publisher gom các frame giữa 2 lần flush -> chỉ vị trí mới nhất được gửi
+        "e2e_delivered_rate": server.positions / n_frames,
+        "e2e_send_errors": float(st["send_errors"]),
+    })
+    return out
+
+
+# ---------- Suite + baseline ----------
+SUITE = {
+    "lm": bench_lm,
+    "lm_tracking": bench_lm_tracking,
+    "kf": bench_kf,
+    "batch": bench_batch,
+    "e2e": bench_e2e,
+}
+
+# Các metric không phải hiệu năng (độ chính xác / bộ đếm) -> chỉ ghi, không so ngưỡng
+INFO_METRICS = ("_ok_rate", "_delivered_rate", "_send_errors")
+
+
+def higher_is_better(name: str) -> bool:
+    return name.endswith("_per_s")
+
+
+def run_suite(names=None, quick: bool = False) -> dict:
+    """Chạy các benchmark -> {"meta": {...}, "metrics": {tên: giá trị}}."""
+    names = list(SUITE) if names is None else list(names)
+    kw = {
+        "lm": {"n": 300 if quick else 2000},
+        "lm_tracking": {"n": 300 if quick else 2000},
+        "kf": {"n": 500 if quick else 5000},
+        "batch": {"tag_counts": (1, 100, 1000) if quick else (1, 10, 100, 1000, 10000),
+                  "repeat": 2 if quick else 5},
+        "e2e": {"n_frames": 50 if quick else 300},
+    }
+    metrics = {}
+    for name in names:
+        metrics.update(SUITE[name](**kw[name]))
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "quick": quick,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "metrics": metrics,
+    }
+
+
+def save_baseline(result: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(metrics: Dict[str, float], baseline: Dict[str, float], threshold: float = 0.2) -> List[dict]:
+    """
+    So với baseline: metric chậm đi quá threshold (tỉ lệ, 0.2 = 20%) -> regression.
+    Latency / số vòng: tăng là xấu; *_per_s: giảm là xấu. Metric mới / thiếu bị bỏ qua.
+    """
+    out = []
+    for name, now in metrics.items():
+        base = baseline.get(name)
+        if base is None or name.endswith(INFO_METRICS) or not (math.isfinite(now) and math.isfinite(base)):
+            continue
+        if base == 0:
+            continue
+        change = (now - base) / abs(base)
+        worse = -change if higher_is_better(name) else change
+        out.append({"name": name, "baseline": base, "value": now, "change": change,
+                    "regression": worse > threshold})
+    return out
+
+
+def format_report(result: dict, comparison: Optional[List[dict]] = None) -> str:
+    cmp = {c["name"]: c for c in comparison or []}
+    lines = []
+    for name, v in result["metrics"].items():
+        line = f"{name:<34} {v:>14.3f}"
+        c = cmp.get(name)
+        if c is not None:
+            line += f"   base {c['baseline']:>14.3f}  {c['change'] * 100:+7.1f}%"
+            if c["regression"]:
+                line += "  << REGRESSION"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Benchmark solver / filter / batch / end-to-end frame")
+    ap.add_argument("only", nargs="*", help=f"chỉ chạy các benchmark này ({', '.join(SUITE)})")
+    ap.add_argument("--baseline", default="bench_baseline.json")
+    ap.add_argument("--save-baseline", action="store_true", help="ghi kết quả làm baseline mới")
+    ap.add_argument("--threshold", type=float, default=0.2, help="ngưỡng regression (0.2 = 20%%)")
+    ap.add_argument("--quick", action="store_true")
+    ap.add_argument("--json", default=None, help="ghi kết quả lần chạy ra file JSON")
+    ap.add_argument("--strategies", action="store_true", help="chỉ so sánh trust-region strategy của LM")
+    args = ap.parse_args()
+    if args.strategies:
+        print(format_strategies(bench_strategies(n=100 if args.quick else 300)))
+        sys.exit(0)
+    unknown = sorted(set(args.only) - set(SUITE))
+    if unknown:
+        ap.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    res = run_suite(args.only or None, quick=args.quick)
+    comparison = None
+    if args.save_baseline:
+        save_baseline(res, args.baseline)
+    else:
+        try:
+            comparison = compare(res["metrics"], load_baseline(args.baseline)["metrics"], args.threshold)
+        except FileNotFoundError:
+            print(f"(no baseline at {args.baseline}; run with --save-baseline)")
+    print(format_report(res, comparison))
+    if args.json:
+        save_baseline(res, args.json)
+
+    regressions = [c["name"] for c in comparison or [] if c["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) > {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
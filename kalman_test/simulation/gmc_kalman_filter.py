@@ -81,7 +81,8 @@ class AdaptiveGMCKalman3D:
             process_var: float = 0.9,     # Cao để tin process mạnh khi có nghi ngờ
             meas_var: float = 0.25,        # Cao để mặc định ít tin measurement
             alpha: float = 1.0,           # Laplace → reject outlier rất mạnh
-            beta_init: float = 1.0        # Kernel rộng ban đầu
+            beta_init: float = 1.0,       # Kernel rộng ban đầu
+            fast_update: bool = False,    # update() -> update_fast() (H = I, R chéo)
     ):
         self.x = np.zeros((3, 1))
         self.P = np.eye(3) * 10.0     # Uncertainty lớn ban đầu để dễ converge
@@ -91,25 +92,43 @@ class AdaptiveGMCKalman3D:
 
         self.alpha = float(alpha)
         self.beta_init = float(beta_init)
+        self.fast_update = bool(fast_update)
 
         self.H = np.eye(3)
         self.I = np.eye(3)
 
+        # cache sqrt(Γ(1/α)/Γ(3/α)), tính lại khi alpha đổi
+        self._ratio_alpha = None
+        self._beta_ratio = None
+
+        self.gated = 0     # số update bị bỏ vì hybrid_cost > hybrid_max_cost
+
     def reset(self, x0: Vec3):
         self.x = vec3_to_np(x0)
         self.P = np.eye(3) * 0.5      # Tin vừa phải vào initial từ Hybrid
 
     def predict(self, dt: float):
-        Q = self.q * dt * np.eye(3)
-        self.P = self.P + Q
+        # P + q*dt*I, cộng thẳng vào đường chéo (không tạo np.eye mỗi frame)
+        self.P.flat[::4] += self.q * dt
 
     def update(
             self,
             meas: Vec3,
             hybrid_cost: Optional[float] = None,
             hybrid_max_cost: float = 2.0,   # Nới lỏng để không bỏ measurement tốt
+    ):
+        if self.fast_update:
+            return self.update_fast(meas, hybrid_cost, hybrid_max_cost)
+        return self._update_full(meas, hybrid_cost, hybrid_max_cost)
+
+    def _update_full(
+            self,
+            meas: Vec3,
+            hybrid_cost: Optional[float] = None,
+            hybrid_max_cost: float = 2.0,
     ):
         if hybrid_cost is not None and hybrid_cost > hybrid_max_cost:
+            self.gated += 1
             return self.get_state_vec3()
 
         z = vec3_to_np(meas)
@@ -152,6 +171,103 @@ class AdaptiveGMCKalman3D:
 
         return self.get_state_vec3()
 
+    def _gamma_beta_ratio(self) -> Optional[float]:
+        if self._ratio_alpha != self.alpha:
+            try:
+                self._beta_ratio = math.sqrt(safe_gamma(1 / self.alpha) / safe_gamma(3 / self.alpha))
+            except Exception:
+                self._beta_ratio = None
+            self._ratio_alpha = self.alpha
+        return self._beta_ratio
+
+    def update_fast(
+            self,
+            meas: Vec3,
+            hybrid_cost: Optional[float] = None,
+            hybrid_max_cost: float = 2.0,
+    ):
+        """
+        Cùng kết quả với update() (sai khác cỡ float) nhưng chuyên biệt cho H = I, R chéo:
+        - tỉ số gamma cache theo alpha, trọng số GMC tính inline
+        - S = P + diag(r/w) nghịch đảo dạng đóng (đối xứng 3x3)
+        - x, P ghi đè tại chỗ, không tạo ma trận trung gian
+        """
+        if hybrid_cost is not None and hybrid_cost > hybrid_max_cost:
+            self.gated += 1
+            return self.get_state_vec3()
+
+        x = self.x
+        (p00, p01, p02), (p10, p11, p12), (p20, p21, p22) = self.P.tolist()
+        x0, x1, x2 = x[0, 0], x[1, 0], x[2, 0]
+        v0, v1, v2 = meas.x - x0, meas.y - x1, meas.z - x2
+
+        # MAD: median của 3 giá trị = tổng - max - min
+        a0, a1, a2 = abs(v0), abs(v1), abs(v2)
+        sigma = (a0 + a1 + a2 - max(a0, a1, a2) - min(a0, a1, a2)) / 0.6745
+        if sigma < 0.1:
+            sigma = 0.1
+
+        ratio = self._gamma_beta_ratio()
+        if ratio is not None:
+            beta = sigma * ratio
+            if beta < 0.3:
+                beta = 0.3
+        else:
+            beta = self.beta_init
+
+        alpha = self.alpha
+        eps = 1e-8
+        r = self.r
+        s00 = p00 + r / (math.exp(-(a0 / beta) ** alpha) + eps)
+        s11 = p11 + r / (math.exp(-(a1 / beta) ** alpha) + eps)
+        s22 = p22 + r / (math.exp(-(a2 / beta) ** alpha) + eps)
+        s01, s02, s12 = p01, p02, p12
+
+        # nghịch đảo đối xứng 3x3 (adjugate)
+        c00 = s11*s22 - s12*s12
+        c01 = s02*s12 - s01*s22
+        c02 = s01*s12 - s02*s11
+        det = s00*c00 + s01*c01 + s02*c02
+        if not det > 1e-300:
+            return self._update_full(meas, hybrid_cost, hybrid_max_cost)
+        inv_det = 1.0 / det
+        i00 = c00 * inv_det
+        i01 = c01 * inv_det
+        i02 = c02 * inv_det
+        i11 = (s00*s22 - s02*s02) * inv_det
+        i12 = (s01*s02 - s00*s12) * inv_det
+        i22 = (s00*s11 - s01*s01) * inv_det
+
+        # K = P S^-1
+        k00 = p00*i00 + p01*i01 + p02*i02
+        k01 = p00*i01 + p01*i11 + p02*i12
+        k02 = p00*i02 + p01*i12 + p02*i22
+        k10 = p10*i00 + p11*i01 + p12*i02
+        k11 = p10*i01 + p11*i11 + p12*i12
+        k12 = p10*i02 + p11*i12 + p12*i22
+        k20 = p20*i00 + p21*i01 + p22*i02
+        k21 = p20*i01 + p21*i11 + p22*i12
+        k22 = p20*i02 + p21*i12 + p22*i22
+
+        x[0, 0] = x0 + (k00*v0 + k01*v1 + k02*v2)
+        x[1, 0] = x1 + (k10*v0 + k11*v1 + k12*v2)
+        x[2, 0] = x2 + (k20*v0 + k21*v1 + k22*v2)
+
+        # P = (I - K) P
+        self.P.flat[:] = (
+            p00 - (k00*p00 + k01*p10 + k02*p20),
+            p01 - (k00*p01 + k01*p11 + k02*p21),
+            p02 - (k00*p02 + k01*p12 + k02*p22),
+            p10 - (k10*p00 + k11*p10 + k12*p20),
+            p11 - (k10*p01 + k11*p11 + k12*p21),
+            p12 - (k10*p02 + k11*p12 + k12*p22),
+            p20 - (k20*p00 + k21*p10 + k22*p20),
+            p21 - (k20*p01 + k21*p11 + k22*p21),
+            p22 - (k20*p02 + k21*p12 + k22*p22),
+        )
+
+        return Vec3(x[0, 0], x[1, 0], x[2, 0])
+
     def get_state_vec3(self) -> Vec3:
         return np_to_vec3(self.x)
 
@@ -213,6 +329,225 @@ class AdaptiveGMCKalman3D:
         return self.get_state_vec3(), debug
 
 
+# ---------- Motion models: RW / CV / CA ----------
+# Trạng thái xếp theo khối [pos(3), vel(3), acc(3)]; mỗi trục độc lập nên
+# F = F1 ⊗ I3, Q = Q1 ⊗ I3 với F1, Q1 là mô hình 1 chiều bậc k.
+#   rw (k=1): random walk vị trí, Q = q dt I (mô hình gốc)
+#   cv (k=2): white-noise acceleration, q = mật độ phổ gia tốc
+#   ca (k=3): white-noise jerk, q = mật độ phổ jerk
+MOTION_MODELS = {"rw": 1, "cv": 2, "ca": 3}
+
+
+def motion_model_matrices(model: str, dt, q):
+    """
+    F, Q cho mô hình chuyển động. dt, q: scalar -> (d,d); (N,) -> (N,d,d).
+    """
+    k = MOTION_MODELS[model]
+    dt = np.asarray(dt, dtype=float)
+    q = np.asarray(q, dtype=float)
+    batch = np.broadcast_shapes(dt.shape, q.shape)
+    dt_b = np.broadcast_to(dt, batch)[..., None, None]
+    q_b = np.broadcast_to(q, batch)[..., None, None]
+
+    i, j = np.meshgrid(np.arange(k), np.arange(k), indexing="ij")
+    # F1[i, j] = dt^(j-i) / (j-i)!  (j >= i)
+    pw = np.maximum(j - i, 0)
+    fact = np.array([math.factorial(int(m)) for m in range(k)], dtype=float)
+    F1 = np.where(j >= i, dt_b ** pw / fact[pw], 0.0)
+
+    # Q1[i, j] = q dt^(pi+pj+1) / ((pi+pj+1) pi! pj!), pi = k-1-i
+    pi, pj = k - 1 - i, k - 1 - j
+    Q1 = q_b * dt_b ** (pi + pj + 1) / ((pi + pj + 1) * fact[pi] * fact[pj])
+
+    eye3 = np.eye(3)
+    d = 3 * k
+    F = np.einsum("...ij,ab->...iajb", F1, eye3).reshape(batch + (d, d))
+    Q = np.einsum("...ij,ab->...iajb", Q1, eye3).reshape(batch + (d, d))
+    return F, Q
+
+
+def _initial_cov_diag(model: str, pos_var: float, vel_var: float, acc_var: float) -> np.ndarray:
+    k = MOTION_MODELS[model]
+    return np.repeat([pos_var, vel_var, acc_var][:k], 3)
+
+
+class AdaptiveGMCKalmanMotion3D(AdaptiveGMCKalman3D):
+    """
+    AdaptiveGMCKalman3D với mô hình chuyển động: "cv" (6 trạng thái) hoặc "ca" (9 trạng thái).
+    Đo vẫn là vị trí (H = [I 0 ...]) với cùng trọng số GMC theo trục; predict
+    đẩy trạng thái đi theo vận tốc / gia tốc nên không "đứng yên" khi mất đo.
+    """
+
+    def __init__(
+            self,
+            process_var: float = 0.9,
+            meas_var: float = 0.25,
+            alpha: float = 1.0,
+            beta_init: float = 1.0,
+            model: str = "cv",
+            vel_var: float = 1.0,     # phương sai ban đầu của vận tốc sau reset
+            acc_var: float = 1.0,     # phương sai ban đầu của gia tốc sau reset
+    ):
+        super().__init__(process_var, meas_var, alpha, beta_init)
+        if model not in MOTION_MODELS:
+            raise ValueError(f"unknown motion model {model!r}, expected one of {list(MOTION_MODELS)}")
+        self.model = model
+        d = 3 * MOTION_MODELS[model]
+        self.x = np.zeros((d, 1))
+        self.P = np.eye(d) * 10.0
+        self.H = np.hstack([np.eye(3), np.zeros((3, d - 3))])
+        self.I = np.eye(d)
+        self.vel_var = float(vel_var)
+        self.acc_var = float(acc_var)
+
+    def reset(self, x0: Vec3, v0: Optional[Vec3] = None):
+        self.x[:] = 0.0
+        self.x[0:3] = vec3_to_np(x0)
+        if v0 is not None:
+            self.x[3:6] = vec3_to_np(v0)
+        self.P = np.diag(_initial_cov_diag(self.model, 0.5, self.vel_var, self.acc_var))
+
+    def predict(self, dt: float):
+        F, Q = motion_model_matrices(self.model, dt, self.q)
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+
+    def update_fast(self, meas: Vec3, hybrid_cost: Optional[float] = None, hybrid_max_cost: float = 2.0):
+        # closed-form 3x3 chỉ áp dụng cho mô hình RW; ở đây dùng update tổng quát
+        return self._update_full(meas, hybrid_cost, hybrid_max_cost)
+
+    def get_velocity_vec3(self) -> Vec3:
+        return np_to_vec3(self.x[3:6])
+
+
+# ---------- Bank N bộ lọc (vector hóa cho nhiều tag) ----------
+class GMCKalmanBank:
+    """
+    N bộ AdaptiveGMCKalman3D chạy song song: x (N,d), P (N,d,d), d = 3 (rw) / 6 (cv) / 9 (ca).
+    predict/update cho cả bank bằng vài phép NumPy batch, giữ nguyên từng tag:
+    MAD sigma, beta adaptive, trọng số GMC theo trục và gating theo hybrid_cost.
+    """
+
+    def __init__(
+            self,
+            n_tags: int,
+            process_var=0.9,
+            meas_var=0.25,
+            alpha: float = 1.0,
+            beta_init: float = 1.0,
+            model: str = "rw",
+            vel_var: float = 1.0,
+            acc_var: float = 1.0,
+    ):
+        if model not in MOTION_MODELS:
+            raise ValueError(f"unknown motion model {model!r}, expected one of {list(MOTION_MODELS)}")
+        self.model = model
+        self.d = 3 * MOTION_MODELS[model]
+        self.n = int(n_tags)
+        self.x = np.zeros((self.n, self.d))
+        self.P = np.broadcast_to(np.eye(self.d) * 10.0, (self.n, self.d, self.d)).copy()
+        self._P0 = np.diag(_initial_cov_diag(model, 0.5, vel_var, acc_var))
+
+        # q, r: scalar hoặc (N,) riêng từng tag
+        self.q = np.broadcast_to(np.asarray(process_var, dtype=float), (self.n,)).copy()
+        self.r = np.broadcast_to(np.asarray(meas_var, dtype=float), (self.n,)).copy()
+
+        self.alpha = float(alpha)
+        self.beta_init = float(beta_init)
+
+        try:
+            self._beta_ratio = math.sqrt(safe_gamma(1 / self.alpha) / safe_gamma(3 / self.alpha))
+        except Exception:
+            self._beta_ratio = None
+
+    def reset(self, x0, idx=None, v0=None):
+        """x0: vị trí (3,) / (N,3) hoặc (len(idx),3); idx: None = cả bank, hoặc chỉ số / mask."""
+        if idx is None:
+            idx = slice(None)
+        x = self.x[idx]
+        x[...] = 0.0
+        x[..., 0:3] = np.asarray(x0, dtype=float)
+        if v0 is not None and self.d > 3:
+            x[..., 3:6] = np.asarray(v0, dtype=float)
+        self.x[idx] = x
+        self.P[idx] = self._P0
+
+    def predict(self, dt, idx=None):
+        """dt: scalar hoặc (N,); idx: chỉ predict một phần bank."""
+        if idx is None:
+            idx = slice(None)
+        if self.model == "rw":
+            q_dt = (self.q * np.broadcast_to(np.asarray(dt, dtype=float), (self.n,)))[idx]
+            P = self.P[idx]
+            P[..., [0, 1, 2], [0, 1, 2]] += q_dt[..., None]
+            self.P[idx] = P
+            return
+
+        dt = np.asarray(dt, dtype=float)
+        dt_i = dt if dt.ndim == 0 else np.broadcast_to(dt, (self.n,))[idx]
+        F, Q = motion_model_matrices(self.model, dt_i, self.q[idx])
+        x = self.x[idx]
+        self.x[idx] = np.einsum("...ij,...j->...i", F, x) if F.ndim == 3 else x @ F.T
+        self.P[idx] = F @ self.P[idx] @ np.swapaxes(F, -1, -2) + Q
+
+    def update(
+            self,
+            meas,
+            hybrid_cost=None,
+            hybrid_max_cost: float = 2.0,
+            mask=None,
+    ):
+        """
+        meas: (N,3); hybrid_cost: None hoặc (N,); mask: (N,) bool - tag có đo ở frame này.
+        Tag bị gate (cost > hybrid_max_cost) hoặc mask=False giữ nguyên trạng thái.
+        Trả về (x (N,d), updated (N,) bool).
+        """
+        upd = np.ones(self.n, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+        if hybrid_cost is not None:
+            upd &= ~(np.asarray(hybrid_cost, dtype=float) > hybrid_max_cost)
+        if not upd.any():
+            return self.x, upd
+
+        x = self.x[upd]
+        P = self.P[upd]
+        v = np.asarray(meas, dtype=float)[upd] - x[:, 0:3]   # innovation (m,3)
+
+        # MAD robust estimator theo từng tag
+        sigma = np.median(np.abs(v), axis=1) / 0.6745
+        sigma = np.maximum(sigma, 0.1)
+
+        if self._beta_ratio is not None:
+            beta = np.maximum(sigma * self._beta_ratio, 0.3)
+        else:
+            beta = np.full_like(sigma, self.beta_init)
+
+        w = np.exp(-(np.abs(v) / beta[:, None]) ** self.alpha)
+
+        eps = 1e-8
+        r_diag = self.r[upd, None] / (w + eps)
+
+        # H = [I 0 ...]: S = P_pp + R, K = P_:p S^-1, P = P - K P_p:
+        S = P[:, 0:3, 0:3].copy()
+        S[:, [0, 1, 2], [0, 1, 2]] += r_diag
+        try:
+            S_inv = np.linalg.inv(S)
+        except np.linalg.LinAlgError:
+            S_inv = np.linalg.pinv(S)
+
+        K = P[:, :, 0:3] @ S_inv
+        self.x[upd] = x + np.einsum("nij,nj->ni", K, v)
+        self.P[upd] = P - K @ P[:, 0:3, :]
+
+        return self.x, upd
+
+    def get_states(self) -> np.ndarray:
+        """Vị trí (N,3)."""
+        return self.x[:, 0:3].copy()
+
+    def get_state_vec3(self, i: int) -> Vec3:
+        return np_to_vec3(self.x[i])
+
+
 # ---------- Demo (giờ sẽ chạy mượt hơn nhiều) ----------
 if __name__ == "__main__":
     import random
@@ -2,8 +2,11 @@ from dataclasses import dataclass
 import math
 import random
 import time
+from functools import lru_cache
 from typing import Sequence, Tuple, Optional
 
+import numpy as np
+
 C0 = 299792458.0
 
 
@@ -31,76 +34,751 @@ def unit(a: Vec3, b: Vec3) -> Vec3:
     return Vec3((a.x - b.x) / d, (a.y - b.y) / d, (a.z - b.z) / d)
 
 
+def anchors_to_array(anchors) -> np.ndarray:
+    """Vec3 list / array-like -> float array (..., K, 3)."""
+    if isinstance(anchors, np.ndarray):
+        return np.asarray(anchors, dtype=float)
+    if len(anchors) > 0 and hasattr(anchors[0], "x"):
+        return np.array([[a.x, a.y, a.z] for a in anchors], dtype=float)
+    return np.asarray(anchors, dtype=float)
+
+
+# ---------- Measurement descriptor ----------
+# Mỗi hàng (i, j): j >= 0 -> TDoA r_i - r_j ; j = -1 (hoặc None) -> range trực tiếp r_i.
+# Layout mặc định 4 anchor: s = [d2, d3, d4, d01, d02]
+HYBRID_MEAS_4 = ((1, 0), (2, 0), (3, 0), (0, -1), (1, -1))
+
+
+def make_measurement_set(n_anchors: int, ref: int = 0, ranges: Sequence[int] = (0, 1)):
+    """TDoA mọi anchor so với ref + các range trực tiếp (n=4 -> HYBRID_MEAS_4)."""
+    rows = [(k, ref) for k in range(n_anchors) if k != ref]
+    rows += [(k, -1) for k in ranges]
+    return tuple(rows)
+
+
+def measurement_index(meas, n_anchors: int):
+    """meas -> (ia, ib) int arrays; ib = -1 trỏ vào hàng 0 phụ của bảng range/unit."""
+    ia = np.array([m[0] for m in meas], dtype=int)
+    ib = np.array([-1 if m[1] is None else m[1] for m in meas], dtype=int)
+    if ia.size == 0:
+        raise ValueError("measurement set is empty")
+    if ia.min() < 0 or ia.max() >= n_anchors or ib.min() < -1 or ib.max() >= n_anchors:
+        raise ValueError(f"measurement set references anchors outside 0..{n_anchors - 1}")
+    return ia, ib
+
+
+def measurement_rows_available(meas, anchor_ok) -> np.ndarray:
+    """Mask (M,) các hàng chỉ dùng anchor còn nhận được (anchor_ok: (K,) bool)."""
+    anchor_ok = np.asarray(anchor_ok, dtype=bool)
+    return np.array(
+        [anchor_ok[i] and (j is None or j < 0 or anchor_ok[j]) for i, j in meas],
+        dtype=bool,
+    )
+
+
 # ---------- Solve 3x3 linear system ----------
 
-def solve_3x3(A, b):
+def solve_3x3_into(A, b, out):
+    """Như solve_3x3 nhưng ghi nghiệm vào buffer out (len 3), không cấp phát list."""
+    a00, a01, a02 = A[0][0], A[0][1], A[0][2]
+    a10, a11, a12 = A[1][0], A[1][1], A[1][2]
+    a20, a21, a22 = A[2][0], A[2][1], A[2][2]
+
     det = (
-        A[0][0]*(A[1][1]*A[2][2] - A[1][2]*A[2][1])
-        - A[0][1]*(A[1][0]*A[2][2] - A[1][2]*A[2][0])
-        + A[0][2]*(A[1][0]*A[2][1] - A[1][1]*A[2][0])
+        a00*(a11*a22 - a12*a21)
+        - a01*(a10*a22 - a12*a20)
+        + a02*(a10*a21 - a11*a20)
     )
 
     if abs(det) < 1e-12:
-        return [0.0, 0.0, 0.0]
+        out[0] = 0.0
+        out[1] = 0.0
+        out[2] = 0.0
+        return out
 
     inv_det = 1.0 / det
-    inv = [[0.0]*3 for _ in range(3)]
 
-    inv[0][0] =  (A[1][1]*A[2][2] - A[1][2]*A[2][1]) * inv_det
-    inv[0][1] = -(A[0][1]*A[2][2] - A[0][2]*A[2][1]) * inv_det
-    inv[0][2] =  (A[0][1]*A[1][2] - A[0][2]*A[1][1]) * inv_det
+    i00 =  (a11*a22 - a12*a21) * inv_det
+    i01 = -(a01*a22 - a02*a21) * inv_det
+    i02 =  (a01*a12 - a02*a11) * inv_det
 
-    inv[1][0] = -(A[1][0]*A[2][2] - A[1][2]*A[2][0]) * inv_det
-    inv[1][1] =  (A[0][0]*A[2][2] - A[0][2]*A[2][0]) * inv_det
-    inv[1][2] = -(A[0][0]*A[1][2] - A[0][2]*A[1][0]) * inv_det
+    i10 = -(a10*a22 - a12*a20) * inv_det
+    i11 =  (a00*a22 - a02*a20) * inv_det
+    i12 = -(a00*a12 - a02*a10) * inv_det
 
-    inv[2][0] =  (A[1][0]*A[2][1] - A[1][1]*A[2][0]) * inv_det
-    inv[2][1] = -(A[0][0]*A[2][1] - A[0][1]*A[2][0]) * inv_det
-    inv[2][2] =  (A[0][0]*A[1][1] - A[0][1]*A[1][0]) * inv_det
+    i20 =  (a10*a21 - a11*a20) * inv_det
+    i21 = -(a00*a21 - a01*a20) * inv_det
+    i22 =  (a00*a11 - a01*a10) * inv_det
 
-    x = [
-        inv[0][0]*b[0] + inv[0][1]*b[1] + inv[0][2]*b[2],
-        inv[1][0]*b[0] + inv[1][1]*b[1] + inv[1][2]*b[2],
-        inv[2][0]*b[0] + inv[2][1]*b[1] + inv[2][2]*b[2],
-    ]
-    return x
+    b0, b1, b2 = b[0], b[1], b[2]
+    out[0] = i00*b0 + i01*b1 + i02*b2
+    out[1] = i10*b0 + i11*b1 + i12*b2
+    out[2] = i20*b0 + i21*b1 + i22*b2
+    return out
+
+
+def solve_3x3(A, b):
+    return solve_3x3_into(A, b, [0.0, 0.0, 0.0])
 
 
 # ---------- Residual + Jacobian ----------
 
-def residual_and_jacobian_s(anchors, s, x: Vec3):
-    x1, x2, x3, x4 = anchors
+def residual_and_jacobian_into(A, s, x, f, J):
+    """
+    Kernel mảng cho residual + Jacobian, mỗi khoảng cách chỉ tính 1 lần.
+
+    A: anchors dạng (4,3) (ndarray hoặc list lồng), x: (3,)
+    f: buffer (5,), J: buffer (5,3) do caller cấp sẵn - ghi đè tại chỗ.
+    """
+    px, py, pz = x[0], x[1], x[2]
     d2, d3, d4, d01, d02 = s
 
-    r1 = dist(x, x1)
-    r2 = dist(x, x2)
-    r3 = dist(x, x3)
-    r4 = dist(x, x4)
-
-    f = [
-        (r2 - r1) - d2,
-        (r3 - r1) - d3,
-        (r4 - r1) - d4,
-        r1 - d01,
-        r2 - d02
-    ]
-
-    u1 = unit(x, x1)
-    u2 = unit(x, x2)
-    u3 = unit(x, x3)
-    u4 = unit(x, x4)
-
-    J = [
-        [u2.x - u1.x, u2.y - u1.y, u2.z - u1.z],
-        [u3.x - u1.x, u3.y - u1.y, u3.z - u1.z],
-        [u4.x - u1.x, u4.y - u1.y, u4.z - u1.z],
-        [u1.x, u1.y, u1.z],
-        [u2.x, u2.y, u2.z],
-    ]
+    a = A[0]
+    dx1, dy1, dz1 = px - a[0], py - a[1], pz - a[2]
+    r1 = math.sqrt(dx1*dx1 + dy1*dy1 + dz1*dz1)
+    a = A[1]
+    dx2, dy2, dz2 = px - a[0], py - a[1], pz - a[2]
+    r2 = math.sqrt(dx2*dx2 + dy2*dy2 + dz2*dz2)
+    a = A[2]
+    dx3, dy3, dz3 = px - a[0], py - a[1], pz - a[2]
+    r3 = math.sqrt(dx3*dx3 + dy3*dy3 + dz3*dz3)
+    a = A[3]
+    dx4, dy4, dz4 = px - a[0], py - a[1], pz - a[2]
+    r4 = math.sqrt(dx4*dx4 + dy4*dy4 + dz4*dz4)
+
+    f[0] = (r2 - r1) - d2
+    f[1] = (r3 - r1) - d3
+    f[2] = (r4 - r1) - d4
+    f[3] = r1 - d01
+    f[4] = r2 - d02
+
+    # unit(x, a_k); trùng anchor -> 0 như unit()
+    if r1 < 1e-12:
+        ux1 = uy1 = uz1 = 0.0
+    else:
+        ux1, uy1, uz1 = dx1 / r1, dy1 / r1, dz1 / r1
+    if r2 < 1e-12:
+        ux2 = uy2 = uz2 = 0.0
+    else:
+        ux2, uy2, uz2 = dx2 / r2, dy2 / r2, dz2 / r2
+    if r3 < 1e-12:
+        ux3 = uy3 = uz3 = 0.0
+    else:
+        ux3, uy3, uz3 = dx3 / r3, dy3 / r3, dz3 / r3
+    if r4 < 1e-12:
+        ux4 = uy4 = uz4 = 0.0
+    else:
+        ux4, uy4, uz4 = dx4 / r4, dy4 / r4, dz4 / r4
+
+    g = J[0]
+    g[0], g[1], g[2] = ux2 - ux1, uy2 - uy1, uz2 - uz1
+    g = J[1]
+    g[0], g[1], g[2] = ux3 - ux1, uy3 - uy1, uz3 - uz1
+    g = J[2]
+    g[0], g[1], g[2] = ux4 - ux1, uy4 - uy1, uz4 - uz1
+    g = J[3]
+    g[0], g[1], g[2] = ux1, uy1, uz1
+    g = J[4]
+    g[0], g[1], g[2] = ux2, uy2, uz2
 
     return f, J
 
 
+def residual_and_jacobian_meas(A, s, x, idx, f, J):
+    """
+    Kernel tổng quát cho K anchor / M phép đo, không có vòng lặp Python theo hàng.
+
+    A: (K,3) ndarray, s: (M,), x: (3,), idx = measurement_index(meas, K)
+    f: buffer (M,), J: buffer (M,3).
+    """
+    ia, ib = idx
+    K = A.shape[0]
+
+    # bảng range/unit có thêm 1 hàng 0 ở cuối cho các phép đo range (ib = -1)
+    U = np.zeros((K + 1, 3))
+    r = np.zeros(K + 1)
+    inv = np.zeros(K + 1)
+    D = U[:K]
+    np.subtract(x, A, out=D)
+    np.sqrt(np.einsum("ki,ki->k", D, D), out=r[:K])
+    np.divide(1.0, r, out=inv, where=r >= 1e-12)  # unit = 0 khi trùng anchor
+    D *= inv[:K, None]
+
+    np.subtract(r[ia], r[ib], out=f)
+    f -= s
+    np.subtract(U[ia], U[ib], out=J)
+    return f, J
+
+
+def residual_and_jacobian_s(anchors, s, x: Vec3, meas=None):
+    if meas is None and len(anchors) == 4:
+        A = [(a.x, a.y, a.z) for a in anchors]
+        f = [0.0] * 5
+        J = [[0.0, 0.0, 0.0] for _ in range(5)]
+        return residual_and_jacobian_into(A, s, (x.x, x.y, x.z), f, J)
+
+    A = anchors_to_array(anchors)
+    if meas is None:
+        meas = make_measurement_set(A.shape[0])
+    idx = measurement_index(meas, A.shape[0])
+    f = np.empty(len(meas))
+    J = np.empty((len(meas), 3))
+    residual_and_jacobian_meas(A, np.asarray(s, dtype=float), np.array([x.x, x.y, x.z]), idx, f, J)
+    return f.tolist(), J.tolist()
+
+
+def _normal_equations_5(J, f, lam, JTJ, rhs):
+    """JTJ + lam*I và -JTf cho 5 hàng (list buffers)."""
+    j00 = j01 = j02 = j11 = j12 = j22 = 0.0
+    b0 = b1 = b2 = 0.0
+
+    for i in range(5):
+        g0, g1, g2 = J[i]
+        fi = f[i]
+
+        j00 += g0*g0
+        j01 += g0*g1
+        j02 += g0*g2
+        j11 += g1*g1
+        j12 += g1*g2
+        j22 += g2*g2
+
+        b0 += g0*fi
+        b1 += g1*fi
+        b2 += g2*fi
+
+    row = JTJ[0]
+    row[0], row[1], row[2] = j00 + lam, j01, j02
+    row = JTJ[1]
+    row[0], row[1], row[2] = j01, j11 + lam, j12
+    row = JTJ[2]
+    row[0], row[1], row[2] = j02, j12, j22 + lam
+    rhs[0], rhs[1], rhs[2] = -b0, -b1, -b2
+
+
+def _normal_equations_np(J, f, lam, JTJ, rhs):
+    """Như _normal_equations_5 nhưng cho M hàng bất kỳ (ndarray J, f)."""
+    (j00, j01, j02), (_, j11, j12), (_, _, j22) = (J.T @ J).tolist()
+    b0, b1, b2 = (J.T @ f).tolist()
+
+    row = JTJ[0]
+    row[0], row[1], row[2] = j00 + lam, j01, j02
+    row = JTJ[1]
+    row[0], row[1], row[2] = j01, j11 + lam, j12
+    row = JTJ[2]
+    row[0], row[1], row[2] = j02, j12, j22 + lam
+    rhs[0], rhs[1], rhs[2] = -b0, -b1, -b2
+
+
+def _sumsq5(f):
+    return f[0]*f[0] + f[1]*f[1] + f[2]*f[2] + f[3]*f[3] + f[4]*f[4]
+
+
+def _sumsq_np(f):
+    return float(f @ f)
+
+
+# ---------- Closed-form initial guess (linearized multilateration) ----------
+#
+# |x - a_k|^2 = r_k^2 trừ cho phương trình anchor tham chiếu a_0 ->
+#     2 (a_k - a_0) . x = r_0^2 - r_k^2 + |a_k|^2 - |a_0|^2        (G x = b)
+# G chỉ phụ thuộc anchors -> pseudo-inverse được cache theo bộ anchor.
+# Anchor (gần) đồng phẳng -> G thiếu hạng theo pháp tuyến n: x = x_p + t n,
+# t lấy từ mặt cầu quanh a_0, chọn nghiệm có z thấp hơn (dưới trần).
+# Không bao giờ trả điểm nằm đúng mặt phẳng anchor: ở đó J theo z = 0 và LM kẹt lại.
+LINEAR_INIT_MIN_OFFPLANE = 0.1
+
+def _ranges_from_meas(S, meas, K):
+    """
+    Khôi phục range r_k (n,K) từ s: range trực tiếp trước, rồi lan qua các hàng
+    TDoA nối với anchor đã biết (r_i = d + r_j). Trả về (R, known (K,) bool).
+    """
+    n = S.shape[0]
+    R = np.zeros((n, K))
+
+    cnt = np.zeros(K)
+    for row, (i, j) in enumerate(meas):
+        if j is None or j < 0:
+            R[:, i] += S[:, row]
+            cnt[i] += 1
+    direct = cnt > 0
+    R[:, direct] /= cnt[direct]
+    known = direct.copy()
+
+    # anchor có range trực tiếp + TDoA tới anchor range trực tiếp khác -> trung bình
+    acc = np.zeros((n, K))
+    cnt_t = np.zeros(K)
+    for row, (i, j) in enumerate(meas):
+        if j is not None and j >= 0 and direct[i] and direct[j]:
+            acc[:, i] += S[:, row] + R[:, j]
+            cnt_t[i] += 1
+    upd = cnt_t > 0
+    R[:, upd] = (R[:, upd] * cnt[upd] + acc[:, upd]) / (cnt[upd] + cnt_t[upd])
+
+    progress = True
+    while progress:
+        progress = False
+        acc = np.zeros((n, K))
+        cnt = np.zeros(K)
+        for row, (i, j) in enumerate(meas):
+            if j is None or j < 0:
+                continue
+            if known[j] and not known[i]:
+                acc[:, i] += S[:, row] + R[:, j]
+                cnt[i] += 1
+            elif known[i] and not known[j]:
+                acc[:, j] += R[:, i] - S[:, row]
+                cnt[j] += 1
+        new = cnt > 0
+        if new.any():
+            R[:, new] = acc[:, new] / cnt[new]
+            known |= new
+            progress = True
+
+    return R, known
+
+
+def _pinv_rank(G, rcond):
+    """
+    Pseudo-inverse cắt hạng của G (..., m, 3) qua SVD.
+    Trả về (Pinv (...,3,m), null (...,3) = hướng kém xác định nhất, rank (...)).
+    """
+    # full_matrices: với m = 2 (chỉ 3 range) Vt vẫn đủ 3 hàng -> có hướng null
+    U, sv, Vt = np.linalg.svd(G, full_matrices=True)
+    k = sv.shape[-1]
+    keep = sv > rcond * sv[..., :1]
+    inv_sv = np.where(keep, 1.0 / np.where(keep, sv, 1.0), 0.0)
+    Pinv = np.einsum("...ki,...k,...mk->...im", Vt[..., :k, :], inv_sv, U[..., :, :k])
+    return Pinv, Vt[..., 2, :], keep.sum(axis=-1)
+
+
+def _linear_system(A, ks):
+    """G (..., m, 3) và hằng số c_k = |a_k|^2 - |a_0|^2 cho các anchor ks."""
+    a0 = A[..., ks[0], :]
+    ak = A[..., list(ks[1:]), :]
+    G = 2.0 * (ak - a0[..., None, :])
+    c = np.einsum("...mi,...mi->...m", ak, ak) - np.einsum("...i,...i->...", a0, a0)[..., None]
+    return G, c
+
+
+@lru_cache(maxsize=64)
+def _linear_init_plan(anchor_rows: tuple, ks: tuple, rcond: float):
+    """Cache theo bộ anchor: (a0, Pinv, c, null, deficient) dạng list Python."""
+    A = np.array(anchor_rows, dtype=float)
+    G, c = _linear_system(A, ks)
+    Pinv, null, rank = _pinv_rank(G, rcond)
+    return (
+        A[ks[0]].tolist(),
+        Pinv.tolist(),
+        c.tolist(),
+        null.tolist(),
+        int(rank) == 2,
+        int(rank) >= 2,
+    )
+
+
+def _sphere_root(xp, nv, a0, r0, up=(0.0, 0.0, 1.0)):
+    """x = xp + t n nằm trên mặt cầu |x - a0| = r0, chọn nghiệm thấp hơn theo trục cao up."""
+    d0 = xp - a0
+    bh = np.einsum("...i,...i->...", nv, d0)
+    c = np.einsum("...i,...i->...", d0, d0) - r0 * r0
+    root = np.maximum(np.sqrt(np.maximum(bh * bh - c, 0.0)), LINEAR_INIT_MIN_OFFPLANE)
+    t1, t2 = -bh + root, -bh - root
+    nu = nv @ np.asarray(up, dtype=float)
+    t = np.where(t1 * nu <= t2 * nu, t1, t2)
+    return xp + t[..., None] * nv
+
+
+def hybrid_linear_init_batch(anchors, S, meas=None, rcond: float = 0.05, up=(0.0, 0.0, 1.0)):
+    """
+    Điểm khởi tạo dạng đóng cho N tag (1 phép giải tuyến tính nhỏ mỗi tag).
+
+    rcond: ngưỡng singular value tương đối để coi anchor là đồng phẳng.
+    up:    trục cao của hệ tọa độ; anchor đồng phẳng -> lấy nghiệm phía dưới mặt phẳng anchor theo up
+           (vd. (0, 1, 0) khi y là trục cao như main.py).
+    Trả về (X (N,3), valid (N,) bool); valid=False khi không đủ range để tuyến tính hóa.
+    """
+    A = anchors_to_array(anchors)
+    K = A.shape[-2]
+    if meas is None:
+        meas = make_measurement_set(K)
+    S = np.asarray(S, dtype=float).reshape(-1, len(meas))
+    n = S.shape[0]
+
+    R, known = _ranges_from_meas(S, meas, K)
+    ks = tuple(int(k) for k in np.nonzero(known)[0])
+    if len(ks) < 3:
+        return np.zeros((n, 3)), np.zeros(n, dtype=bool)
+
+    if A.ndim == 2:
+        a0_l, Pinv_l, c_l, null_l, deficient, ok = _linear_init_plan(
+            tuple(map(tuple, A.tolist())), ks, rcond
+        )
+        a0 = np.broadcast_to(np.array(a0_l), (n, 3))
+        Pinv = np.array(Pinv_l)
+        b = R[:, ks[0]:ks[0] + 1] ** 2 - R[:, list(ks[1:])] ** 2 + np.array(c_l)
+        X = b @ Pinv.T
+        deficient = np.full(n, deficient)
+        valid = np.full(n, ok)
+        null = np.broadcast_to(np.array(null_l), (n, 3))
+    else:
+        G, c = _linear_system(A, ks)
+        Pinv, null, rank = _pinv_rank(G, rcond)
+        a0 = A[:, ks[0], :]
+        b = R[:, ks[0]:ks[0] + 1] ** 2 - R[:, list(ks[1:])] ** 2 + c
+        X = np.einsum("nim,nm->ni", Pinv, b)
+        deficient = rank == 2
+        valid = rank >= 2
+
+    if deficient.any():
+        X[deficient] = _sphere_root(X[deficient], null[deficient], a0[deficient], R[deficient, ks[0]], up)
+
+    return X, valid
+
+
+def hybrid_linear_init(anchors, s, meas=None, rcond: float = 0.05, up=(0.0, 0.0, 1.0)) -> Optional[Vec3]:
+    """Bản 1 tag của hybrid_linear_init_batch (Python thuần); None nếu không tuyến tính hóa được."""
+    A = anchors_to_array(anchors)
+    K = A.shape[0]
+
+    if meas is None and K == 4:
+        d2, d3, d4, d01, d02 = s
+        r = (d01, 0.5 * (d02 + d2 + d01), d3 + d01, d4 + d01)
+        ks = (0, 1, 2, 3)
+    else:
+        if meas is None:
+            meas = make_measurement_set(K)
+        R, known = _ranges_from_meas(np.asarray(s, dtype=float).reshape(1, -1), meas, K)
+        ks = tuple(int(k) for k in np.nonzero(known)[0])
+        if len(ks) < 3:
+            return None
+        r = R[0].tolist()
+
+    a0, Pinv, c, null, deficient, ok = _linear_init_plan(tuple(map(tuple, A.tolist())), ks, rcond)
+    if not ok:
+        return None
+
+    r0 = r[ks[0]]
+    b = [r0*r0 - r[k]*r[k] + ck for k, ck in zip(ks[1:], c)]
+    x = [sum(p*bk for p, bk in zip(row, b)) for row in Pinv]
+
+    if deficient:
+        nx, ny, nz = null
+        dx, dy, dz = x[0] - a0[0], x[1] - a0[1], x[2] - a0[2]
+        bh = nx*dx + ny*dy + nz*dz
+        root = max(math.sqrt(max(bh*bh - (dx*dx + dy*dy + dz*dz - r0*r0), 0.0)),
+                   LINEAR_INIT_MIN_OFFPLANE)
+        t1, t2 = -bh + root, -bh - root
+        nu = nx*up[0] + ny*up[1] + nz*up[2]
+        t = t1 if t1*nu <= t2*nu else t2
+        x = [x[0] + t*nx, x[1] + t*ny, x[2] + t*nz]
+
+    return Vec3(x[0], x[1], x[2])
+
+
+# ---------- LM diagnostics (opt-in) ----------
+
+class LMDiagnostics:
+    """
+    Truyền vào hybrid_solve_LM(..., diag=d) để xem bên trong solver (giống update_debug của Kalman):
+    - trace lần giải gần nhất, mảng cấp sẵn `capacity` vòng: lam, cost (chi2 ứng viên), step (trước khi cắt),
+      accepted, clipped (chạm max_step), z_clamped (bị kéo về [z_min, z_max])
+    - reason: "step" | "res" | "lam" (lambda > 1e7) | "max_iter"; rescued: nhận nghiệm nhờ cost < 0.05
+    - bộ đếm cộng dồn qua mọi lần giải -> summary() để chỉnh lambda_init / max_step / tol_*
+    1 object dùng lại cho nhiều lần giải, không cấp phát thêm trong vòng lặp.
+    """
+
+    REASONS = ("step", "res", "lam", "max_iter")
+    INITS = ("linear", "midpoint", "given")
+
+    def __init__(self, capacity: int = 120):
+        self.capacity = int(capacity)
+        self.lam = np.zeros(self.capacity)
+        self.cost = np.zeros(self.capacity)
+        self.step_norm = np.zeros(self.capacity)
+        self.accepted = np.zeros(self.capacity, dtype=bool)
+        self.clipped = np.zeros(self.capacity, dtype=bool)
+        self.z_clamped = np.zeros(self.capacity, dtype=bool)
+        self.iter_hist = np.zeros(self.capacity + 1, dtype=np.int64)   # bin cuối: >= capacity
+        self.reset_counters()
+        self.n = 0
+        self.init = None
+        self.cost0 = 0.0
+        self.reason = None
+        self.rescued = False
+
+    def reset_counters(self) -> None:
+        self.solves = 0
+        self.iterations = 0
+        self.evals = 0            # số bước ứng viên đã tính residual
+        self.rejected = 0
+        self.clip_hits = 0
+        self.z_clamps = 0
+        self.rescues = 0
+        self.not_converged = 0
+        self.truncated = 0        # số lần trace vượt capacity
+        self.reasons = dict.fromkeys(self.REASONS, 0)
+        self.inits = dict.fromkeys(self.INITS, 0)
+        self.iter_hist[:] = 0
+
+    # ----- gọi từ hybrid_solve_LM -----
+    def begin(self, init_kind: str, cost0: float) -> None:
+        self.n = 0
+        self.init = init_kind
+        self.cost0 = cost0
+        self.reason = None
+        self.rescued = False
+
+    def step(self, lam, cost, step_norm, accepted, clipped, z_clamped) -> None:
+        i = self.n
+        if i < self.capacity:
+            self.lam[i] = lam
+            self.cost[i] = cost
+            self.step_norm[i] = step_norm
+            self.accepted[i] = accepted
+            self.clipped[i] = clipped
+            self.z_clamped[i] = z_clamped
+        self.n = i + 1
+        self.evals += 1
+        self.rejected += not accepted
+        self.clip_hits += clipped
+        self.z_clamps += z_clamped
+
+    def end(self, iterations: int, converged: bool, reason: str, rescued: bool, cost: float) -> None:
+        self.reason = reason
+        self.rescued = rescued
+        self.solves += 1
+        self.iterations += iterations
+        self.iter_hist[min(iterations, self.capacity)] += 1
+        self.reasons[reason] += 1
+        self.inits[self.init] += 1
+        self.rescues += rescued
+        self.not_converged += not converged
+        self.truncated += self.n > self.capacity
+
+    # ----- đọc kết quả -----
+    def trace(self) -> dict:
+        """Bản copy trace của lần giải gần nhất (tối đa capacity vòng)."""
+        n = min(self.n, self.capacity)
+        return {
+            "init": self.init,
+            "cost0": self.cost0,
+            "reason": self.reason,
+            "rescued": self.rescued,
+            "lam": self.lam[:n].copy(),
+            "cost": self.cost[:n].copy(),
+            "step": self.step_norm[:n].copy(),
+            "accepted": self.accepted[:n].copy(),
+            "clipped": self.clipped[:n].copy(),
+            "z_clamped": self.z_clamped[:n].copy(),
+        }
+
+    def iter_percentile(self, q: float) -> float:
+        if self.solves == 0:
+            return 0.0
+        k = int(np.searchsorted(np.cumsum(self.iter_hist), q / 100.0 * self.solves))
+        return float(min(k, self.capacity))
+
+    def summary(self) -> dict:
+        n = max(self.solves, 1)
+        ev = max(self.evals, 1)
+        return {
+            "solves": self.solves,
+            "it_mean": self.iterations / n,
+            "it_p50": self.iter_percentile(50),
+            "it_p95": self.iter_percentile(95),
+            "it_p99": self.iter_percentile(99),
+            "it_max": float(np.flatnonzero(self.iter_hist)[-1]) if self.solves else 0.0,
+            "rejected_per_solve": self.rejected / n,
+            "reject_rate": self.rejected / ev,
+            "clip_rate": self.clip_hits / ev,
+            "z_clamp_rate": self.z_clamps / ev,
+            "rescue_rate": self.rescues / n,
+            "not_converged_rate": self.not_converged / n,
+            "reasons": dict(self.reasons),
+            "inits": dict(self.inits),
+        }
+
+
+# ---------- Trust-region strategies ----------
+#
+# "lm"      : lịch lambda cố định (x0.7 khi nhận, x2 khi bỏ) + cắt bước ở max_step (mặc định)
+# "nielsen" : mu = lambda_init * max diag(JTJ), cập nhật theo tỉ số gain rho
+#             (nhận: mu *= max(1/3, 1 - (2 rho - 1)^3), nu = 2; bỏ: mu *= nu, nu *= 2) - không cắt bước
+# "dogleg"  : Powell dogleg giữa bước Gauss-Newton và steepest descent, bán kính Delta theo rho
+# geodesic  : bước LM v + 0.5 a, a = -(JTJ + mu I)^-1 J^T f_vv (đạo hàm bậc 2 theo hướng v, sai phân hữu hạn);
+#             bỏ bước khi 2|a|/|v| > GEODESIC_ALPHA
+TR_STRATEGIES = ("lm", "nielsen", "dogleg")
+GEODESIC_ALPHA = 0.75
+GEODESIC_FD_H = 0.1
+
+
+def _dogleg_step(JTJ, g, radius):
+    """Bước dogleg trong bán kính radius. Trả về (h, |bước Gauss-Newton|)."""
+    try:
+        h_gn = np.linalg.solve(JTJ, -g)
+        gn_norm = math.sqrt(h_gn @ h_gn)
+    except np.linalg.LinAlgError:
+        h_gn, gn_norm = None, math.inf
+    if gn_norm <= radius:
+        return h_gn, gn_norm
+
+    g_norm = math.sqrt(g @ g)
+    if g_norm < 1e-300:
+        return np.zeros(3), gn_norm
+    gJg = g @ JTJ @ g
+    alpha = g_norm * g_norm / gJg if gJg > 0 else radius / g_norm
+    if h_gn is None or alpha * g_norm >= radius:
+        return -(radius / g_norm) * g, gn_norm
+
+    h_sd = -alpha * g
+    d = h_gn - h_sd
+    a, b, c = d @ d, 2.0 * (h_sd @ d), h_sd @ h_sd - radius * radius
+    beta = (-b + math.sqrt(max(b * b - 4.0 * a * c, 0.0))) / (2.0 * a)
+    return h_sd + beta * d, gn_norm
+
+
+def _solve_trust_region(A, s, meas, x0, strategy, geodesic, max_iter, lambda_init,
+                        tol_step, tol_res, z_min, z_max, max_step, diag, init_kind):
+    """
+    Vòng lặp chung cho các strategy khác "lm" thuần (NumPy, K anchor bất kỳ).
+    Cùng quy ước với hybrid_solve_LM: z kéo mềm về [z_min, z_max], dừng khi bước thực đi
+    < tol_step (dogleg: cả khi bán kính co dưới tol_step) hoặc cost < tol_res, rescue khi cost < 0.05.
+    Cột lam của diag: mu, hoặc Delta với dogleg.
+    """
+    K = A.shape[0]
+    if meas is None:
+        meas = make_measurement_set(K)
+    idx = measurement_index(meas, K)
+    s = np.asarray(s, dtype=float)
+    if s.shape != (len(meas),):
+        raise ValueError(f"s has {s.size} values, measurement set has {len(meas)} rows")
+    M = len(meas)
+
+    x = np.array(x0, dtype=float)
+    f, J = np.empty(M), np.empty((M, 3))
+    f_new, J_new = np.empty(M), np.empty((M, 3))
+    f_fd, J_fd = np.empty(M), np.empty((M, 3))
+    eye3 = np.eye(3)
+
+    residual_and_jacobian_meas(A, s, x, idx, f, J)
+    chi2 = float(f @ f)
+    JTJ, g = J.T @ J, J.T @ f
+
+    lam = lambda_init
+    if strategy == "nielsen":
+        lam = lambda_init * max(float(JTJ.diagonal().max()), 1e-12)
+    nu = 2.0
+    radius = max_step
+
+    converged = False
+    reason = "max_iter"
+    if diag is not None:
+        diag.begin(init_kind, chi2)
+
+    for it in range(max_iter):
+        clipped = False
+        geo_ok = True
+        if strategy == "dogleg":
+            h, gn_norm = _dogleg_step(JTJ, g, radius)
+            step_norm = math.sqrt(h @ h)
+            clipped = gn_norm > radius
+        else:
+            Aug = JTJ + lam * eye3
+            try:
+                h = np.linalg.solve(Aug, -g)
+            except np.linalg.LinAlgError:
+                reason = "lam"
+                break
+            step_norm = math.sqrt(h @ h)
+            if geodesic and step_norm >= tol_step:
+                # f_vv ~ 2/hfd * ((f(x + hfd v) - f(x)) / hfd - J v)
+                hfd = GEODESIC_FD_H
+                residual_and_jacobian_meas(A, s, x + hfd * h, idx, f_fd, J_fd)
+                fvv = (2.0 / hfd) * ((f_fd - f) / hfd - J @ h)
+                acc = np.linalg.solve(Aug, -(J.T @ fvv))
+                geo_ok = 2.0 * math.sqrt(acc @ acc) <= GEODESIC_ALPHA * step_norm
+                if geo_ok:
+                    h = h + 0.5 * acc
+            if strategy == "lm":
+                # cắt sau khi cộng gia tốc -> bước v + a/2 cũng nằm trong max_step
+                h_norm = math.sqrt(h @ h)
+                if h_norm > max_step:
+                    h *= max_step / h_norm
+                    clipped = True
+
+        if step_norm < tol_step:
+            converged = True
+            reason = "step"
+            break
+
+        cand = x + h
+        cz = cand[2]
+        if cz < z_min:
+            cz = (cz + z_min) * 0.5
+        if cz > z_max:
+            cz = (cz + z_max) * 0.5
+        z_clamped = cz != cand[2]
+        cand[2] = cz
+
+        if geo_ok:
+            residual_and_jacobian_meas(A, s, cand, idx, f_new, J_new)
+            chi2_new = float(f_new @ f_new)
+        else:
+            chi2_new = math.inf
+        accepted = chi2_new < chi2
+
+        if diag is not None:
+            diag.step(radius if strategy == "dogleg" else lam, chi2_new, step_norm, accepted, clipped, z_clamped)
+
+        if strategy != "lm" and accepted:
+            dx = cand - x
+            pred = -(2.0 * (g @ dx) + dx @ JTJ @ dx)     # giảm chi2 theo mô hình tuyến tính
+            rho = (chi2 - chi2_new) / pred if pred > 0 else 0.0
+
+        if accepted:
+            x, cand = cand, x
+            f, f_new = f_new, f
+            J, J_new = J_new, J
+            chi2 = chi2_new
+            JTJ, g = J.T @ J, J.T @ f
+            if chi2 < tol_res:
+                converged = True
+                reason = "res"
+                break
+
+        if strategy == "lm":
+            lam = max(lam * 0.7, 1e-7) if accepted else lam * 2.0
+            if lam > 1e7:
+                reason = "lam"
+                break
+        elif strategy == "nielsen":
+            if accepted:
+                lam *= max(1.0 / 3.0, 1.0 - (2.0 * rho - 1.0) ** 3)
+                lam = max(lam, 1e-12)
+                nu = 2.0
+            else:
+                lam *= nu
+                nu *= 2.0
+                if lam > 1e7:
+                    reason = "lam"
+                    break
+        elif accepted and rho > 0.75:
+            radius = max(radius, 3.0 * step_norm)
+        elif not accepted or rho < 0.25:
+            radius = 0.5 * step_norm       # bước kế tiếp < tol_step -> dừng "step"
+
+    est = Vec3(float(x[0]), float(x[1]), float(x[2]))
+    if not converged and chi2 < 0.05:
+        if diag is not None:
+            diag.end(max_iter, True, reason, True, chi2)
+        return est, max_iter, True, chi2
+
+    if diag is not None:
+        diag.end(it + 1, converged, reason, False, chi2)
+    return est, it + 1, converged, chi2
+
+
 # ---------- LM Solver ----------
 
 def hybrid_solve_LM(
@@ -113,83 +791,143 @@ def hybrid_solve_LM(
     tol_res: float = 1e-6,
     z_min: float = 0.2,
     z_max: float = 3.5,
+    meas=None,
+    max_step: float = 0.25,
+    diag=None,
+    strategy: str = "lm",
+    geodesic: bool = False,
+    up=(0.0, 0.0, 1.0),
 ):
+    """
+    meas: None -> layout 4 anchor mặc định (HYBRID_MEAS_4), hoặc danh sách
+          (i, j) cho K anchor bất kỳ (xem make_measurement_set).
+    max_step: bán kính trust region (m) - bước dài hơn bị co lại
+              (strategy="dogleg": bán kính ban đầu, sau đó tự co / giãn)
+    diag: LMDiagnostics (tùy chọn) - ghi lambda / cost / bước từng vòng + bộ đếm tổng
+    strategy: "lm" (lambda x0.7 / x2 + cắt max_step), "nielsen", "dogleg" - xem _solve_trust_region
+    geodesic: thêm gia tốc geodesic vào bước LM ("lm" / "nielsen")
+    up: trục cao cho linear init khi init=None (xem hybrid_linear_init_batch)
+    """
+    if strategy not in TR_STRATEGIES:
+        raise ValueError(f"unknown strategy {strategy!r}, expected one of {TR_STRATEGIES}")
+    if geodesic and strategy == "dogleg":
+        raise ValueError("geodesic acceleration applies to LM steps, not dogleg")
+
+    A_arr = anchors_to_array(anchors)
+    K = A_arr.shape[0]
+
+    if meas is None and K == 4:
+        # fast path: anchors -> (4,3) list một lần, vòng lặp chỉ ghi vào buffer
+        A = A_arr.tolist()
+        s_vec = s
+        rj = residual_and_jacobian_into
+        normal_eq = _normal_equations_5
+        sumsq = _sumsq5
+        f = [0.0] * 5
+        J = [[0.0, 0.0, 0.0] for _ in range(5)]
+        f_new = [0.0] * 5
+        J_new = [[0.0, 0.0, 0.0] for _ in range(5)]
+    else:
+        if meas is None:
+            meas = make_measurement_set(K)
+        idx = measurement_index(meas, K)
+        s_vec = np.asarray(s, dtype=float)
+        if s_vec.shape != (len(meas),):
+            raise ValueError(f"s has {s_vec.size} values, measurement set has {len(meas)} rows")
+        A = A_arr
+
+        def rj(A_, s_, x_, f_, J_):
+            return residual_and_jacobian_meas(A_, s_, x_, idx, f_, J_)
 
+        normal_eq = _normal_equations_np
+        sumsq = _sumsq_np
+        M = len(meas)
+        f = np.empty(M)
+        J = np.empty((M, 3))
+        f_new = np.empty(M)
+        J_new = np.empty((M, 3))
+
+    init_kind = "given"
     if init is None:
-        x0 = Vec3(
-            (anchors[0].x + anchors[-1].x) * 0.5,
-            (anchors[0].y + anchors[-1].y) * 0.5,
-            1.5
-        )
+        # khởi tạo dạng đóng; chỉ khi không tuyến tính hóa được mới dùng điểm giữa anchor
+        init = hybrid_linear_init(A_arr, s, meas=meas, up=up)
+        init_kind = "linear"
+        if init is not None:
+            init.z = min(max(init.z, z_min), z_max)
+
+    if init is None:
+        init_kind = "midpoint"
+        x0 = [
+            (A_arr[0, 0] + A_arr[-1, 0]) * 0.5,
+            (A_arr[0, 1] + A_arr[-1, 1]) * 0.5,
+            1.5,
+        ]
     else:
-        x0 = Vec3(init.x, init.y, init.z)
+        x0 = [init.x, init.y, init.z]
+    x0 = [float(v) for v in x0]
+
+    if strategy != "lm" or geodesic:
+        return _solve_trust_region(
+            A_arr, s, meas, x0, strategy, geodesic, max_iter, lambda_init,
+            tol_step, tol_res, z_min, z_max, max_step, diag, init_kind,
+        )
 
     lam = lambda_init
 
-    f, J = residual_and_jacobian_s(anchors, s, x0)
-    chi2 = sum(fi*fi for fi in f)
+    x_candidate = [0.0, 0.0, 0.0]
+    JTJ = [[0.0]*3 for _ in range(3)]
+    rhs = [0.0, 0.0, 0.0]
+    delta = [0.0, 0.0, 0.0]
+
+    rj(A, s_vec, x0, f, J)
+    chi2 = sumsq(f)
     converged = False
-    last_good = x0
     last_good_cost = chi2
+    reason = "max_iter"
+    if diag is not None:
+        diag.begin(init_kind, chi2)
 
     for it in range(max_iter):
-        JTJ = [[0.0]*3 for _ in range(3)]
-        JTf = [0.0,0.0,0.0]
-
-        for i in range(5):
-            g0,g1,g2 = J[i]
-            fi = f[i]
-
-            JTJ[0][0] += g0*g0
-            JTJ[0][1] += g0*g1
-            JTJ[0][2] += g0*g2
-            JTJ[1][0] += g1*g0
-            JTJ[1][1] += g1*g1
-            JTJ[1][2] += g1*g2
-            JTJ[2][0] += g2*g0
-            JTJ[2][1] += g2*g1
-            JTJ[2][2] += g2*g2
-
-            JTf[0] += g0*fi
-            JTf[1] += g1*fi
-            JTf[2] += g2*fi
-
-        for k in range(3):
-            JTJ[k][k] += lam
-
-        delta = solve_3x3(JTJ, [-JTf[0],-JTf[1],-JTf[2]])
+        normal_eq(J, f, lam, JTJ, rhs)
+        solve_3x3_into(JTJ, rhs, delta)
         step_norm = math.sqrt(delta[0]**2 + delta[1]**2 + delta[2]**2)
 
         # 🔥 trust region nhỏ hơn → bớt nhảy “văng”
-        max_step = 0.25
         if step_norm > max_step:
             scale = max_step / step_norm
-            delta = [d*scale for d in delta]
+            delta[0] *= scale
+            delta[1] *= scale
+            delta[2] *= scale
 
         if step_norm < tol_step and chi2 < last_good_cost + 1e-6:
             converged = True
+            reason = "step"
             break
 
-        x_candidate = Vec3(
-            x0.x + delta[0],
-            x0.y + delta[1],
-            x0.z + delta[2]
-        )
+        x_candidate[0] = x0[0] + delta[0]
+        x_candidate[1] = x0[1] + delta[1]
+        cz = x0[2] + delta[2]
 
         # giữ trong vùng hợp lệ
-        if x_candidate.z < z_min:
-            x_candidate.z = (x_candidate.z + z_min) * 0.5
-        if x_candidate.z > z_max:
-            x_candidate.z = (x_candidate.z + z_max) * 0.5
+        if cz < z_min:
+            cz = (cz + z_min) * 0.5
+        if cz > z_max:
+            cz = (cz + z_max) * 0.5
+        x_candidate[2] = cz
 
-        f_new, J_new = residual_and_jacobian_s(anchors, s, x_candidate)
-        chi2_new = sum(fi*fi for fi in f_new)
+        rj(A, s_vec, x_candidate, f_new, J_new)
+        chi2_new = sumsq(f_new)
+
+        if diag is not None:
+            diag.step(lam, chi2_new, step_norm, chi2_new < chi2, step_norm > max_step,
+                      cz != x0[2] + delta[2])
 
         if chi2_new < chi2:
-            last_good = x_candidate
             last_good_cost = chi2_new
-            x0 = x_candidate
-            f, J = f_new, J_new
+            # đổi vai buffer thay vì copy
+            x0, x_candidate = x_candidate, x0
+            f, f_new = f_new, f
+            J, J_new = J_new, J
             chi2 = chi2_new
 
             lam *= 0.7
@@ -198,25 +936,380 @@ def hybrid_solve_LM(
 
             if chi2 < tol_res:
                 converged = True
+                reason = "res"
                 break
         else:
             lam *= 2.0
             if lam > 1e7:
+                reason = "lam"
                 break
 
+    last_good = Vec3(x0[0], x0[1], x0[2])
+
     if not converged:
         # 🔥 nghiêm hơn → tránh nhận nghiệm sai vài mét
         if last_good_cost < 0.05:
             converged = True
+            if diag is not None:
+                diag.end(max_iter, True, reason, True, last_good_cost)
             return last_good, max_iter, True, last_good_cost
 
+    if diag is not None:
+        diag.end(it + 1, converged, reason, False, last_good_cost)
     return last_good, it+1, converged, last_good_cost
 
 
 
+# ---------- Tracking mode (warm start) ----------
+
+def hybrid_solve_tracking(
+    anchors,
+    s,
+    prior=None,
+    max_cost: float = 0.05,
+    fallback_inits: Sequence = (),
+    meas=None,
+    **lm_kwargs,
+):
+    """
+    Warm start LM từ prior (vd. dự đoán của Kalman) thay vì điểm giữa anchor.
+
+    Nếu nghiệm warm không ok hoặc cost > max_cost -> cold start (init mặc định),
+    rồi lần lượt các fallback_inits; giữ nghiệm có cost nhỏ nhất.
+
+    Trả về (est, it_total, ok, cost, seed) với it_total = tổng số vòng LM đã chạy,
+    seed = "warm" | "cold" | "fallback".
+    """
+    attempts = []
+    if prior is not None:
+        attempts.append(("warm", prior))
+    attempts.append(("cold", None))
+    attempts += [("fallback", p) for p in fallback_inits]
+
+    it_total = 0
+    best = None
+    for seed, init in attempts:
+        est, it, ok, cost = hybrid_solve_LM(anchors, s, init=init, meas=meas, **lm_kwargs)
+        it_total += it
+        if best is None or (ok, -cost) > (best[2], -best[3]):
+            best = (est, it, ok, cost, seed)
+        if ok and cost <= max_cost:
+            break
+
+    est, _, ok, cost, seed = best
+    return est, it_total, ok, cost, seed
+
+
+# ---------- Batched LM Solver (NumPy) ----------
+
+def _residual_and_jacobian_batch(A, S, X, idx):
+    """
+    A: (n,K,3) anchors, S: (n,M) s vectors, X: (n,3) positions, idx = (ia, ib).
+    Trả về F: (n,M), J: (n,M,3) - cùng công thức với residual_and_jacobian_meas.
+    """
+    ia, ib = idx
+    n, K = A.shape[0], A.shape[1]
+
+    U = np.zeros((n, K + 1, 3))
+    r = np.zeros((n, K + 1))
+    np.subtract(X[:, None, :], A, out=U[:, :K])
+    r[:, :K] = np.sqrt(np.einsum("nki,nki->nk", U[:, :K], U[:, :K]))
+    safe = np.where(r[:, :K] < 1e-12, np.inf, r[:, :K])
+    U[:, :K] /= safe[:, :, None]                  # unit(x, a_k), = 0 khi trùng anchor
+
+    F = r[:, ia] - r[:, ib] - S
+    J = U[:, ia, :] - U[:, ib, :]
+    return F, J
+
+
+def _solve_3x3_batch(A, b):
+    """Giống solve_3x3 nhưng cho (n,3,3) x (n,3); det ~ 0 -> nghiệm 0."""
+    c00 = A[:, 1, 1] * A[:, 2, 2] - A[:, 1, 2] * A[:, 2, 1]
+    c01 = A[:, 1, 0] * A[:, 2, 2] - A[:, 1, 2] * A[:, 2, 0]
+    c02 = A[:, 1, 0] * A[:, 2, 1] - A[:, 1, 1] * A[:, 2, 0]
+    det = A[:, 0, 0] * c00 - A[:, 0, 1] * c01 + A[:, 0, 2] * c02
+
+    singular = np.abs(det) < 1e-12
+    inv_det = 1.0 / np.where(singular, 1.0, det)
+
+    inv = np.empty_like(A)
+    inv[:, 0, 0] = c00
+    inv[:, 0, 1] = -(A[:, 0, 1] * A[:, 2, 2] - A[:, 0, 2] * A[:, 2, 1])
+    inv[:, 0, 2] = A[:, 0, 1] * A[:, 1, 2] - A[:, 0, 2] * A[:, 1, 1]
+    inv[:, 1, 0] = -c01
+    inv[:, 1, 1] = A[:, 0, 0] * A[:, 2, 2] - A[:, 0, 2] * A[:, 2, 0]
+    inv[:, 1, 2] = -(A[:, 0, 0] * A[:, 1, 2] - A[:, 0, 2] * A[:, 1, 0])
+    inv[:, 2, 0] = c02
+    inv[:, 2, 1] = -(A[:, 0, 0] * A[:, 2, 1] - A[:, 0, 1] * A[:, 2, 0])
+    inv[:, 2, 2] = A[:, 0, 0] * A[:, 1, 1] - A[:, 0, 1] * A[:, 1, 0]
+    inv *= inv_det[:, None, None]
+
+    x = np.einsum("nij,nj->ni", inv, b)
+    x[singular] = 0.0
+    return x
+
+
+def hybrid_solve_LM_batch(
+    anchors,
+    S,
+    init=None,
+    max_iter: int = 120,
+    lambda_init: float = 0.1,
+    tol_step: float = 1e-4,
+    tol_res: float = 1e-6,
+    z_min: float = 0.2,
+    z_max: float = 3.5,
+    meas=None,
+    max_step: float = 0.25,
+    up=(0.0, 0.0, 1.0),
+):
+    """
+    LM vector hóa cho N tag cùng lúc (cùng logic với hybrid_solve_LM).
+
+    anchors: list K Vec3 / mảng (K,3) dùng chung, hoặc (N,K,3) riêng từng tag
+    S:       (N,M) các vector s (mặc định M=5: [d2, d3, d4, d01, d02])
+    init:    None, Vec3, (3,) hoặc (N,3)
+    meas:    descriptor (i, j) như hybrid_solve_LM
+    up:      trục cao cho linear init (như hybrid_solve_LM)
+
+    Trả về (est (N,3), it (N,), ok (N,), cost (N,)).
+    """
+    A = anchors_to_array(anchors)
+    K = A.shape[-2]
+    if meas is None:
+        meas = make_measurement_set(K)
+    idx = measurement_index(meas, K)
+
+    S = np.asarray(S, dtype=float).reshape(-1, len(meas))
+    n = S.shape[0]
+
+    if init is None:
+        X, valid = hybrid_linear_init_batch(A, S, meas=meas, up=up)
+        X[:, 2] = np.clip(X[:, 2], z_min, z_max)
+
+    if A.ndim == 2:
+        A = np.broadcast_to(A, (n,) + A.shape)
+
+    if init is None:
+        fb = ~valid
+        X[fb, 0:2] = (A[fb, 0, 0:2] + A[fb, -1, 0:2]) * 0.5
+        X[fb, 2] = 1.5
+    elif isinstance(init, Vec3):
+        X = np.tile([init.x, init.y, init.z], (n, 1)).astype(float)
+    else:
+        X = np.array(np.broadcast_to(np.asarray(init, dtype=float), (n, 3)))
+
+    lam = np.full(n, float(lambda_init))
+    F, J = _residual_and_jacobian_batch(A, S, X, idx)
+    chi2 = np.einsum("ni,ni->n", F, F)
+
+    it_out = np.full(n, max_iter, dtype=int)
+    converged = np.zeros(n, dtype=bool)
+    active = np.arange(n)
+
+    eye3 = np.eye(3)
+
+    for it in range(max_iter):
+        if active.size == 0:
+            break
+
+        Ja = J[active]
+        Fa = F[active]
+        JTJ = np.einsum("nki,nkj->nij", Ja, Ja) + lam[active, None, None] * eye3
+        JTf = np.einsum("nki,nk->ni", Ja, Fa)
+
+        delta = _solve_3x3_batch(JTJ, -JTf)
+        step_norm = np.sqrt(np.einsum("ni,ni->n", delta, delta))
+
+        clip = step_norm > max_step
+        if clip.any():
+            delta[clip] *= (max_step / step_norm[clip])[:, None]
+
+        # last_good_cost luôn bằng chi2 (chỉ cập nhật khi nhận bước)
+        done = step_norm < tol_step
+        if done.any():
+            converged[active[done]] = True
+            it_out[active[done]] = it + 1
+            keep = ~done
+            active, delta = active[keep], delta[keep]
+            if active.size == 0:
+                break
+
+        cand = X[active] + delta
+        z = cand[:, 2]
+        z[:] = np.where(z < z_min, (z + z_min) * 0.5, z)
+        z[:] = np.where(z > z_max, (z + z_max) * 0.5, z)
+
+        F_new, J_new = _residual_and_jacobian_batch(A[active], S[active], cand, idx)
+        chi2_new = np.einsum("ni,ni->n", F_new, F_new)
+
+        better = chi2_new < chi2[active]
+        acc = active[better]
+        X[acc] = cand[better]
+        F[acc] = F_new[better]
+        J[acc] = J_new[better]
+        chi2[acc] = chi2_new[better]
+        lam[acc] = np.maximum(lam[acc] * 0.7, 1e-7)
+
+        rej = active[~better]
+        lam[rej] *= 2.0
+
+        stop = np.zeros(active.size, dtype=bool)
+        res_ok = better & (chi2[active] < tol_res)
+        converged[active[res_ok]] = True
+        stop |= res_ok
+        stop |= ~better & (lam[active] > 1e7)
+
+        it_out[active[stop]] = it + 1
+        active = active[~stop]
+
+    # 🔥 giống scalar: nhận nghiệm nếu cost đủ nhỏ
+    rescue = ~converged & (chi2 < 0.05)
+    converged[rescue] = True
+    it_out[rescue] = max_iter
+
+    return X, it_out, converged, chi2
+
+
+# ---------- Multi-start (batched) + mirror ambiguity ----------
+
+def _up_unit(up) -> np.ndarray:
+    u = np.asarray(up, dtype=float)
+    nrm = float(np.linalg.norm(u))
+    if u.shape != (3,) or nrm < 1e-12:
+        raise ValueError(f"up must be a non-zero 3-vector, got {up!r}")
+    return u / nrm
+
+
+def _default_seeds(A, S, meas, z_min, z_max, floor_h, ceiling_h, up):
+    """
+    Seed mặc định cho mỗi tag (n,4,3): nghiệm dạng đóng, ảnh gương của nó qua
+    mặt phẳng anchor (theo trục up), và 2 điểm giữa vùng anchor ở độ cao thấp / giữa.
+    """
+    n = S.shape[0]
+    u = _up_unit(up)
+    X_lin, _ = hybrid_linear_init_batch(A, S, meas=meas, up=u)
+    A = np.broadcast_to(A, (n,) + A.shape[-2:])
+    plane_h = (A @ u).mean(axis=1)
+    center = A.mean(axis=1)
+    center -= (center @ u)[:, None] * u           # chân của tâm anchor trên mặt phẳng độ cao 0
+    h_hi = ceiling_h
+    if u[2] == 1.0:
+        h_hi = min(ceiling_h, z_max)
+
+    seeds = np.empty((n, 4, 3))
+    seeds[:, 0] = X_lin
+    seeds[:, 1] = X_lin + (2.0 * (plane_h - X_lin @ u))[:, None] * u
+    seeds[:, 2] = center + (floor_h + 0.25 * (h_hi - floor_h)) * u
+    seeds[:, 3] = center + (0.5 * (floor_h + h_hi)) * u
+    seeds[:, :, 2] = np.clip(seeds[:, :, 2], z_min, z_max)
+    return seeds
+
+
+def hybrid_solve_multistart_batch(
+    anchors,
+    S,
+    seeds=None,
+    floor_z: Optional[float] = None,
+    ceiling_z: Optional[float] = None,
+    mirror_sep: float = 0.3,
+    meas=None,
+    z_min: float = 0.2,
+    z_max: float = 3.5,
+    up=(0.0, 0.0, 1.0),
+    **lm_kwargs,
+):
+    """
+    Multi-start LM cho N tag x K seed trong MỘT lần hybrid_solve_LM_batch
+    (mỗi seed thêm = thêm 1 hàng trong batch, không phải thêm 1 lần giải Python).
+
+    seeds:     None (mặc định, xem _default_seeds), (K,3) / list Vec3 dùng chung, hoặc (N,K,3)
+    up:        trục cao (như hybrid_solve_LM); sàn / trần / seed gương đều đo theo x . up
+    floor_z:   sàn theo up (mặc định z_min khi up là z, ngược lại 0.0);
+    ceiling_z: trần theo up (mặc định anchor cao nhất)
+    Ứng viên hợp lệ: ok và floor_z <= x . up <= ceiling_z; chọn cost nhỏ nhất.
+
+    ambiguity = cost_best / cost của ứng viên hội tụ tốt nhất cách nghiệm chọn > mirror_sep
+    (kể cả ứng viên bị loại bởi sàn/trần): ~1 -> nghiệm gương tốt ngang nhau, 0 -> không có.
+
+    Trả về (est (N,3), it (N,), ok (N,), cost (N,), ambiguity (N,)).
+    """
+    A = anchors_to_array(anchors)
+    K_a = A.shape[-2]
+    if meas is None:
+        meas = make_measurement_set(K_a)
+    S = np.asarray(S, dtype=float).reshape(-1, len(meas))
+    n = S.shape[0]
+    u = _up_unit(up)
+
+    if floor_z is None:
+        floor_z = z_min if u[2] == 1.0 else 0.0
+    if ceiling_z is None:
+        ceiling_z = float((A @ u).max())
+
+    if seeds is None:
+        seeds = _default_seeds(A, S, meas, z_min, z_max, floor_z, ceiling_z, u)
+    else:
+        seeds = anchors_to_array(seeds)
+        if seeds.ndim == 2:
+            seeds = np.broadcast_to(seeds, (n,) + seeds.shape)
+    k = seeds.shape[1]
+
+    # (n,k) -> hàng phẳng n*k, tag i dùng các hàng i*k .. i*k + k-1
+    S_rep = np.repeat(S, k, axis=0)
+    A_rep = np.repeat(A, k, axis=0) if A.ndim == 3 else A
+    est, it, ok, cost = hybrid_solve_LM_batch(
+        A_rep, S_rep, init=seeds.reshape(-1, 3), meas=meas,
+        z_min=z_min, z_max=z_max, up=u, **lm_kwargs,
+    )
+    est = est.reshape(n, k, 3)
+    it = it.reshape(n, k)
+    ok = ok.reshape(n, k)
+    cost = cost.reshape(n, k)
+
+    height = est @ u
+    valid = ok & (height >= floor_z - 1e-6) & (height <= ceiling_z + 1e-6)
+    any_valid = valid.any(axis=1)
+    # không ứng viên nào hợp lệ -> lấy ứng viên cost nhỏ nhất, ok=False
+    rank_cost = np.where(valid | ~any_valid[:, None], cost, np.inf)
+    best = np.argmin(rank_cost, axis=1)
+    rows = np.arange(n)
+
+    best_est = est[rows, best]
+    best_cost = cost[rows, best]
+
+    sep = np.linalg.norm(est - best_est[:, None, :], axis=2)
+    alt_cost = np.where(ok & (sep > mirror_sep), cost, np.inf).min(axis=1)
+    eps = 1e-12
+    ambiguity = np.where(np.isfinite(alt_cost), np.minimum((best_cost + eps) / (alt_cost + eps), 1.0), 0.0)
+
+    return best_est, it[rows, best], valid[rows, best], best_cost, ambiguity
+
+
+def hybrid_solve_multistart(anchors, s, seeds=None, **kwargs):
+    """Bản 1 tag: trả về (est Vec3, it, ok, cost, ambiguity)."""
+    if seeds is not None and len(seeds) > 0 and hasattr(seeds[0], "x"):
+        seeds = anchors_to_array(seeds)
+    est, it, ok, cost, amb = hybrid_solve_multistart_batch(anchors, [s], seeds=seeds, **kwargs)
+    e = est[0]
+    return Vec3(float(e[0]), float(e[1]), float(e[2])), int(it[0]), bool(ok[0]), float(cost[0]), float(amb[0])
+
+
 # ---------- Forward Model ----------
 
-def s_from_groundtruth(anchors, tag, noise_std_m: float = 0.0):
+def s_from_groundtruth(anchors, tag, noise_std_m: float = 0.0, meas=None):
+    if meas is not None or len(anchors) != 4:
+        if meas is None:
+            meas = make_measurement_set(len(anchors))
+        r = [dist(tag, a) for a in anchors]
+        out = []
+        for i, j in meas:
+            d = r[i] if (j is None or j < 0) else r[i] - r[j]
+            if noise_std_m > 0.0:
+                d += random.gauss(0, noise_std_m)
+            out.append(d)
+        return out
+
     r1 = dist(tag, anchors[0])
     r2 = dist(tag, anchors[1])
     r3 = dist(tag, anchors[2])
@@ -238,6 +1331,36 @@ def s_from_groundtruth(anchors, tag, noise_std_m: float = 0.0):
     return [d2, d3, d4, d01, d02]
 
 
+def s_from_groundtruth_batch(anchors, P, noise_std_m: float = 0.0, meas=None, rng=None):
+    """
+    Forward model vector hóa (cùng công thức với s_from_groundtruth).
+
+    anchors: (K,3) dùng chung, hoặc broadcast được với P[..., None, :] (vd (T,1,K,3) theo frame)
+    P:       (..., 3) vị trí tag, vd (T,N,3) cả quỹ đạo x cả fleet
+    rng:     numpy.random.Generator (bắt buộc khi noise_std_m > 0)
+
+    Trả về S (..., M).
+    """
+    A = anchors_to_array(anchors)
+    K = A.shape[-2]
+    if meas is None:
+        meas = make_measurement_set(K)
+    ia, ib = measurement_index(meas, K)
+
+    P = np.asarray(P, dtype=float)
+    R = np.linalg.norm(P[..., None, :] - A, axis=-1)           # (..., K)
+    S = R[..., ia]
+    tdoa = ib >= 0
+    if tdoa.any():
+        S[..., tdoa] -= R[..., ib[tdoa]]
+
+    if noise_std_m > 0.0:
+        if rng is None:
+            raise ValueError("rng (numpy.random.Generator) is required when noise_std_m > 0")
+        S += rng.normal(0.0, noise_std_m, S.shape)
+    return S
+
+
 # ---------- Public API ----------
 
 def hybrid_from_raw(anchors, d01, d02, d2, d3, d4):
@@ -0,0 +1,345 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+import functools
+import json
+import threading
+import time
+
+
+# ---------- HDR-style histogram ----------
+class LatencyHistogram:
+    """
+    Histogram log-tuyến tính kiểu HDR cho số nguyên >= 0 (ns, số vòng lặp, ...):
+    - [0, 2^sub_bits): mỗi giá trị 1 bucket
+    - từ đó mỗi quãng [2^k, 2^(k+1)) chia 2^(sub_bits-1) bucket -> sai số tương đối <= 2^(1-sub_bits)
+    sub_bits=6 -> ~3%, ~1100 bucket cho tới 2^37 ns (~137 s). record() O(1), không cấp phát.
+    """
+
+    def __init__(self, sub_bits: int = 6, max_bits: int = 37):
+        self.sub_bits = int(sub_bits)
+        self._sub = 1 << self.sub_bits
+        self._half = self._sub >> 1
+        self._max = (1 << int(max_bits)) - 1
+        self.counts = [0] * self._index(self._max)
+        self.counts.append(0)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def _index(self, v: int) -> int:
+        m = v.bit_length()
+        if m <= self.sub_bits:
+            return v
+        shift = m - self.sub_bits
+        return self._sub + (shift - 1) * self._half + (v >> shift) - self._half
+
+    def _lower(self, idx: int) -> int:
+        """Giá trị nhỏ nhất của bucket idx (nghịch đảo _index)."""
+        if idx < self._sub:
+            return idx
+        shift, off = divmod(idx - self._sub, self._half)
+        return (off + self._half) << (shift + 1)
+
+    def record(self, v) -> None:
+        v = min(max(int(v), 0), self._max)
+        i = self._index(v)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += v
+            if v > self.max:
+                self.max = v
+            if self.min is None or v < self.min:
+                self.min = v
+
+    def percentile(self, q: float) -> float:
+        """q trong [0, 100] -> điểm giữa bucket chứa percentile (kẹp trong [min, max])."""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(q / 100.0 * self.count + 0.5))
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                lo, hi = self._lower(i), self._lower(i + 1)
+                return float(min(max((lo + hi - 1) * 0.5, self.min), self.max))
+        return float(self.max)
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        with self._lock:
+            for i, c in enumerate(other.counts):
+                if c:
+                    self.counts[i] += c
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+            if other.min is not None and (self.min is None or other.min < self.min):
+                self.min = other.min
+        return self
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+    def summary(self, scale: float = 1.0) -> dict:
+        """scale: đổi đơn vị (vd. 1e-3 cho ns -> µs)."""
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count * scale,
+            "min": self.min * scale,
+            "p50": self.percentile(50) * scale,
+            "p90": self.percentile(90) * scale,
+            "p99": self.percentile(99) * scale,
+            "max": self.max * scale,
+        }
+
+
+# ---------- Instrumentation ----------
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist: LatencyHistogram):
+        self.hist = hist
+        self.t0 = 0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.record(time.perf_counter_ns() - self.t0)
+        return False
+
+
+class Instrumentation:
+    """
+    Đo hot path của vòng realtime:
+    - stage(name): context manager đo thời gian (ns) vào histogram của stage
+    - count(name, n): bộ đếm; observe(name, v): histogram giá trị nguyên (vd. số vòng LM)
+    - wrap(name, fn): bọc callable (send / emit) -> đo thời gian + đếm lỗi "<name>_errors" rồi raise lại
+    - add_source(name, fn): snapshot() gọi fn() -> dict (vd. publisher.stats)
+    enabled=False: stage() trả về timer rỗng dùng chung, count/observe return ngay, wrap trả fn nguyên vẹn.
+    """
+
+    def __init__(self, enabled: bool = True, sub_bits: int = 6):
+        self.enabled = bool(enabled)
+        self.sub_bits = int(sub_bits)
+        self.stages: Dict[str, LatencyHistogram] = {}
+        self.values: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.sources: Dict[str, Callable[[], dict]] = {}
+        self._timers: Dict[str, _StageTimer] = {}
+        self._lock = threading.Lock()
+        self._t0 = time.time()
+
+    def _hist(self, table: Dict[str, LatencyHistogram], name: str) -> LatencyHistogram:
+        h = table.get(name)
+        if h is None:
+            with self._lock:
+                h = table.setdefault(name, LatencyHistogram(self.sub_bits))
+        return h
+
+    def stage(self, name: str):
+        """with instr.stage("solve"): ... — timer tái sử dụng, chỉ dùng từ 1 thread cho mỗi stage."""
+        if not self.enabled:
+            return _NULL_TIMER
+        t = self._timers.get(name)
+        if t is None:
+            t = self._timers[name] = _StageTimer(self._hist(self.stages, name))
+        return t
+
+    def record_ns(self, name: str, ns: int) -> None:
+        if self.enabled:
+            self._hist(self.stages, name).record(ns)
+
+    def observe(self, name: str, value) -> None:
+        if self.enabled:
+            self._hist(self.values, name).record(value)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        if not self.enabled:
+            return fn
+        hist = self._hist(self.stages, name)
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                self.count(f"{name}_errors")
+                raise
+            finally:
+                hist.record(time.perf_counter_ns() - t0)
+
+        return timed
+
+    def add_source(self, name: str, fn: Callable[[], dict]) -> None:
+        self.sources[name] = fn
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """
+        {"t", "uptime_s", "stages": {name: µs summary}, "values": {...}, "counters": {...}, "<source>": {...}}
+        reset=True: xóa histogram + bộ đếm sau khi chụp (snapshot theo cửa sổ).
+        """
+        with self._lock:
+            stages = list(self.stages.items())
+            values = list(self.values.items())
+            counters = dict(self.counters)
+            if reset:
+                self.counters.clear()
+        snap = {
+            "t": time.time(),
+            "uptime_s": time.time() - self._t0,
+            "stages": {name: h.summary(1e-3) for name, h in stages},
+            "values": {name: h.summary() for name, h in values},
+            "counters": counters,
+        }
+        for name, fn in list(self.sources.items()):
+            try:
+                snap[name] = fn()
+            except Exception as e:
+                snap[name] = {"error": repr(e)}
+        if reset:
+            for _, h in stages + values:
+                h.reset()
+        return snap
+
+
+def format_snapshot(snap: dict) -> str:
+    """Vài dòng text gọn cho console: mỗi stage p50/p99/max (µs) + bộ đếm."""
+    lines = []
+    for name, s in snap["stages"].items():
+        if s["count"]:
+            lines.append(f"  {name:<14} n={s['count']:<6} p50={s['p50']:9.1f} p99={s['p99']:9.1f} "
+                         f"max={s['max']:9.1f} µs")
+    for name, s in snap["values"].items():
+        if s["count"]:
+            lines.append(f"  {name:<14} n={s['count']:<6} mean={s['mean']:.2f} p99={s['p99']:.0f} max={s['max']:.0f}")
+    if snap["counters"]:
+        lines.append("  " + " ".join(f"{k}={v}" for k, v in sorted(snap["counters"].items())))
+    return "\n".join(lines)
+
+
+# ---------- Export định kỳ ----------
+class SnapshotExporter:
+    """
+    Thread nền chụp snapshot mỗi interval giây:
+    - path: append 1 dòng JSON / snapshot (JSON Lines)
+    - port: HTTP cục bộ, GET /metrics trả snapshot mới nhất (JSON)
+    - on_snapshot(snap): callback tùy chọn (vd. in ra console)
+    reset_each=True -> mỗi snapshot chỉ chứa số liệu của cửa sổ vừa qua.
+    """
+
+    def __init__(self, instr: Instrumentation, interval: float = 5.0, path: Optional[str] = None,
+                 port: Optional[int] = None, host: str = "127.0.0.1", reset_each: bool = False,
+                 on_snapshot: Optional[Callable[[dict], None]] = None):
+        self.instr = instr
+        self.interval = float(interval)
+        self.path = path
+        self.reset_each = reset_each
+        self.on_snapshot = on_snapshot
+        self.latest: Optional[dict] = None
+        self.exports = 0
+        self.export_errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.server = None
+        if port is not None:
+            self.server = self._make_server(host, port)
+            self.address = self.server.server_address
+
+    def _make_server(self, host: str, port: int) -> ThreadingHTTPServer:
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                snap = exporter.latest if exporter.latest is not None else exporter.instr.snapshot()
+                body = json.dumps(snap).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+    def export(self) -> dict:
+        """Chụp + xuất 1 snapshot ngay (cũng được thread nền gọi định kỳ)."""
+        snap = self.instr.snapshot(reset=self.reset_each)
+        self.latest = snap
+        try:
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(snap) + "\n")
+            if self.on_snapshot is not None:
+                self.on_snapshot(snap)
+            self.exports += 1
+        except Exception:
+            self.export_errors += 1
+        return snap
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def start(self) -> "SnapshotExporter":
+        if self.server is not None:
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        self._thread = threading.Thread(target=self._run, name="metrics-export", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, final: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1.0)
+            self._thread = None
+        if final:
+            self.export()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
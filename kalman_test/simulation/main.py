@@ -1,218 +1,349 @@
-import math
 import time
-import requests
 
-from hybrid_scalable import Vec3, s_from_groundtruth, hybrid_solve_LM
+from hybrid_scalable import Vec3, hybrid_solve_LM, hybrid_solve_LM_batch, hybrid_solve_tracking, LMDiagnostics
 from gmc_kalman_filter import AdaptiveGMCKalman3D as GMCKalman3D
+from publisher import PositionPublisher, AnchorBroadcaster, http_batch_sender, http_binary_sender
+from scheduler import FrameScheduler
+from pipeline import Pipeline, Stage, SolveStage, FilterStage
+from async_runner import AsyncRealtimeRunner
+from sources import SimulatorSource, UDPSource, ReplaySource
+from sessionlog import SessionLogWriter
+from instrument import Instrumentation, SnapshotExporter, format_snapshot
+from scenarios import LM_KW, KF_KW, WARM_MAX_COST, PUBLISH_QUEUE, get_measure
+
+PUSH_URL = "http://localhost:3000/push-batch"
+PUSH_BIN_URL = "http://localhost:3000/push-bin"
+PUSH_FORMAT = "json"    # "json" | "binary" (wire.py: frame nhị phân, tag id là số)
+TAG_ID = 0 if PUSH_FORMAT == "binary" else "T0"
+
+# Tracking mode: seed LM từ dự đoán Kalman, fallback cold start nếu cost > gate
+WARM_START = True
+LM_STATS_EVERY = 50     # in thống kê số vòng LM mỗi N frame
+
+# Vòng realtime bám deadline tuyệt đối (không trôi), "skip" / "merge" khi bị tụt
+FRAME_HZ = 10.0
+SCHED_POLICY = "skip"
+
+# "sync"      : vòng lặp tuần tự (main)
+# "pipelined" : ingest -> solve -> filter -> publish (solve frame N+1 song song publish frame N),
+#               solve là cold start (linear init), không warm start từ Kalman
+# "async"     : asyncio + Socket.IO AsyncClient, reconnect/emit là task riêng (main_async)
+# "source"    : nhiều tag từ nguồn đo SOURCE, giải LM theo batch (main_source)
+RUN_MODE = "sync"
+
+# Nguồn đo cho RUN_MODE = "source": "sim" (get_measure), "udp" (UDPSource), "replay" (file capture)
+SOURCE = "sim"
+UDP_PORT = 9500
+REPLAY_PATH = "session.uwcap"
+REPLAY_SPEED = 1.0      # None = nhanh nhất có thể
+
+# Ghi lại phiên (s, anchors, t, nghiệm LM, vị trí lọc) để replay: python sessionlog.py <dir>
+RECORD_PATH = None      # vd. "sessions/2025-01-01_run1"
+PIPE_QUEUE = 8
+PIPE_BACKPRESSURE = "drop_oldest"   # realtime: bỏ frame cũ thay vì chặn vòng ingest
+
+# Đo hot path: thời gian từng stage (histogram), bộ đếm LM / gate / lỗi publish.
+# Tắt -> timer rỗng, chi phí không đáng kể.
+INSTRUMENT = False
+INSTRUMENT_EVERY_S = 5.0
+INSTRUMENT_PATH = "metrics.jsonl"   # JSON Lines, None = không ghi file
+INSTRUMENT_PORT = None              # vd. 9464 -> GET http://127.0.0.1:9464/metrics
+
+instr = Instrumentation(enabled=INSTRUMENT)
+
+
+def make_publisher() -> PositionPublisher:
+    if PUSH_FORMAT == "binary":
+        send = http_binary_sender(PUSH_BIN_URL, timeout=0.25)
+    else:
+        send = http_batch_sender(PUSH_URL, timeout=0.25)
+    return PositionPublisher(instr.wrap("http_push", send), max_queue=PUBLISH_QUEUE)
 
-PUSH_URL = "http://localhost:3000/push"
-SCENARIO_DUR_S = 10.0
-NUM_SCENARIOS = 6
-
-
-def send_position_to_web(x: float, y: float, z: float):
-    try:
-        requests.get(
-            PUSH_URL,
-            params={
-                "x": round(x, 3),
-                "y": round(y, 3),
-                "z": round(z, 3),
-                "ts": round(time.time(), 3),
-            },
-            timeout=0.25,
-        )
-    except Exception:
-        pass
 
+def make_exporter(**sources):
+    """Snapshot định kỳ (file / endpoint cục bộ) khi INSTRUMENT; sources: tên -> hàm stats()."""
+    if not INSTRUMENT:
+        return None
+    for name, fn in sources.items():
+        instr.add_source(name, fn)
+    return SnapshotExporter(
+        instr, interval=INSTRUMENT_EVERY_S, path=INSTRUMENT_PATH, port=INSTRUMENT_PORT, reset_each=True,
+        on_snapshot=lambda snap: print(f"[INSTR]\n{format_snapshot(snap)}"),
+    ).start()
 
-try:
-    import socketio
 
-    sio = socketio.Client(
-        reconnection=True,
-        reconnection_attempts=10,
-        reconnection_delay=500,
-        reconnection_delay_max=2000,
-    )
+anchor_broadcaster = None
 
-    @sio.event
-    def connect():
-        print("Socket.IO connected")
+sio = None
 
-    @sio.event
-    def disconnect():
-        print("Socket.IO disconnected, retrying...")
+# Mode async tự quản lý AsyncClient -> không mở client blocking lúc import
+if RUN_MODE != "async":
+    try:
+        import socketio
 
-    @sio.event
-    def connect_error(data):
-        print(f"Socket.IO connect error: {data}")
+        sio = socketio.Client(
+            reconnection=True,
+            reconnection_attempts=10,
+            reconnection_delay=500,
+            reconnection_delay_max=2000,
+        )
 
-    try:
-        sio.connect("http://localhost:3000")
+        @sio.event
+        def connect():
+            print("Socket.IO connected")
+            # BE có thể vừa khởi động lại -> gửi lại anchor set hiện tại
+            if anchor_broadcaster is not None:
+                anchor_broadcaster.resend_all()
+
+        @sio.event
+        def disconnect():
+            print("Socket.IO disconnected, retrying...")
+
+        @sio.event
+        def connect_error(data):
+            print(f"Socket.IO connect error: {data}")
+
+        try:
+            sio.connect("http://localhost:3000")
+        except Exception as e:
+            print(f"Initial Socket.IO connect failed: {e}")
+            sio = None
+    except ImportError:
+        print("python-socketio not installed, only HTTP will be used")
+        sio = None
     except Exception as e:
-        print(f"Initial Socket.IO connect failed: {e}")
+        print(f"Socket.IO client init error: {e}")
         sio = None
-except ImportError:
-    print("python-socketio not installed, only HTTP will be used")
-    sio = None
-except Exception as e:
-    print(f"Socket.IO client init error: {e}")
-    sio = None
-
-
-def clamp(v, lo, hi):
-    return max(lo, min(hi, v))
-
-
-def anchors_for_scenario(idx: int):
-    if idx == 0:
-        return [
-            Vec3(0.0, 2.8, 0.0),
-            Vec3(12.0, 2.8, 0.0),
-            Vec3(0.0, 2.8, 12.0),
-            Vec3(12.0, 2.8, 12.0),
-        ]
-    if idx == 1:
-        return [
-            Vec3(1.0, 2.8, 1.0),
-            Vec3(11.0, 2.8, 1.0),
-            Vec3(1.0, 2.8, 11.0),
-            Vec3(11.0, 2.8, 11.0),
-        ]
-    if idx == 2:
-        return [
-            Vec3(0.0, 2.8, 0.0),
-            Vec3(12.0, 2.8, 0.0),
-            Vec3(0.0, 1.4, 12.0),
-            Vec3(12.0, 1.4, 12.0),
-        ]
-    if idx == 3:
-        return [
-            Vec3(0.0, 2.8, 0.0),
-            Vec3(12.0, 1.4, 0.0),
-            Vec3(0.0, 2.0, 12.0),
-            Vec3(12.0, 2.8, 12.0),
-        ]
-    if idx == 4:
-        return [
-            Vec3(0.0, 2.0, 0.0),
-            Vec3(4.0, 2.0, 0.0),
-            Vec3(8.0, 2.0, 0.0),
-            Vec3(12.0, 2.2, 2.0),
-        ]
-    if idx == 5:
-        return [
-            Vec3(0.0, 2.0, 0.0),
-            Vec3(0.5, 2.0, 0.1),
-            Vec3(1.0, 2.0, 0.0),
-            Vec3(1.5, 2.1, 0.1),
-        ]
-    return anchors_for_scenario(0)
-
-
-def tag_trajectory(seg_t: float, scenario_idx: int):
-    cx, cz = 6.0, 6.0
-
-    if scenario_idx == 0:
-        rx, rz = 5.0, 4.2
-    elif scenario_idx == 1:
-        rx, rz = 5.2, 2.8
-    elif scenario_idx == 2:
-        rx, rz = 4.2, 5.2
-    elif scenario_idx == 3:
-        rx, rz = 4.8, 4.8
-    else:
-        rx, rz = 5.6, 2.0
-
-    omega = (2.0 * math.pi) / SCENARIO_DUR_S
-    ang = omega * seg_t
 
-    x = cx + rx * math.cos(ang)
-    z = cz + rz * math.sin(ang)
-    y = 1.55 + 0.18 * math.sin(ang * 1.2)
 
-    return Vec3(
-        clamp(x, 0.6, 11.4),
-        clamp(y, 1.2, 2.2),
-        clamp(z, 0.6, 11.4),
-    )
+def emit_socketio(event: str, payload: dict):
+    if sio is None or not sio.connected:
+        raise ConnectionError("Socket.IO not connected")
+    sio.emit(event, payload)
 
 
-def scenario_of_time(t: float):
-    seg_idx = int(t // SCENARIO_DUR_S)
-    idx = seg_idx % NUM_SCENARIOS
-    seg_t = t - seg_idx * SCENARIO_DUR_S
-    return idx, seg_t
+# Anchor chỉ broadcast khi đổi scenario (+ khi reconnect), mỗi scenario là 1 zone
+anchor_broadcaster = AnchorBroadcaster(instr.wrap("sio_emit", emit_socketio))
 
 
-def get_measure(step, t):
-    scenario_idx, seg_t = scenario_of_time(t)
-    anchors = anchors_for_scenario(scenario_idx)
-    gt = tag_trajectory(seg_t, scenario_idx)
-    s = s_from_groundtruth(anchors, gt, noise_std_m=0.05)
-    return scenario_idx, seg_t, anchors, s, gt
+kf = GMCKalman3D(**KF_KW, fast_update=True)
 
 
-kf = GMCKalman3D(
-    process_var=0.8,
-    meas_var=0.7,
-    alpha=1.0,
-    beta_init=1.0,
-)
+def make_recorder(kf_init=None):
+    """kf_init: {tag: (t, Vec3)} trạng thái bộ lọc trước frame ghi đầu tiên (để replay_session tái lập)."""
+    if RECORD_PATH is None:
+        return None
+    return SessionLogWriter(RECORD_PATH, extra_meta={
+        "lm_kwargs": LM_KW,
+        "kf_kwargs": KF_KW,
+        "warm_start": WARM_START,
+        "warm_max_cost": WARM_MAX_COST,
+        "kf_gate": "cost",      # main(): kf.update(est, hybrid_cost=cost)
+        "kf_init": {str(tag): {"t": t, "pos": [p.x, p.y, p.z]} for tag, (t, p) in (kf_init or {}).items()},
+    })
 
 
 def main():
     print("\n===== REALTIME UWB → WEB PUSH (No delay after scenario switch) =====\n")
 
-    dt = 0.1
-    t0 = time.time()
-
     scenario0, seg0, anchors0, s0, gt0 = get_measure(1, 0.0)
-    est0, _, ok0, _ = hybrid_solve_LM(anchors0, s0)
+    est0, _, ok0, _ = hybrid_solve_LM(anchors0, s0, **LM_KW)
     kf.reset(est0 if ok0 else Vec3(6.0, 1.6, 6.0))
 
     step = 1
     last_scenario = scenario0
 
-    while True:
-        t = time.time() - t0
-        step += 1
+    publisher = make_publisher().start()
 
-        scenario_idx, seg_t, anchors, s, gt = get_measure(step, t)
+    sched = FrameScheduler(period=1.0 / FRAME_HZ, policy=SCHED_POLICY)
+    recorder = make_recorder(kf_init={0: (0.0, kf.get_state_vec3())})
+    # Bộ đếm bên trong LM (lambda, bước bị từ chối, cắt trust region, rescue) khi INSTRUMENT
+    lm_diag = LMDiagnostics() if INSTRUMENT else None
+    exporter = make_exporter(
+        publisher=publisher.stats, sched=sched.stats, anchors=anchor_broadcaster.stats,
+        kf=lambda: {"gated": kf.gated}, lm=lambda: lm_diag.summary(),
+    )
 
-        if scenario_idx != last_scenario:
-            print(f"\n=== SWITCH SCENARIO → {scenario_idx} (t={t:.1f}s) ===")
-            last_scenario = scenario_idx
+    lm_frames = 0
+    lm_iters = 0
+    lm_warm_hits = 0
+
+    try:
+        for tick in sched:
+            t_frame = time.perf_counter_ns()
+            t = tick.t
+            step += 1
+
+            with instr.stage("measure"):
+                scenario_idx, seg_t, anchors, s, gt = get_measure(step, t)
+
+            if scenario_idx != last_scenario:
+                print(f"\n=== SWITCH SCENARIO → {scenario_idx} (t={t:.1f}s) ===")
+                last_scenario = scenario_idx
+
+            kf.predict(tick.dt)     # dt thực, kể cả khi frame bị skip/merge
+
+            with instr.stage("solve"):
+                if WARM_START:
+                    est, it, ok, cost, seed = hybrid_solve_tracking(
+                        anchors, s, prior=kf.get_state_vec3(), max_cost=WARM_MAX_COST, diag=lm_diag, **LM_KW
+                    )
+                    lm_warm_hits += seed == "warm"
+                else:
+                    est, it, ok, cost = hybrid_solve_LM(anchors, s, diag=lm_diag, **LM_KW)
+            instr.observe("lm_iters", it)
+            if not ok:
+                instr.count("lm_not_converged")
+
+            lm_frames += 1
+            lm_iters += it
+            if lm_frames == LM_STATS_EVERY:
+                print(f"[LM] mean_it={lm_iters / lm_frames:.1f} warm={lm_warm_hits}/{lm_frames}")
+                lm_frames = lm_iters = lm_warm_hits = 0
+                st = publisher.stats()
+                print(f"[PUB] sent={st['sent_positions']} batches={st['sent_batches']} "
+                      f"dropped={st['dropped']} coalesced={st['coalesced']} errors={st['send_errors']}")
+                ss = sched.stats()
+                print(f"[SCHED] overruns={ss['overruns']} missed={ss['missed']} "
+                      f"jitter mean={ss['jitter_mean_ms']:.2f} p95={ss['jitter_p95_ms']:.2f} max={ss['jitter_max_ms']:.2f} ms")
+
+            with instr.stage("filter"):
+                smoothed = kf.update(est, hybrid_cost=cost) if ok else kf.get_state_vec3()
+            if recorder is not None:
+                with instr.stage("record"):
+                    recorder.append(t, 0, anchors, s, est, ok, cost, it, smoothed)
+
+            with instr.stage("publish"):
+                anchor_version = anchor_broadcaster.update(anchors, zone=f"S{scenario_idx}")
+                publisher.publish(TAG_ID, smoothed.x, smoothed.y, smoothed.z, anchor_version=anchor_version)
+
+            # Mất kết nối Socket.IO: client tự reconnect (reconnection=True), handler connect gửi lại anchor
+            instr.record_ns("frame", time.perf_counter_ns() - t_frame)
+    finally:
+        if recorder is not None:
+            recorder.close()     # flush chunk cuối khi dừng (Ctrl+C)
+        if exporter is not None:
+            exporter.stop()
+        publisher.stop()
+
+
+def main_pipelined():
+    print("\n===== REALTIME UWB → WEB PUSH (pipelined) =====\n")
+
+    publisher = make_publisher().start()
+
+    def publish_stage(item):
+        pos = item["pos"]
+        anchor_version = anchor_broadcaster.update(item["anchors"], zone=f"S{item['scenario']}")
+        publisher.publish(item["tag"], pos.x, pos.y, pos.z, anchor_version=anchor_version)
+        return None
+
+    pipe = Pipeline(
+        [
+            Stage("solve", SolveStage(**LM_KW)),
+            Stage("filter", FilterStage(**KF_KW, fast_update=True)),
+            Stage("publish", publish_stage),
+        ],
+        queue_size=PIPE_QUEUE,
+        backpressure=PIPE_BACKPRESSURE,
+    ).start()
+
+    sched = FrameScheduler(period=1.0 / FRAME_HZ, policy=SCHED_POLICY)
+    step = 1
+    try:
+        for tick in sched:
+            step += 1
+            scenario_idx, seg_t, anchors, s, gt = get_measure(step, tick.t)
+            pipe.submit({"tag": TAG_ID, "scenario": scenario_idx, "anchors": anchors, "s": s, "t": tick.t})
+
+            if step % LM_STATS_EVERY == 0:
+                print(f"[PIPE] {pipe.stats()}")
+    finally:
+        pipe.close(timeout=1.0)
+        publisher.stop()
 
-        est, _, ok, _ = hybrid_solve_LM(anchors, s)
 
-        kf.predict(dt)
-        smoothed = kf.update(est) if ok else kf.get_state_vec3()
+def solve_tracking(anchors, s, prior):
+    if WARM_START:
+        est, it, ok, cost, _ = hybrid_solve_tracking(anchors, s, prior=prior, max_cost=WARM_MAX_COST, **LM_KW)
+        return est, it, ok, cost
+    return hybrid_solve_LM(anchors, s, **LM_KW)
 
-        send_position_to_web(smoothed.x, smoothed.y, smoothed.z)
 
-        if sio:
-            if not sio.connected:
-                try:
-                    sio.connect("http://localhost:3000")
-                except:
-                    pass
+def main_async():
+    import asyncio
+
+    print("\n===== REALTIME UWB → WEB PUSH (asyncio) =====\n")
+
+    _, _, anchors0, s0, _ = get_measure(1, 0.0)
+    est0, _, ok0, _ = hybrid_solve_LM(anchors0, s0, **LM_KW)
+    kf.reset(est0 if ok0 else Vec3(6.0, 1.6, 6.0))
+
+    def on_frame(runner, tick, pos):
+        if runner.frames % LM_STATS_EVERY == 0:
+            print(f"[ASYNC] {runner.stats()}")
 
-            if sio and sio.connected:
-                try:
-                    sio.emit("anchors-update", {
-                        f"A{i}": {"x": round(a.x, 3), "y": round(a.y, 3), "z": round(a.z, 3)}
-                        for i, a in enumerate(anchors)
-                    })
-                except:
-                    pass
+    runner = AsyncRealtimeRunner(get_measure, solve_tracking, kf, frame_hz=FRAME_HZ, tag_id=TAG_ID, on_frame=on_frame)
+    asyncio.run(runner.run())
 
-        time.sleep(dt)
+
+def make_source():
+    if SOURCE == "udp":
+        return UDPSource(port=UDP_PORT)
+    if SOURCE == "replay":
+        return ReplaySource(REPLAY_PATH, speed=REPLAY_SPEED)
+    return SimulatorSource.from_get_measure(get_measure, period=1.0 / FRAME_HZ)
+
+
+def main_source():
+    print(f"\n===== UWB SOURCE={SOURCE} → WEB PUSH (batch LM) =====\n")
+
+    publisher = make_publisher().start()
+    filters = {}    # tag -> (GMCKalman3D, t của frame trước)
+    frames = 0
+    init_skipped = 0    # frame đầu của tag không hội tụ -> chưa khởi tạo bộ lọc, chờ frame sau
+
+    try:
+        with make_source() as source:
+            for batch in source:
+                X, _, ok, cost = hybrid_solve_LM_batch(batch.anchors, batch.S, **LM_KW)
+                av = anchor_broadcaster.update([Vec3(*a) for a in batch.anchors], zone=f"Z{batch.zone}")
+
+                for i, tag in enumerate(batch.tags.tolist()):
+                    est = Vec3(*X[i])
+                    entry = filters.get(tag)
+                    if entry is None:
+                        if not ok[i]:
+                            init_skipped += 1
+                            instr.count("tag_init_skipped")
+                            continue
+                        tag_kf = GMCKalman3D(**KF_KW, fast_update=True)
+                        tag_kf.reset(est)
+                        pos = tag_kf.get_state_vec3()
+                    else:
+                        tag_kf, t_prev = entry
+                        tag_kf.predict(batch.t - t_prev)
+                        pos = tag_kf.update(est, hybrid_cost=cost[i]) if ok[i] else tag_kf.get_state_vec3()
+                    filters[tag] = (tag_kf, batch.t)
+                    publisher.publish(tag, pos.x, pos.y, pos.z, ts=batch.t, anchor_version=av)
+
+                frames += 1
+                if frames % LM_STATS_EVERY == 0:
+                    print(f"[SOURCE] batches={frames} tags={len(filters)} ok={int(ok.sum())}/{len(ok)} "
+                          f"init_skipped={init_skipped} pub={publisher.stats()}")
+    finally:
+        publisher.stop()
 
 
 if __name__ == "__main__":
-    main()
+    if RUN_MODE == "source":
+        main_source()
+    elif RUN_MODE == "pipelined":
+        main_pipelined()
+    elif RUN_MODE == "async":
+        main_async()
+    else:
+        main()
 
 
 
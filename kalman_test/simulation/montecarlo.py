@@ -0,0 +1,279 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+import os
+import time
+
+import numpy as np
+
+from hybrid_scalable import (
+    anchors_to_array, hybrid_solve_LM_batch, make_measurement_set, measurement_index,
+    s_from_groundtruth_batch,
+)
+
+
+# ---------- Cấu hình sweep ----------
+@dataclass
+class Layout:
+    """Anchor layout + hộp lấy mẫu vị trí tag [lo, hi] + tham số LM riêng (vd z-clamp)."""
+    name: str
+    anchors: np.ndarray     # (K,3)
+    lo: Sequence[float]
+    hi: Sequence[float]
+    lm_kwargs: Dict = field(default_factory=dict)
+
+
+@dataclass
+class Condition:
+    """
+    Điều kiện kênh cho 1 trial (ngoài nhiễu Gauss):
+    - NLOS: với xác suất nlos_prob, các hàng nlos_rows của s bị + bias + nhiễu thêm
+    - dropout: mỗi anchor mất độc lập với xác suất drop_prob (chỉ giải trên các hàng còn đủ anchor)
+    """
+    name: str = "LOS"
+    nlos_prob: float = 0.0
+    nlos_bias_m: float = 0.60
+    nlos_extra_noise: float = 0.12
+    nlos_rows: tuple = (1, 2)
+    drop_prob: float = 0.0
+
+
+def main_layouts() -> List[Layout]:
+    """anchors_for_scenario 0..5 của main.py (trục cao là y, sàn 12 x 12 m)."""
+    from scenarios import LM_KW, anchors_for_scenario
+
+    return [
+        Layout(f"S{i}", anchors_to_array(anchors_for_scenario(i)),
+               lo=(0.6, 1.2, 0.6), hi=(11.4, 2.2, 11.4), lm_kwargs=dict(LM_KW))
+        for i in range(6)
+    ]
+
+
+# ---------- Streaming accumulator ----------
+class ErrorStats:
+    """
+    Thống kê sai số dạng streaming (không giữ từng mẫu), gộp được giữa các process:
+    count / sum / max + histogram bin cố định (bin_m) cho percentile, cộng các bộ đếm.
+    """
+
+    def __init__(self, bin_m: float = 1e-3, max_m: float = 20.0):
+        self.bin_m = float(bin_m)
+        self.hist = np.zeros(int(round(max_m / bin_m)) + 1, dtype=np.int64)   # bin cuối = tràn
+        self.trials = 0
+        self.lost = 0        # không đủ hàng đo để giải (dropout)
+        self.solved = 0
+        self.converged = 0
+        self.mirror = 0
+        self.err_sum = 0.0
+        self.err_max = 0.0
+        self.elapsed = 0.0
+
+    def add(self, err: np.ndarray, ok: np.ndarray, mirror: np.ndarray, lost: int = 0) -> None:
+        self.trials += len(err) + lost
+        self.lost += lost
+        if len(err) == 0:
+            return
+        self.solved += len(err)
+        self.converged += int(ok.sum())
+        self.mirror += int(mirror.sum())
+        self.err_sum += float(err.sum())
+        self.err_max = max(self.err_max, float(err.max()))
+        b = np.minimum((err / self.bin_m).astype(np.int64), len(self.hist) - 1)
+        self.hist += np.bincount(b, minlength=len(self.hist))
+
+    def merge(self, other: "ErrorStats") -> "ErrorStats":
+        self.hist += other.hist
+        self.trials += other.trials
+        self.lost += other.lost
+        self.solved += other.solved
+        self.converged += other.converged
+        self.mirror += other.mirror
+        self.err_sum += other.err_sum
+        self.err_max = max(self.err_max, other.err_max)
+        self.elapsed += other.elapsed
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Percentile theo histogram (cận trên của bin, sai số <= bin_m)."""
+        if self.solved == 0:
+            return float("nan")
+        k = int(np.searchsorted(np.cumsum(self.hist), q * self.solved))
+        return self.err_max if k >= len(self.hist) - 1 else min((k + 1) * self.bin_m, self.err_max)
+
+    def summary(self) -> dict:
+        n = max(self.solved, 1)
+        return {
+            "trials": self.trials,
+            "mean": self.err_sum / n if self.solved else float("nan"),
+            "p95": self.quantile(0.95),
+            "max": self.err_max if self.solved else float("nan"),
+            "conv_rate": self.converged / max(self.trials, 1),
+            "mirror_rate": self.mirror / n,
+            "lost_rate": self.lost / max(self.trials, 1),
+            "trials_per_s": self.trials / self.elapsed if self.elapsed > 0 else float("nan"),
+        }
+
+
+# ---------- 1 chunk trial (chạy trong worker) ----------
+def run_trials(layout: Layout, noise_std_m: float, cond: Condition, n: int, seed,
+               mirror_thr: float = 0.30, fn_thr: float = 0.12) -> ErrorStats:
+    """
+    n trial độc lập: vị trí đều trong hộp của layout -> s (nhiễu + NLOS) -> dropout -> LM batch.
+    Mirror hit: LM hội tụ với residual nhỏ (||f|| < fn_thr) nhưng cách nghiệm thật > mirror_thr.
+    """
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    A = anchors_to_array(layout.anchors)
+    K = A.shape[0]
+    meas = make_measurement_set(K)
+    ia, ib = measurement_index(meas, K)
+
+    P = rng.uniform(layout.lo, layout.hi, (n, 3))
+    S = s_from_groundtruth_batch(A, P, noise_std_m, meas=meas, rng=rng)
+    if cond.nlos_prob > 0.0:
+        hit = np.flatnonzero(rng.random(n) < cond.nlos_prob)
+        rows = np.asarray(cond.nlos_rows, dtype=int)
+        S[np.ix_(hit, rows)] += cond.nlos_bias_m + rng.normal(0.0, cond.nlos_extra_noise, (hit.size, rows.size))
+
+    if cond.drop_prob > 0.0:
+        anchor_ok = rng.random((n, K)) >= cond.drop_prob
+        row_ok = anchor_ok[:, ia] & ((ib < 0) | anchor_ok[:, np.maximum(ib, 0)])
+    else:
+        row_ok = np.ones((n, len(meas)), dtype=bool)
+
+    stats = ErrorStats()
+    # Gom trial theo pattern hàng đo còn lại -> mỗi pattern 1 lần LM batch
+    patterns, inv = np.unique(row_ok, axis=0, return_inverse=True)
+    for p, pat in enumerate(patterns):
+        sel = np.flatnonzero(inv.reshape(-1) == p)
+        if pat.sum() < 3:
+            stats.add(np.empty(0), np.empty(0, dtype=bool), np.empty(0, dtype=bool), lost=sel.size)
+            continue
+        sub = tuple(m for m, keep in zip(meas, pat) if keep)
+        X, _, ok, cost = hybrid_solve_LM_batch(A, S[np.ix_(sel, np.flatnonzero(pat))], meas=sub,
+                                               **layout.lm_kwargs)
+        err = np.linalg.norm(X - P[sel], axis=1)
+        mirror = ok & (err > mirror_thr) & (cost < fn_thr * fn_thr)
+        stats.add(err, ok, mirror)
+    stats.elapsed = time.perf_counter() - t0
+    return stats
+
+
+def _run_job(job):
+    cell, layout, noise, cond, n, seed, kw = job
+    return cell, run_trials(layout, noise, cond, n, seed, **kw)
+
+
+# ---------- Sweep ----------
+@dataclass
+class SweepResult:
+    layout: str
+    noise_std_m: float
+    condition: str
+    stats: ErrorStats
+
+    def row(self) -> dict:
+        return {"layout": self.layout, "noise": self.noise_std_m, "cond": self.condition, **self.stats.summary()}
+
+
+def run_sweep(
+        layouts: Sequence[Layout],
+        noise_levels: Sequence[float] = (0.05,),
+        conditions: Sequence[Condition] = (Condition(),),
+        n_trials: int = 10000,
+        chunk: int = 20000,
+        workers: Optional[int] = None,
+        seed: int = 0,
+        progress: Optional[Callable] = None,
+        **trial_kwargs,
+) -> List[SweepResult]:
+    """
+    Quét layouts x noise_levels x conditions, mỗi ô n_trials trial, chia chunk <= chunk trial.
+    - Seed mỗi chunk = SeedSequence(seed, spawn_key=(ô, chunk)) -> kết quả không phụ thuộc
+      số worker hay thứ tự hoàn thành
+    - workers: None = os.cpu_count(), <= 1 = chạy ngay trong process hiện tại
+    - progress(done_chunks, total_chunks) tùy chọn
+    """
+    cells = [(lay, noise, cond) for lay in layouts for noise in noise_levels for cond in conditions]
+    jobs = []
+    for c, (lay, noise, cond) in enumerate(cells):
+        for k, start in enumerate(range(0, n_trials, chunk)):
+            ss = np.random.SeedSequence(seed, spawn_key=(c, k))
+            jobs.append((c, lay, noise, cond, min(chunk, n_trials - start), ss, trial_kwargs))
+
+    acc = [ErrorStats() for _ in cells]
+    workers = os.cpu_count() if workers is None else int(workers)
+    if workers <= 1:
+        done = map(_run_job, jobs)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        done = pool.map(_run_job, jobs)
+    try:
+        for i, (c, st) in enumerate(done, 1):
+            acc[c].merge(st)
+            if progress is not None:
+                progress(i, len(jobs))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return [SweepResult(lay.name, noise, cond.name, acc[c]) for c, (lay, noise, cond) in enumerate(cells)]
+
+
+# ---------- Bảng kết quả ----------
+TABLE_COLS = (       # (khóa summary, tiêu đề, format)
+    ("layout", "layout", "{:<8}"), ("noise", "noise", "{:>6.3f}"), ("cond", "cond", "{:<10}"),
+    ("trials", "trials", "{:>9d}"), ("mean", "mean", "{:>7.3f}"), ("p95", "p95", "{:>7.3f}"),
+    ("max", "max", "{:>7.2f}"), ("conv_rate", "conv", "{:>6.1%}"), ("mirror_rate", "mirror", "{:>6.1%}"),
+    ("lost_rate", "lost", "{:>6.1%}"), ("trials_per_s", "trial/s", "{:>9.0f}"),
+)
+
+
+def format_table(results: Sequence[SweepResult]) -> str:
+    """Bảng text gọn: 1 dòng / ô (sai số theo m)."""
+    rows = [[fmt.format(r.row()[key]) for key, _, fmt in TABLE_COLS] for r in results]
+    widths = [max([len(title)] + [len(row[i]) for row in rows]) for i, (_, title, _) in enumerate(TABLE_COLS)]
+    head = " ".join(f"{title:>{w}}" for (_, title, _), w in zip(TABLE_COLS, widths))
+    lines = [head, "-" * len(head)]
+    lines += [" ".join(f"{c:>{w}}" for c, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def write_table(results: Sequence[SweepResult], path: str) -> None:
+    """.csv -> CSV (đủ chữ số), còn lại -> bảng text của format_table."""
+    with open(path, "w") as f:
+        if path.endswith(".csv"):
+            f.write(",".join(key for key, _, _ in TABLE_COLS) + "\n")
+            for r in results:
+                row = r.row()
+                f.write(",".join(str(row[key]) for key, _, _ in TABLE_COLS) + "\n")
+        else:
+            f.write(format_table(results) + "\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Monte Carlo sweep anchor layout x noise x NLOS/dropout")
+    ap.add_argument("--trials", type=int, default=100000, help="trial / ô")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--noise", type=float, nargs="+", default=[0.02, 0.05, 0.10])
+    ap.add_argument("--out", default=None, help="ghi bảng ra file (.csv hoặc text)")
+    args = ap.parse_args()
+
+    conditions = [
+        Condition("LOS"),
+        Condition("NLOS20%", nlos_prob=0.2),
+        Condition("drop5%", drop_prob=0.05),
+    ]
+    t0 = time.perf_counter()
+    res = run_sweep(main_layouts(), args.noise, conditions, n_trials=args.trials,
+                    workers=args.workers, seed=args.seed)
+    el = time.perf_counter() - t0
+    print(format_table(res))
+    total = sum(r.stats.trials for r in res)
+    print(f"\n{total:,} trials in {el:.1f}s ({total / el:,.0f} trials/s)")
+    if args.out:
+        write_table(res, args.out)
@@ -0,0 +1,267 @@
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import multiprocessing as mp
+import queue
+import threading
+import zlib
+
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+_STOP = None    # sentinel kết thúc luồng dữ liệu
+
+
+# ---------- Stage ----------
+@dataclass
+class Stage:
+    """
+    1 tầng xử lý: fn(item) -> item | None (None = bỏ item, không chuyển tiếp).
+    - workers: số worker song song; item được chia theo item[key] -> mỗi tag luôn vào
+      cùng 1 worker nên thứ tự theo tag được giữ, và state theo tag (vd. Kalman) nằm gọn trong worker đó
+    - mode: "thread" hoặc "process" (process: fn phải pickle được, vd. hàm top-level
+      hoặc instance class có __call__; mỗi process giữ 1 bản state riêng)
+    """
+    name: str
+    fn: Callable
+    workers: int = 1
+    mode: str = "thread"
+
+
+def _route(item, key: str, n: int) -> int:
+    """Chọn worker theo tag. Không dùng hash() vì str hash khác nhau giữa các process."""
+    if n <= 1:
+        return 0
+    k = item[key]
+    if isinstance(k, int):
+        return k % n
+    return zlib.crc32(str(k).encode()) % n
+
+
+def _put(q, item, backpressure: str, dropped) -> None:
+    if backpressure == "block":
+        q.put(item)
+        return
+    try:
+        q.put_nowait(item)
+        return
+    except queue.Full:
+        pass
+    if backpressure == "drop_newest":
+        with dropped.get_lock():
+            dropped.value += 1
+        return
+    # drop_oldest: bỏ item cũ nhất rồi thử lại (có thể race với consumer -> lặp)
+    while True:
+        try:
+            old = q.get_nowait()
+            if old is _STOP:
+                # sentinel của worker tầng trước (>1 upstream) không bao giờ bị bỏ:
+                # trả lại rồi chờ chỗ trống như "block" (chỉ xảy ra lúc kết thúc dòng dữ liệu)
+                q.put(_STOP)
+                q.put(item)
+                return
+            with dropped.get_lock():
+                dropped.value += 1
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            continue
+
+
+def _stage_worker(fn, in_q, out_qs, n_upstream, key, backpressure, processed, dropped):
+    """Vòng lặp của 1 worker (chạy trong thread hoặc process)."""
+    stops = 0
+    n_out = len(out_qs)
+    while True:
+        item = in_q.get()
+        if item is _STOP:
+            stops += 1
+            if stops == n_upstream:
+                break
+            continue
+        out = fn(item)
+        with processed.get_lock():
+            processed.value += 1
+        if out is not None and n_out:
+            _put(out_qs[_route(out, key, n_out)], out, backpressure, dropped)
+    # Sentinel luôn gửi blocking để tầng sau chắc chắn nhận đủ
+    for q in out_qs:
+        q.put(_STOP)
+
+
+# ---------- Pipeline ----------
+class Pipeline:
+    """
+    Pipeline nhiều tầng (ingest -> solve -> filter -> publish) với queue giới hạn giữa các tầng:
+    tầng solve xử lý frame N+1 trong khi tầng publish còn gửi frame N.
+
+    - submit(item): đưa item (dict có field key, mặc định "tag") vào tầng đầu
+    - backpressure khi queue đầy: "block" (chặn tầng trước), "drop_oldest", "drop_newest"
+    - collect=True: kết quả tầng cuối được đưa vào self.results (queue) để đọc lại
+    - close(): gửi sentinel, chờ toàn bộ worker kết thúc
+    """
+
+    def __init__(
+            self,
+            stages: List[Stage],
+            queue_size: int = 64,
+            backpressure: str = "block",
+            key: str = "tag",
+            collect: bool = False,
+    ):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure {backpressure!r}, expected one of {BACKPRESSURE_POLICIES}")
+        for st in stages:
+            if st.mode not in ("thread", "process"):
+                raise ValueError(f"Unknown stage mode {st.mode!r}")
+        self.stages = stages
+        self.backpressure = backpressure
+        self.key = key
+
+        use_mp = any(st.mode == "process" for st in stages)
+        make_q = (lambda: mp.Queue(queue_size)) if use_mp else (lambda: queue.Queue(queue_size))
+
+        # Queue vào của từng worker, theo tầng
+        self._in_qs = [[make_q() for _ in range(max(1, st.workers))] for st in stages]
+        # Kết quả đọc từ thread chính -> không giới hạn để tầng cuối không bị kẹt
+        self.results = None
+        if collect:
+            self.results = mp.Queue() if use_mp else queue.Queue()
+
+        self.processed = [mp.Value("q", 0) for _ in stages]
+        self.dropped = [mp.Value("q", 0) for _ in stages]
+        self.submitted = 0
+        self._submit_dropped = mp.Value("q", 0)
+
+        self._workers = []
+        n_upstream = 1
+        for i, st in enumerate(stages):
+            if i + 1 < len(stages):
+                out_qs = self._in_qs[i + 1]
+            else:
+                out_qs = [self.results] if collect else []
+            for in_q in self._in_qs[i]:
+                args = (st.fn, in_q, out_qs, n_upstream, key, backpressure, self.processed[i], self.dropped[i])
+                if st.mode == "process":
+                    w = mp.Process(target=_stage_worker, args=args, name=f"{st.name}", daemon=True)
+                else:
+                    w = threading.Thread(target=_stage_worker, args=args, name=f"{st.name}", daemon=True)
+                self._workers.append(w)
+            n_upstream = len(self._in_qs[i])
+        self._closed = False
+        self._collected = []
+
+    def start(self) -> "Pipeline":
+        for w in self._workers:
+            w.start()
+        return self
+
+    def submit(self, item) -> None:
+        qs = self._in_qs[0]
+        _put(qs[_route(item, self.key, len(qs))], item, self.backpressure, self._submit_dropped)
+        self.submitted += 1
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Kết thúc dòng dữ liệu: item đang chờ vẫn được xử lý hết."""
+        if self._closed:
+            return
+        self._closed = True
+        for q in self._in_qs[0]:
+            q.put(_STOP)
+        for w in self._workers:
+            # Process chỉ thoát khi đã đẩy hết dữ liệu vào pipe -> vừa join vừa đọc results
+            while self.results is not None and w.is_alive():
+                got = self.drain_results(timeout=0.01)    # drain_results() reset self._collected
+                self._collected.extend(got)
+                w.join(0.01)
+            w.join(timeout)
+
+    def drain_results(self, timeout: float = 0.05) -> list:
+        """Lấy toàn bộ kết quả hiện có (collect=True), bỏ qua sentinel."""
+        out, self._collected = self._collected, []
+        if self.results is None:
+            return out
+        while True:
+            try:
+                item = self.results.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                out.append(item)
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "submit_dropped": self._submit_dropped.value,
+            "stages": {
+                st.name: {"processed": self.processed[i].value, "dropped": self.dropped[i].value}
+                for i, st in enumerate(self.stages)
+            },
+        }
+
+
+# ---------- Tracking stages (pickle được -> dùng được cả mode="process") ----------
+class SolveStage:
+    """item["anchors"], item["s"] -> thêm item["est"], item["ok"], item["cost"], item["it"]."""
+
+    def __init__(self, **lm_kwargs):
+        self.lm_kwargs = lm_kwargs
+
+    def __call__(self, item):
+        from hybrid_scalable import hybrid_solve_LM
+
+        est, it, ok, cost = hybrid_solve_LM(item["anchors"], item["s"], **self.lm_kwargs)
+        item["est"], item["it"], item["ok"], item["cost"] = est, it, ok, cost
+        return item
+
+
+class FilterStage:
+    """
+    Giữ 1 AdaptiveGMCKalman3D cho mỗi tag (tag luôn vào cùng worker nên state không bị chia).
+    item["t"] (hoặc item["dt"]), item["est"], item["ok"] -> thêm item["pos"] (Vec3 đã lọc).
+    Có item["t"] thì dt tính theo frame trước của tag -> đúng cả khi backpressure bỏ frame.
+    Không có cả "t" lẫn "dt" -> dùng default_dt.
+    """
+
+    def __init__(self, default_dt: float = 0.1, **kf_kwargs):
+        self.default_dt = float(default_dt)
+        self.kf_kwargs = kf_kwargs
+        self.filters = {}
+        self.last_t = {}
+
+    def __call__(self, item):
+        from gmc_kalman_filter import AdaptiveGMCKalman3D, Vec3
+
+        tag = item["tag"]
+        kf = self.filters.get(tag)
+        est = item["est"]
+        t = item.get("t")
+        last_t = self.last_t.get(tag)
+        if t is not None and last_t is not None:
+            dt = t - last_t
+        else:
+            dt = item.get("dt")
+            if dt is None:
+                dt = self.default_dt
+        if kf is None:
+            if not item["ok"]:
+                return None      # chưa có điểm khởi tạo tin cậy
+            kf = AdaptiveGMCKalman3D(**self.kf_kwargs)
+            kf.reset(Vec3(est.x, est.y, est.z))
+            self.filters[tag] = kf
+            self.last_t[tag] = t
+            item["pos"] = kf.get_state_vec3()
+            return item
+        kf.predict(dt)
+        self.last_t[tag] = t
+        if item["ok"]:
+            item["pos"] = kf.update(Vec3(est.x, est.y, est.z), hybrid_cost=item["cost"])
+        else:
+            item["pos"] = kf.get_state_vec3()
+        return item
@@ -0,0 +1,277 @@
+from collections import deque
+from typing import Callable, Dict, List, Optional
+import threading
+import time
+
+
+# ---------- Sender (transport) ----------
+def http_batch_sender(url: str, timeout: float = 0.25, pool_size: int = 4) -> Callable[[List[dict]], None]:
+    """
+    POST cả batch dạng JSON {"positions": [...]} lên BE (/push-batch).
+    Dùng 1 requests.Session keep-alive -> không mở kết nối mới mỗi frame.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def send(batch: List[dict]) -> None:
+        r = session.post(url, json={"positions": batch}, timeout=timeout)
+        r.raise_for_status()
+
+    return send
+
+
+def http_binary_sender(url: str, timeout: float = 0.25, pool_size: int = 4) -> Callable[[List[dict]], None]:
+    """
+    Như http_batch_sender nhưng body là frame nhị phân (wire.py) lên /push-bin.
+    Tag id phải là số nguyên.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    from wire import encode_items
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    headers = {"Content-Type": "application/octet-stream"}
+
+    def send(batch: List[dict]) -> None:
+        r = session.post(url, data=encode_items(batch), headers=headers, timeout=timeout)
+        r.raise_for_status()
+
+    return send
+
+
+def socketio_batch_sender(sio, event: str = "tags-update") -> Callable[[List[dict]], None]:
+    """Emit cả batch thành 1 message Socket.IO (bỏ qua khi chưa connect)."""
+
+    def send(batch: List[dict]) -> None:
+        if sio is None or not sio.connected:
+            raise ConnectionError("Socket.IO not connected")
+        sio.emit(event, {"positions": batch})
+
+    return send
+
+
+# ---------- Non-blocking publisher ----------
+class PositionPublisher:
+    """
+    Publisher vị trí tag không chặn vòng lọc:
+    - publish() chỉ append vào hàng đợi giới hạn (O(1), không I/O)
+    - Hàng đợi đầy -> bỏ vị trí CŨ NHẤT trước (dropped)
+    - Thread nền gom hàng đợi, mỗi tag chỉ giữ vị trí mới nhất (coalesced)
+      rồi gửi 1 request / 1 message cho cả batch
+    - stats() trả về các bộ đếm để theo dõi
+    """
+
+    def __init__(
+            self,
+            send: Callable[[List[dict]], None],
+            max_queue: int = 256,
+            max_batch: int = 64,
+            flush_interval: float = 0.05,
+    ):
+        self.send = send
+        self.max_batch = int(max_batch)
+        self.flush_interval = float(flush_interval)
+
+        self._queue = deque(maxlen=int(max_queue))
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent_batches = 0
+        self.sent_positions = 0
+        self.send_errors = 0
+
+    # ----- Producer side (gọi từ vòng lọc) -----
+    def publish(
+            self,
+            tag_id,
+            x: float,
+            y: float,
+            z: float,
+            ts: Optional[float] = None,
+            anchor_version: Optional[int] = None,
+    ) -> None:
+        item = {
+            "id": tag_id,
+            "x": round(float(x), 3),
+            "y": round(float(y), 3),
+            "z": round(float(z), 3),
+            "ts": round(time.time() if ts is None else ts, 3),
+        }
+        if anchor_version is not None:
+            item["av"] = anchor_version    # chỉ gửi version, không gửi lại toạ độ anchor
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1          # deque(maxlen) tự đẩy phần tử cũ nhất ra
+            self._queue.append(item)
+            self.enqueued += 1
+            self._cond.notify()
+
+    # ----- Consumer side (thread nền) -----
+    def _drain(self) -> List[dict]:
+        """Lấy hết hàng đợi, mỗi tag giữ vị trí mới nhất (giữ thứ tự xuất hiện)."""
+        with self._cond:
+            items = list(self._queue)
+            self._queue.clear()
+
+        latest: Dict[object, dict] = {}
+        for it in items:
+            latest.pop(it["id"], None)
+            latest[it["id"]] = it
+        self.coalesced += len(items) - len(latest)
+        return list(latest.values())
+
+    def flush(self) -> int:
+        """Gửi đồng bộ những gì đang chờ. Trả về số vị trí đã gửi."""
+        batch = self._drain()
+        sent = 0
+        for i in range(0, len(batch), self.max_batch):
+            chunk = batch[i:i + self.max_batch]
+            try:
+                self.send(chunk)
+                self.sent_batches += 1
+                self.sent_positions += len(chunk)
+                sent += len(chunk)
+            except Exception:
+                self.send_errors += 1
+        return sent
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running and not self._queue:
+                    return
+            # Chờ thêm 1 chút để gom nhiều vị trí vào cùng batch
+            if self.flush_interval > 0 and self._running:
+                time.sleep(self.flush_interval)
+            self.flush()
+
+    def start(self) -> "PositionPublisher":
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="position-publisher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """Dừng thread nền; phần còn trong hàng đợi được flush lần cuối."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "sent_batches": self.sent_batches,
+            "sent_positions": self.sent_positions,
+            "send_errors": self.send_errors,
+            "pending": self.pending(),
+        }
+
+
+# ---------- Versioned anchor sets ----------
+class AnchorBroadcaster:
+    """
+    Anchor là cấu hình có version, không phải dữ liệu theo frame:
+    - update(anchors, zone) chỉ emit khi toạ độ (làm tròn mm) thay đổi -> version mới
+    - Version duy nhất trên mọi zone -> 1 số nguyên đủ để BE tra ra anchor set
+    - Emit lỗi (mất kết nối) -> zone giữ cờ dirty, thử lại ở lần update/resend sau
+    - resend_all() gọi khi reconnect: gửi lại version hiện tại của mọi zone
+    - Vị trí tag chỉ mang version (PositionPublisher.publish(..., anchor_version=v))
+    """
+
+    def __init__(self, emit: Callable[[str, dict], None], event: str = "anchors-update"):
+        self.emit = emit
+        self.event = event
+        self._zones: Dict[object, dict] = {}   # zone -> {"key", "version", "payload", "dirty"}
+        self.broadcasts = 0
+        self.skipped = 0
+        self.emit_errors = 0
+        self._last_version = 0
+
+    @staticmethod
+    def _anchor_key(anchors) -> tuple:
+        return tuple((round(a.x, 3), round(a.y, 3), round(a.z, 3)) for a in anchors)
+
+    def _send(self, entry: dict) -> bool:
+        try:
+            self.emit(self.event, entry["payload"])
+        except Exception:
+            self.emit_errors += 1
+            entry["dirty"] = True
+            return False
+        entry["dirty"] = False
+        self.broadcasts += 1
+        return True
+
+    def update(self, anchors, zone="default") -> int:
+        """Khai báo anchor của zone cho frame hiện tại. Trả về version đang dùng."""
+        key = self._anchor_key(anchors)
+        entry = self._zones.get(zone)
+        if entry is not None and entry["key"] == key:
+            if entry["dirty"]:
+                self._send(entry)
+            else:
+                self.skipped += 1
+            return entry["version"]
+
+        self._last_version += 1
+        version = self._last_version
+        payload = {f"A{i}": {"x": p[0], "y": p[1], "z": p[2]} for i, p in enumerate(key)}
+        payload["zone"] = zone
+        payload["version"] = version
+        entry = {"key": key, "version": version, "payload": payload, "dirty": True}
+        self._zones[zone] = entry
+        self._send(entry)
+        return version
+
+    def version(self, zone="default") -> Optional[int]:
+        entry = self._zones.get(zone)
+        return None if entry is None else entry["version"]
+
+    def mark_dirty(self, zone, version: Optional[int] = None) -> bool:
+        """
+        Emit đã nhận message nhưng sau đó làm mất (vd. hàng đợi gửi bất đồng bộ bỏ / lỗi) -> gửi lại
+        ở lần update/resend sau. version khác version hiện tại của zone (đã có anchor mới) -> bỏ qua.
+        """
+        entry = self._zones.get(zone)
+        if entry is None or (version is not None and entry["version"] != version):
+            return False
+        entry["dirty"] = True
+        return True
+
+    def resend_all(self) -> int:
+        """Gửi lại toàn bộ zone (vd. sau reconnect). Trả về số zone gửi thành công."""
+        return sum(self._send(entry) for entry in self._zones.values())
+
+    def stats(self) -> dict:
+        return {
+            "zones": len(self._zones),
+            "broadcasts": self.broadcasts,
+            "skipped": self.skipped,
+            "emit_errors": self.emit_errors,
+        }
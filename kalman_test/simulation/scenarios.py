@@ -0,0 +1,115 @@
+import math
+
+from hybrid_scalable import Vec3, s_from_groundtruth
+
+
+# Layout anchor, quỹ đạo tag mô phỏng + tham số LM / Kalman của main.py, tách riêng để import không kéo
+# theo side effect của main (Socket.IO client, Kalman / Instrumentation toàn cục) - vd. montecarlo.py, bench.py.
+
+SCENARIO_DUR_S = 10.0
+NUM_SCENARIOS = 6
+
+# Ở đây trục cao là y, z là trục sàn 0..12 m -> nới z-clamp mặc định (0.2..3.5) của LM,
+# nếu không warm start từ z > 3.5 sẽ bị kẹt tại chỗ. up: linear init chọn nghiệm dưới mặt phẳng anchor theo y
+LM_KW = {"z_min": 0.0, "z_max": 12.0, "up": (0.0, 1.0, 0.0)}
+
+KF_KW = {"process_var": 0.8, "meas_var": 0.7, "alpha": 1.0, "beta_init": 1.0}
+
+# Tracking mode: seed LM từ dự đoán Kalman, fallback cold start nếu cost > gate
+WARM_MAX_COST = 0.05
+
+# Publisher nền: vòng lọc chỉ enqueue, thread riêng gom + POST batch (keep-alive)
+PUBLISH_QUEUE = 256
+
+
+def anchors_for_scenario(idx: int):
+    if idx == 0:
+        return [
+            Vec3(0.0, 2.8, 0.0),
+            Vec3(12.0, 2.8, 0.0),
+            Vec3(0.0, 2.8, 12.0),
+            Vec3(12.0, 2.8, 12.0),
+        ]
+    if idx == 1:
+        return [
+            Vec3(1.0, 2.8, 1.0),
+            Vec3(11.0, 2.8, 1.0),
+            Vec3(1.0, 2.8, 11.0),
+            Vec3(11.0, 2.8, 11.0),
+        ]
+    if idx == 2:
+        return [
+            Vec3(0.0, 2.8, 0.0),
+            Vec3(12.0, 2.8, 0.0),
+            Vec3(0.0, 1.4, 12.0),
+            Vec3(12.0, 1.4, 12.0),
+        ]
+    if idx == 3:
+        return [
+            Vec3(0.0, 2.8, 0.0),
+            Vec3(12.0, 1.4, 0.0),
+            Vec3(0.0, 2.0, 12.0),
+            Vec3(12.0, 2.8, 12.0),
+        ]
+    if idx == 4:
+        return [
+            Vec3(0.0, 2.0, 0.0),
+            Vec3(4.0, 2.0, 0.0),
+            Vec3(8.0, 2.0, 0.0),
+            Vec3(12.0, 2.2, 2.0),
+        ]
+    if idx == 5:
+        return [
+            Vec3(0.0, 2.0, 0.0),
+            Vec3(0.5, 2.0, 0.1),
+            Vec3(1.0, 2.0, 0.0),
+            Vec3(1.5, 2.1, 0.1),
+        ]
+    return anchors_for_scenario(0)
+
+
+def clamp(v, lo, hi):
+    return max(lo, min(hi, v))
+
+
+def tag_trajectory(seg_t: float, scenario_idx: int):
+    cx, cz = 6.0, 6.0
+
+    if scenario_idx == 0:
+        rx, rz = 5.0, 4.2
+    elif scenario_idx == 1:
+        rx, rz = 5.2, 2.8
+    elif scenario_idx == 2:
+        rx, rz = 4.2, 5.2
+    elif scenario_idx == 3:
+        rx, rz = 4.8, 4.8
+    else:
+        rx, rz = 5.6, 2.0
+
+    omega = (2.0 * math.pi) / SCENARIO_DUR_S
+    ang = omega * seg_t
+
+    x = cx + rx * math.cos(ang)
+    z = cz + rz * math.sin(ang)
+    y = 1.55 + 0.18 * math.sin(ang * 1.2)
+
+    return Vec3(
+        clamp(x, 0.6, 11.4),
+        clamp(y, 1.2, 2.2),
+        clamp(z, 0.6, 11.4),
+    )
+
+
+def scenario_of_time(t: float):
+    seg_idx = int(t // SCENARIO_DUR_S)
+    idx = seg_idx % NUM_SCENARIOS
+    seg_t = t - seg_idx * SCENARIO_DUR_S
+    return idx, seg_t
+
+
+def get_measure(step, t):
+    scenario_idx, seg_t = scenario_of_time(t)
+    anchors = anchors_for_scenario(scenario_idx)
+    gt = tag_trajectory(seg_t, scenario_idx)
+    s = s_from_groundtruth(anchors, gt, noise_std_m=0.05)
+    return scenario_idx, seg_t, anchors, s, gt
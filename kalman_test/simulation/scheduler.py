@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from typing import Callable
+import time
+
+import numpy as np
+
+
+SCHED_POLICIES = ("skip", "merge")
+
+
+# ---------- Frame tick ----------
+@dataclass
+class Tick:
+    index: int        # số thứ tự deadline trên lưới t0 + index * period
+    t: float          # thời điểm thực (s, tính từ start)
+    dt: float         # dt thực kể từ tick trước -> đưa vào kf.predict
+    late: float       # trễ so với deadline (s), >= 0
+    missed: int       # số deadline bị bỏ qua / gộp vào tick này
+
+
+# ---------- Deadline-driven fixed-rate scheduler ----------
+class FrameScheduler:
+    """
+    Lịch chạy tần số cố định theo deadline tuyệt đối t0 + k * period (monotonic clock):
+    - Không cộng dồn thời gian xử lý như time.sleep(dt) -> không trôi pha
+    - tick.dt là khoảng thời gian thực giữa 2 tick (không giả định = period)
+    - Xử lý vượt deadline kế tiếp (tụt sau):
+        "skip" : bỏ các deadline đã lỡ, chờ tới điểm lưới kế tiếp
+        "merge": chạy ngay 1 frame gộp các deadline đã lỡ (dt lớn hơn), rồi bám lại lưới
+    - stats(): overrun, frame bị bỏ/gộp, jitter (mean/p95/max) trên cửa sổ gần nhất
+    """
+
+    def __init__(
+            self,
+            period: float = 0.1,
+            policy: str = "skip",
+            spin: float = 0.001,
+            window: int = 1024,
+            clock: Callable[[], float] = time.perf_counter,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        if period <= 0:
+            raise ValueError("period must be > 0")
+        if policy not in SCHED_POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {SCHED_POLICIES}")
+        self.period = float(period)
+        self.policy = policy
+        self.spin = float(spin)      # busy-wait phần cuối để sleep() không trễ ~1 ms
+        self.clock = clock
+        self.sleep = sleep
+
+        self._late = np.zeros(int(window))
+        self._n_late = 0
+        self.reset()
+
+    def reset(self):
+        self.t0 = self.clock()
+        self.k = 0
+        self.last_t = 0.0
+        self.frames = 0
+        self.overruns = 0
+        self.missed = 0
+        self._n_late = 0
+
+    def _wait_until(self, deadline: float) -> float:
+        remaining = deadline - self.clock()
+        if remaining > self.spin:
+            self.sleep(remaining - self.spin)
+        now = self.clock()
+        if self.spin > 0:
+            while now < deadline:
+                now = self.clock()
+        return now
+
+    def _next_deadline(self):
+        """Chọn deadline kế tiếp theo policy khi bị tụt. Trả về (k, deadline, missed)."""
+        now = self.clock()
+        k = self.k + 1
+        missed = 0
+        behind = int((now - self.t0) // self.period) - k + 1    # số deadline đã qua, tính từ k
+        if self.frames > 0 and now - (self.t0 + self.last_t) > self.period:
+            self.overruns += 1            # frame trước xử lý lâu hơn 1 chu kỳ
+        if behind > 1:
+            if self.policy == "skip":
+                missed = behind           # bỏ hết deadline đã lỡ, chờ điểm lưới đầu tiên sau now
+            else:
+                missed = behind - 1       # chạy ngay tại deadline lỡ gần nhất
+            k += missed
+            self.missed += missed
+        return k, self.t0 + k * self.period, missed
+
+    def _tick(self, k: int, deadline: float, missed: int, now: float) -> Tick:
+        late = max(0.0, now - deadline)
+        t = now - self.t0
+        dt = t - self.last_t
+        self.k = k
+        self.last_t = t
+        self.frames += 1
+        self._late[self._n_late % len(self._late)] = late
+        self._n_late += 1
+        return Tick(index=k, t=t, dt=dt, late=late, missed=missed)
+
+    def wait(self) -> Tick:
+        """Chờ tới deadline kế tiếp và trả về Tick của frame mới."""
+        k, deadline, missed = self._next_deadline()
+        now = self._wait_until(deadline)
+        return self._tick(k, deadline, missed, now)
+
+    async def wait_async(self) -> Tick:
+        """Như wait() nhưng nhường event loop (asyncio.sleep) thay vì chặn thread."""
+        import asyncio
+
+        k, deadline, missed = self._next_deadline()
+        remaining = deadline - self.clock()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        return self._tick(k, deadline, missed, self.clock())
+
+    def __iter__(self):
+        while True:
+            yield self.wait()
+
+    def stats(self) -> dict:
+        late = self._late[:min(self._n_late, len(self._late))]
+        if len(late) == 0:
+            late = np.zeros(1)
+        return {
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "missed": self.missed,
+            "jitter_mean_ms": float(late.mean() * 1e3),
+            "jitter_p95_ms": float(np.percentile(late, 95) * 1e3),
+            "jitter_max_ms": float(late.max() * 1e3),
+        }
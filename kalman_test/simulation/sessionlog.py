@@ -0,0 +1,331 @@
+from typing import Dict, Optional
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+# ---------- Schema ----------
+def session_schema(n_anchors: int = 4, n_meas: int = 5) -> Dict[str, tuple]:
+    """Cột -> (dtype, số phần tử mỗi hàng). 1 hàng = 1 tag tại 1 frame."""
+    return {
+        "t": ("<f8", 1),
+        "tag": ("<i8", 1),
+        "anchors": ("<f8", 3 * n_anchors),
+        "s": ("<f8", n_meas),
+        "est": ("<f8", 3),          # nghiệm LM
+        "ok": ("|b1", 1),
+        "cost": ("<f8", 1),
+        "it": ("<i4", 1),
+        "filt": ("<f8", 3),         # vị trí sau Kalman
+    }
+
+
+INDEX_FILE = "chunks.jsonl"
+META_FILE = "meta.json"
+
+
+# ---------- Writer ----------
+class SessionLogWriter:
+    """
+    Log phiên đo dạng cột, append-only, chia chunk:
+    - append() chỉ ghi vào buffer numpy cấp phát sẵn (không I/O trên hot path)
+    - Chunk đầy -> chuyển cho thread nền ghi ra đĩa, hot path đổi sang buffer mới
+    - Chunk không nén: mỗi cột 1 file .npy (đọc lại bằng mmap); compress=True: 1 file .npz / chunk
+    - chunks.jsonl: mỗi chunk ghi xong append 1 dòng -> log đọc được cả khi process chết giữa chừng
+    """
+
+    def __init__(self, path: str, n_anchors: int = 4, n_meas: int = 5,
+                 chunk_rows: int = 4096, compress: bool = False, max_pending: int = 8,
+                 extra_meta: Optional[dict] = None):
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            raise FileExistsError(f"session log already exists: {path}")
+        self.path = path
+        self.schema = session_schema(n_anchors, n_meas)
+        self.chunk_rows = int(chunk_rows)
+        self.compress = compress
+
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump({
+                "version": 1,
+                "n_anchors": n_anchors,
+                "n_meas": n_meas,
+                "compress": compress,
+                "columns": {k: [dt, w] for k, (dt, w) in self.schema.items()},
+                "created": time.time(),
+                **(extra_meta or {}),
+            }, f)
+
+        self._buf = self._new_buffers()
+        self._n = 0
+        self._chunk_id = 0
+        self.rows = 0
+        self.dropped_chunks = 0
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._writer_loop, name="session-log", daemon=True)
+        self._thread.start()
+
+    def _new_buffers(self) -> Dict[str, np.ndarray]:
+        return {
+            k: np.zeros((self.chunk_rows,) if w == 1 else (self.chunk_rows, w), dtype=dt)
+            for k, (dt, w) in self.schema.items()
+        }
+
+    # ----- Hot path -----
+    def append(self, t, tag, anchors, s, est=None, ok=False, cost=np.nan, it=0, filt=None) -> None:
+        """1 hàng. anchors: list Vec3 hoặc mảng (K,3); est/filt: Vec3 hoặc (3,)."""
+        i = self._n
+        b = self._buf
+        b["t"][i] = t
+        b["tag"][i] = tag
+        b["anchors"][i] = _flat3(anchors)
+        b["s"][i] = s
+        b["est"][i] = np.nan if est is None else _flat3(est)
+        b["ok"][i] = ok
+        b["cost"][i] = cost
+        b["it"][i] = it
+        b["filt"][i] = np.nan if filt is None else _flat3(filt)
+        self._n = i + 1
+        if self._n == self.chunk_rows:
+            self._flush_chunk()
+
+    def append_batch(self, t, tags, anchors, S, est=None, ok=None, cost=None, it=None, filt=None) -> None:
+        """N hàng cùng lúc (vd. từ MeasurementBatch / hybrid_solve_LM_batch)."""
+        tags = np.asarray(tags).reshape(-1)
+        n = len(tags)
+        cols = {
+            "t": np.broadcast_to(np.asarray(t, dtype=float), (n,)),
+            "tag": tags,
+            "anchors": np.broadcast_to(np.asarray(anchors, dtype=float).reshape(-1, self.schema["anchors"][1]),
+                                       (n, self.schema["anchors"][1])),
+            "s": np.asarray(S, dtype=float).reshape(n, -1),
+            "est": np.full((n, 3), np.nan) if est is None else np.asarray(est, dtype=float).reshape(n, 3),
+            "ok": np.zeros(n, dtype=bool) if ok is None else np.asarray(ok, dtype=bool),
+            "cost": np.full(n, np.nan) if cost is None else np.asarray(cost, dtype=float),
+            "it": np.zeros(n, dtype=np.int32) if it is None else np.asarray(it),
+            "filt": np.full((n, 3), np.nan) if filt is None else np.asarray(filt, dtype=float).reshape(n, 3),
+        }
+        done = 0
+        while done < n:
+            take = min(n - done, self.chunk_rows - self._n)
+            for k, v in cols.items():
+                self._buf[k][self._n:self._n + take] = v[done:done + take]
+            self._n += take
+            done += take
+            if self._n == self.chunk_rows:
+                self._flush_chunk()
+
+    def _flush_chunk(self) -> None:
+        if self._n == 0:
+            return
+        n = self._n
+        chunk = {k: v[:n] for k, v in self._buf.items()}
+        self._buf = self._new_buffers()
+        self._n = 0
+        try:
+            self._queue.put_nowait((self._chunk_id, chunk))
+            self._chunk_id += 1
+            self.rows += n
+        except queue.Full:
+            # Đĩa không theo kịp: bỏ chunk thay vì chặn vòng realtime
+            self.dropped_chunks += 1
+
+    # ----- Thread nền -----
+    def _writer_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            cid, chunk = job
+            name = f"chunk_{cid:06d}"
+            if self.compress:
+                np.savez_compressed(os.path.join(self.path, name + ".npz"), **chunk)
+            else:
+                for k, v in chunk.items():
+                    np.save(os.path.join(self.path, f"{name}.{k}.npy"), v)
+            with open(os.path.join(self.path, INDEX_FILE), "a") as f:
+                f.write(json.dumps({
+                    "chunk": name,
+                    "rows": int(len(chunk["t"])),
+                    "t0": float(chunk["t"][0]),
+                    "t1": float(chunk["t"][-1]),
+                }) + "\n")
+
+    def close(self) -> None:
+        self._flush_chunk()
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _flat3(v) -> np.ndarray:
+    if hasattr(v, "x"):
+        return np.array([v.x, v.y, v.z], dtype=float)
+    if isinstance(v, (list, tuple)) and v and hasattr(v[0], "x"):
+        return np.array([[a.x, a.y, a.z] for a in v], dtype=float).reshape(-1)
+    return np.asarray(v, dtype=float).reshape(-1)
+
+
+# ---------- Reader ----------
+class SessionLog:
+    """Đọc log: load() ghép toàn bộ cột (chunk không nén được mmap), iter_chunks() theo từng chunk."""
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        self.mmap = mmap
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.chunks = []
+        index = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index):
+            with open(index) as f:
+                self.chunks = [json.loads(line) for line in f if line.strip()]
+        self.chunks.sort(key=lambda c: c["chunk"])
+        self.rows = sum(c["rows"] for c in self.chunks)
+
+    def _load_chunk(self, name: str) -> Dict[str, np.ndarray]:
+        cols = self.meta["columns"]
+        if self.meta["compress"]:
+            with np.load(os.path.join(self.path, name + ".npz")) as z:
+                return {k: z[k] for k in cols}
+        mode = "r" if self.mmap else None
+        return {k: np.load(os.path.join(self.path, f"{name}.{k}.npy"), mmap_mode=mode) for k in cols}
+
+    def iter_chunks(self):
+        for c in self.chunks:
+            yield self._load_chunk(c["chunk"])
+
+    def load(self) -> Dict[str, np.ndarray]:
+        parts = list(self.iter_chunks())
+        if not parts:
+            return {k: np.zeros((0,) if w == 1 else (0, w), dtype=dt)
+                    for k, (dt, w) in self.meta["columns"].items()}
+        if len(parts) == 1:
+            return parts[0]
+        return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+# ---------- Replay ----------
+def replay_session(path: str, warm_start: Optional[bool] = None, lm_kwargs: Optional[dict] = None,
+                   kf_kwargs: Optional[dict] = None) -> dict:
+    """
+    Chạy lại hybrid_solve_LM (+ warm start) và AdaptiveGMCKalman3D trên log đã ghi, không sleep
+    (bulk mode). Mỗi tag có bộ lọc riêng, dt lấy từ cột t; lm_kwargs / kf_kwargs mặc định lấy từ meta.
+
+    Meta (extra_meta của writer) mô tả vòng đã ghi để replay tái lập đúng:
+    - "warm_start" (mặc định True), "warm_max_cost": max_cost của hybrid_solve_tracking (mặc định 0.05)
+    - "kf_gate": "cost" -> kf.update(est, hybrid_cost=cost), "none" -> kf.update(est) (mặc định "cost")
+    - "kf_init": {tag: {"t", "pos"}} trạng thái bộ lọc trước hàng đầu tiên (vd. reset từ frame không ghi);
+      tag không có -> reset từ nghiệm cold của hàng đầu tiên
+
+    Trả về {"est", "ok", "it", "filt", "elapsed_s", "span_s", "speedup", "est_diff", "filt_diff"};
+    *_diff: sai khác lớn nhất so với giá trị đã ghi (regression).
+    """
+    from hybrid_scalable import Vec3 as HVec3, hybrid_solve_LM, hybrid_solve_tracking
+    from gmc_kalman_filter import AdaptiveGMCKalman3D, Vec3
+
+    reader = SessionLog(path)
+    # Mặc định dùng đúng tham số đã ghi trong meta (extra_meta của writer)
+    lm_kwargs = reader.meta.get("lm_kwargs", {}) if lm_kwargs is None else lm_kwargs
+    kf_kwargs = {"process_var": 0.8, "meas_var": 0.7, "fast_update": True,
+                 **reader.meta.get("kf_kwargs", {}), **(kf_kwargs or {})}
+    warm_start = reader.meta.get("warm_start", True) if warm_start is None else warm_start
+    max_cost = reader.meta.get("warm_max_cost", 0.05)
+    gate = reader.meta.get("kf_gate", "cost")
+    if gate not in ("cost", "none"):
+        raise ValueError(f"unknown kf_gate {gate!r} in session meta")
+    log = reader.load()
+    n = len(log["t"])
+    K = log["anchors"].shape[1] // 3
+
+    est_out = np.full((n, 3), np.nan)
+    filt_out = np.full((n, 3), np.nan)
+    ok_out = np.zeros(n, dtype=bool)
+    it_out = np.zeros(n, dtype=np.int32)
+    filters = {}
+    for tag, init in reader.meta.get("kf_init", {}).items():
+        kf = AdaptiveGMCKalman3D(**kf_kwargs)
+        kf.reset(Vec3(*init["pos"]))
+        filters[int(tag)] = (kf, float(init["t"]))
+
+    t_start = time.perf_counter()
+    A_all = log["anchors"].reshape(n, K, 3)
+    for i in range(n):
+        tag = int(log["tag"][i])
+        t = float(log["t"][i])
+        anchors = [HVec3(*a) for a in A_all[i].tolist()]
+        s = log["s"][i].tolist()
+        entry = filters.get(tag)
+
+        if entry is not None and warm_start:
+            kf, t_prev = entry
+            kf.predict(t - t_prev)
+            est, it, ok, cost, _ = hybrid_solve_tracking(anchors, s, prior=kf.get_state_vec3(),
+                                                         max_cost=max_cost, **lm_kwargs)
+        else:
+            if entry is not None:
+                entry[0].predict(t - entry[1])
+            est, it, ok, cost = hybrid_solve_LM(anchors, s, **lm_kwargs)
+
+        if entry is None:
+            if ok:
+                kf = AdaptiveGMCKalman3D(**kf_kwargs)
+                kf.reset(Vec3(est.x, est.y, est.z))
+                pos = kf.get_state_vec3()
+                filters[tag] = (kf, t)
+                filt_out[i] = (pos.x, pos.y, pos.z)
+        else:
+            kf = entry[0]
+            if not ok:
+                pos = kf.get_state_vec3()
+            elif gate == "cost":
+                pos = kf.update(Vec3(est.x, est.y, est.z), hybrid_cost=cost)
+            else:
+                pos = kf.update(Vec3(est.x, est.y, est.z))
+            filters[tag] = (kf, t)
+            filt_out[i] = (pos.x, pos.y, pos.z)
+
+        est_out[i] = (est.x, est.y, est.z)
+        ok_out[i] = ok
+        it_out[i] = it
+    elapsed = time.perf_counter() - t_start
+
+    span = float(log["t"].max() - log["t"].min()) if n else 0.0
+
+    def max_diff(a, b):
+        m = np.isfinite(a).all(axis=1) & np.isfinite(b).all(axis=1)
+        return float(np.abs(a[m] - b[m]).max()) if m.any() else float("nan")
+
+    return {
+        "est": est_out,
+        "ok": ok_out,
+        "it": it_out,
+        "filt": filt_out,
+        "rows": n,
+        "elapsed_s": elapsed,
+        "span_s": span,
+        "speedup": span / elapsed if elapsed > 0 else float("inf"),
+        "est_diff": max_diff(est_out, np.asarray(log["est"])),
+        "filt_diff": max_diff(filt_out, np.asarray(log["filt"])),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("usage: python sessionlog.py <session_dir> [--cold]")
+        sys.exit(1)
+    res = replay_session(sys.argv[1], warm_start=False if "--cold" in sys.argv else None)
+    print(f"rows={res['rows']} span={res['span_s']:.1f}s replay={res['elapsed_s']:.2f}s "
+          f"(x{res['speedup']:.0f} realtime) ok={res['ok'].mean() * 100:.1f}% "
+          f"mean_it={res['it'].mean():.1f} | max |Δest|={res['est_diff']:.2e} m, |Δfilt|={res['filt_diff']:.2e} m")
@@ -0,0 +1,312 @@
+from multiprocessing import shared_memory
+from typing import Optional
+import multiprocessing as mp
+
+import numpy as np
+
+from hybrid_scalable import hybrid_solve_LM_batch
+from gmc_kalman_filter import GMCKalmanBank
+
+
+# Cột kết quả mỗi tag: [tag, t, x, y, z, ok, cost, updated]
+OUT_COLS = 8
+
+
+# ---------- Shared-memory ring buffer (1 producer / 1 consumer) ----------
+class ShmRing:
+    """
+    Ring buffer n_slots ô, mỗi ô là 1 batch (max_rows, width) float64 trong shared memory.
+    Hàng 0 của ô là header [n_rows, kind]; kind = 1 dữ liệu, -1 dừng.
+    Đồng bộ bằng 2 semaphore (items / spaces) -> không pickle dữ liệu, chỉ copy vào/ra shm.
+    """
+
+    KIND_DATA = 1.0
+    KIND_STOP = -1.0
+
+    def __init__(self, n_slots: int, max_rows: int, width: int):
+        self.shape = (int(n_slots), int(max_rows) + 1, int(width))
+        nbytes = int(np.prod(self.shape)) * 8
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.name = self._shm.name
+        self._owner = True
+        self.items = mp.Semaphore(0)
+        self.spaces = mp.Semaphore(int(n_slots))
+        self._attach_view()
+
+    def _attach_view(self):
+        self.buf = np.ndarray(self.shape, dtype=np.float64, buffer=self._shm.buf)
+        self.pos = 0    # con trỏ riêng của phía đang dùng (producer: head, consumer: tail)
+
+    def __getstate__(self):
+        return {"shape": self.shape, "name": self.name, "items": self.items, "spaces": self.spaces}
+
+    def __setstate__(self, state):
+        self.shape = state["shape"]
+        self.name = state["name"]
+        self.items = state["items"]
+        self.spaces = state["spaces"]
+        self._shm = shared_memory.SharedMemory(name=self.name)
+        self._owner = False
+        try:
+            # Process con chỉ attach: không để resource_tracker unlink hộ khi con thoát
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+        self._attach_view()
+
+    @property
+    def max_rows(self) -> int:
+        return self.shape[1] - 1
+
+    def put(self, rows: Optional[np.ndarray], timeout: Optional[float] = None) -> bool:
+        """Ghi 1 batch (n, width) vào ô kế tiếp. rows=None -> gói dừng. Trả về False nếu timeout."""
+        if not self.spaces.acquire(timeout=timeout):
+            return False
+        slot = self.buf[self.pos % self.shape[0]]
+        if rows is None:
+            slot[0, 0:2] = (0.0, self.KIND_STOP)
+        else:
+            n = rows.shape[0]
+            slot[1:n + 1, :rows.shape[1]] = rows
+            slot[0, 0:2] = (n, self.KIND_DATA)
+        self.pos += 1
+        self.items.release()
+        return True
+
+    def get(self, timeout: Optional[float] = None):
+        """Đọc 1 batch (bản copy). Trả về None nếu gặp gói dừng, raise TimeoutError nếu timeout."""
+        if not self.items.acquire(timeout=timeout):
+            raise TimeoutError("ShmRing.get timeout")
+        slot = self.buf[self.pos % self.shape[0]]
+        n, kind = int(slot[0, 0]), slot[0, 1]
+        rows = None if kind == self.KIND_STOP else slot[1:n + 1].copy()
+        self.pos += 1
+        self.spaces.release()
+        return rows
+
+    def close(self):
+        self.buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+# ---------- Worker ----------
+def _shard_worker(in_ring: ShmRing, out_ring: ShmRing, n_workers: int, n_local: int,
+                  n_anchors: int, kf_kwargs: dict, lm_kwargs: dict):
+    """
+    1 process = 1 shard: giữ GMCKalmanBank cho các tag có tag % n_workers == shard,
+    mỗi batch giải LM vector hóa (anchor riêng từng hàng) rồi predict/update cả bank.
+    """
+    bank = GMCKalmanBank(n_local, **kf_kwargs)
+    inited = np.zeros(n_local, dtype=bool)
+    last_t = np.zeros(n_local)
+    dt = np.zeros(n_local)
+    meas = np.zeros((n_local, 3))
+    cost_full = np.zeros(n_local)
+    a0, a1 = 2, 2 + 3 * n_anchors
+
+    while True:
+        rows = in_ring.get()
+        if rows is None:
+            out_ring.put(None)
+            break
+
+        tags = rows[:, 0].astype(np.int64)
+        t = rows[:, 1]
+        loc = tags // n_workers
+        A = rows[:, a0:a1].reshape(-1, n_anchors, 3)
+        S = rows[:, a1:]
+        X, _, ok, cost = hybrid_solve_LM_batch(A, S, **lm_kwargs)
+
+        old = inited[loc]
+        new = ~old & ok
+        if new.any():
+            bank.reset(X[new], idx=loc[new])
+            inited[loc[new]] = True
+            last_t[loc[new]] = t[new]
+
+        upd = np.zeros(len(tags), dtype=bool)
+        if old.any():
+            lo = loc[old]
+            dt[:] = 0.0
+            dt[lo] = t[old] - last_t[lo]
+            bank.predict(dt, idx=lo)
+            last_t[lo] = t[old]
+
+            mask = np.zeros(n_local, dtype=bool)
+            mask[lo] = ok[old]
+            meas[lo] = X[old]
+            cost_full[lo] = cost[old]
+            _, upd_bank = bank.update(meas, hybrid_cost=cost_full, mask=mask)
+            upd[old] = upd_bank[lo]
+
+        out = np.empty((len(tags), OUT_COLS))
+        out[:, 0] = tags
+        out[:, 1] = t
+        out[:, 2:5] = bank.x[loc, 0:3]
+        out[:, 5] = ok & inited[loc]
+        out[:, 6] = cost
+        out[:, 7] = upd
+        out_ring.put(out)
+
+
+# ---------- Sharded tracker ----------
+class ShardedTracker:
+    """
+    Tracking server chia tag theo tag_id % n_workers cho 1 pool process (né GIL):
+    - Mỗi worker sở hữu state Kalman của các tag mình (GMCKalmanBank), không chia sẻ
+    - Batch đo đi qua ring buffer shared memory (chỉ copy float64, không pickle object)
+    - submit(): chia batch theo shard, ghi vào ring; collect(): gom kết quả các shard
+      (ring vào đầy -> submit đọc bớt ring ra của shard đó, nên batch lớn hơn n_slots * max_batch không kẹt)
+    - Mỗi tag tối đa 1 hàng / batch (bank cập nhật vector hóa theo tag)
+
+    Kết quả: mảng (N, 8) [tag, t, x, y, z, ok, cost, updated], sắp theo tag.
+    """
+
+    def __init__(
+            self,
+            n_workers: int,
+            max_tags: int,
+            n_anchors: int = 4,
+            n_meas: int = 5,
+            max_batch: int = 4096,
+            n_slots: int = 4,
+            kf_kwargs: Optional[dict] = None,
+            lm_kwargs: Optional[dict] = None,
+    ):
+        self.n_workers = int(n_workers)
+        self.max_tags = int(max_tags)
+        self.n_anchors = int(n_anchors)
+        self.n_meas = int(n_meas)
+        self.width = 2 + 3 * self.n_anchors + self.n_meas
+        n_local = -(-self.max_tags // self.n_workers)
+        max_rows = min(int(max_batch), n_local)
+
+        self.in_rings = [ShmRing(n_slots, max_rows, self.width) for _ in range(self.n_workers)]
+        self.out_rings = [ShmRing(n_slots, max_rows, OUT_COLS) for _ in range(self.n_workers)]
+        self._pending = [0] * self.n_workers
+        self._ready = [[] for _ in range(self.n_workers)]    # kết quả đọc sớm trong lúc submit
+        self._procs = [
+            mp.Process(
+                target=_shard_worker,
+                args=(self.in_rings[w], self.out_rings[w], self.n_workers, n_local,
+                      self.n_anchors, kf_kwargs or {}, lm_kwargs or {}),
+                name=f"shard-{w}",
+                daemon=True,
+            )
+            for w in range(self.n_workers)
+        ]
+        self._closed = False
+
+    def start(self) -> "ShardedTracker":
+        for p in self._procs:
+            p.start()
+        return self
+
+    def submit(self, tags, t, anchors, S) -> None:
+        """
+        tags: (N,) int, t: scalar hoặc (N,), anchors: (K,3) dùng chung hoặc (N,K,3), S: (N,M).
+        Ring của shard đầy -> chờ (backpressure), trong lúc chờ đọc kết quả của shard đó ra
+        self._ready để worker không bị chặn ở ring ra.
+        """
+        tags = np.asarray(tags, dtype=np.int64).reshape(-1)
+        n = len(tags)
+        if np.any(tags < 0) or np.any(tags >= self.max_tags):
+            raise ValueError("tag id out of range [0, max_tags)")
+        if len(np.unique(tags)) != n:
+            raise ValueError("each tag may appear at most once per batch")
+
+        rows = np.empty((n, self.width))
+        rows[:, 0] = tags
+        rows[:, 1] = t
+        A = np.asarray(anchors, dtype=float)
+        rows[:, 2:2 + 3 * self.n_anchors] = np.broadcast_to(A, (n, self.n_anchors, 3)).reshape(n, -1)
+        rows[:, 2 + 3 * self.n_anchors:] = np.asarray(S, dtype=float).reshape(n, self.n_meas)
+
+        shard = tags % self.n_workers
+        for w in range(self.n_workers):
+            part = rows[shard == w]
+            ring = self.in_rings[w]
+            for i in range(0, len(part), ring.max_rows):
+                while not ring.put(part[i:i + ring.max_rows], timeout=0.005):
+                    self._drain(w)
+                self._pending[w] += 1
+
+    def _drain(self, w: int) -> None:
+        """Đọc mọi kết quả đã sẵn của shard w (không chờ)."""
+        while self._pending[w] > 0:
+            try:
+                self._ready[w].append(self.out_rings[w].get(timeout=0))
+            except TimeoutError:
+                return
+            self._pending[w] -= 1
+
+    def collect(self, timeout: Optional[float] = None) -> np.ndarray:
+        """Chờ kết quả mọi batch đã submit, trả về (N, 8) sắp theo tag."""
+        outs = []
+        for w in range(self.n_workers):
+            outs.extend(self._ready[w])
+            self._ready[w] = []
+            while self._pending[w] > 0:
+                outs.append(self.out_rings[w].get(timeout=timeout))
+                self._pending[w] -= 1
+        if not outs:
+            return np.empty((0, OUT_COLS))
+        out = np.concatenate(outs)
+        return out[np.argsort(out[:, 0], kind="stable")]
+
+    def track(self, tags, t, anchors, S) -> np.ndarray:
+        self.submit(tags, t, anchors, S)
+        return self.collect()
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.collect(timeout=timeout)
+        for ring in self.in_rings:
+            ring.put(None, timeout=timeout)
+        for w, ring in enumerate(self.out_rings):
+            try:
+                while ring.get(timeout=timeout) is not None:
+                    pass
+            except TimeoutError:
+                pass
+        for p in self._procs:
+            p.join(timeout)
+        for ring in self.in_rings + self.out_rings:
+            ring.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import time
+
+    print("===== ShardedTracker throughput =====")
+    rng = np.random.default_rng(1)
+    anchors = np.array([[0, 0, 2.0], [20, 0, 2.0], [0, 20, 2.0], [20, 20, 2.7]])
+    n_tags = 4000
+    tags = np.arange(n_tags)
+    P = np.column_stack([rng.uniform(2, 18, n_tags), rng.uniform(2, 18, n_tags), np.full(n_tags, 1.5)])
+
+    def s_batch(P):
+        d = np.linalg.norm(P[:, None, :] - anchors[None, :, :], axis=2)
+        S = np.column_stack([d[:, 1] - d[:, 0], d[:, 2] - d[:, 0], d[:, 3] - d[:, 0], d[:, 0], d[:, 1]])
+        return S + rng.normal(0, 0.05, S.shape)
+
+    for n_workers in (1, 2, 4):
+        with ShardedTracker(n_workers, n_tags) as tr:
+            tr.track(tags, 0.0, anchors, s_batch(P))
+            frames = 10
+            t0 = time.perf_counter()
+            for k in range(1, frames + 1):
+                tr.track(tags, 0.1 * k, anchors, s_batch(P))
+            el = time.perf_counter() - t0
+        print(f"workers={n_workers}: {n_tags * frames / el:,.0f} tag-solutions/s")
@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from hybrid_scalable import s_from_groundtruth_batch
+
+
+# ---------- Cửa sổ thời gian (vector hóa in_burst / NLOS window) ----------
+def window_mask(t, windows: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Mask (T,) True khi a <= t <= b với 1 cửa sổ (a, b) bất kỳ (như ss2.in_burst)."""
+    t = np.asarray(t, dtype=float)
+    mask = np.zeros(t.shape, dtype=bool)
+    for a, b in windows:
+        mask |= (t >= a) & (t <= b)
+    return mask
+
+
+@dataclass
+class NLOSWindow:
+    """NLOS trên các hàng rows của s trong [t_start, t_end]: + bias + nhiễu thêm (như ss2.apply_nlos_to_s)."""
+    t_start: float
+    t_end: float
+    bias_m: float = 0.60
+    extra_noise_std: float = 0.12
+    rows: Tuple[int, ...] = (1, 2)      # s = [d2, d3, d4, d01, d02] -> A2, A3
+    tags: Optional[Sequence[int]] = None  # None = mọi tag
+
+
+def apply_nlos_batch(S: np.ndarray, t, nlos: Sequence[NLOSWindow], rng: np.random.Generator) -> np.ndarray:
+    """
+    Cộng NLOS vào S (T,N,M) tại chỗ; t: (T,).
+    Trả về mask (T,N,M) các phần tử bị ảnh hưởng.
+    """
+    T, N, M = S.shape
+    hit = np.zeros(S.shape, dtype=bool)
+    for w in nlos:
+        f = np.flatnonzero(window_mask(t, [(w.t_start, w.t_end)]))
+        if f.size == 0:
+            continue
+        tags = np.arange(N) if w.tags is None else np.asarray(w.tags, dtype=int)
+        rows = np.asarray(w.rows, dtype=int)
+        sel = np.ix_(f, tags, rows)
+        S[sel] += w.bias_m + rng.normal(0.0, w.extra_noise_std, (f.size, tags.size, rows.size))
+        hit[sel] = True
+    return hit
+
+
+def dropout_mask(t, n_tags: int, bursts: Sequence[Tuple[float, float]] = (),
+                 drop_prob: float = 0.0, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Mask (T,N) frame bị mất: trong burst (mọi tag) hoặc rơi ngẫu nhiên độc lập với xác suất drop_prob."""
+    t = np.asarray(t, dtype=float)
+    dropped = np.repeat(window_mask(t, bursts)[:, None], n_tags, axis=1)
+    if drop_prob > 0.0:
+        if rng is None:
+            raise ValueError("rng (numpy.random.Generator) is required when drop_prob > 0")
+        dropped |= rng.random(dropped.shape) < drop_prob
+    return dropped
+
+
+# ---------- Generator ----------
+@dataclass
+class SimMeasurements:
+    t: np.ndarray         # (T,)
+    P: np.ndarray         # (T,N,3) ground truth
+    S: np.ndarray         # (T,N,M)
+    dropped: np.ndarray   # (T,N) bool
+    nlos: np.ndarray      # (T,N,M) bool
+
+
+def generate_measurements(
+        anchors,
+        P,
+        t,
+        noise_std_m: float = 0.05,
+        seed=None,
+        meas=None,
+        nlos: Sequence[NLOSWindow] = (),
+        bursts: Sequence[Tuple[float, float]] = (),
+        drop_prob: float = 0.0,
+) -> SimMeasurements:
+    """
+    Sinh tensor đo cho cả quỹ đạo x cả fleet trong 1 lần gọi.
+
+    anchors: (K,3) dùng chung hoặc (T,K,3) theo frame
+    P:       (T,N,3) hoặc (T,3) (1 tag)
+    t:       (T,) thời điểm (dùng cho cửa sổ NLOS / burst)
+    seed:    int / numpy.random.Generator -> cùng seed cho cùng kết quả
+    """
+    rng = np.random.default_rng(seed)
+    t = np.asarray(t, dtype=float)
+    P = np.asarray(P, dtype=float)
+    if P.ndim == 2:
+        P = P[:, None, :]
+    if P.shape[0] != t.shape[0]:
+        raise ValueError("P and t must have the same number of frames")
+
+    A = np.asarray(anchors, dtype=float)
+    if A.ndim == 3:
+        A = A[:, None, :, :]     # (T,1,K,3) -> broadcast theo tag
+
+    S = s_from_groundtruth_batch(A, P, noise_std_m, meas=meas, rng=rng)
+    hit = apply_nlos_batch(S, t, nlos, rng)
+    dropped = dropout_mask(t, P.shape[1], bursts, drop_prob, rng)
+    return SimMeasurements(t=t, P=P, S=S, dropped=dropped, nlos=hit)
+
+
+if __name__ == "__main__":
+    import time
+
+    print("===== generate_measurements throughput =====")
+    anchors = np.array([[0, 0, 2.0], [20, 0, 2.0], [0, 20, 2.0], [20, 20, 2.7]])
+    T, N = 10000, 100
+    t = np.arange(T) * 0.1
+    ang = 0.05 * t[:, None] + np.linspace(0, 2 * np.pi, N, endpoint=False)[None, :]
+    P = np.stack([10 + 6 * np.cos(ang), 10 + 6 * np.sin(ang), np.full(ang.shape, 1.5)], axis=-1)
+
+    t0 = time.perf_counter()
+    sim = generate_measurements(
+        anchors, P, t, noise_std_m=0.05, seed=1,
+        nlos=[NLOSWindow(100.0, 300.0)], bursts=[(500.0, 520.0)], drop_prob=0.02,
+    )
+    el = time.perf_counter() - t0
+    print(f"{T * N:,} tag-frames in {el:.3f}s ({T * N / el:,.0f} /s) | "
+          f"nlos {sim.nlos.any(axis=2).mean() * 100:.1f}% | dropped {sim.dropped.mean() * 100:.1f}%")
@@ -0,0 +1,263 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import socket
+import struct
+import time
+
+import numpy as np
+
+from wire import decode_measurements, encode_measurements
+
+
+# ---------- Batch đo chung cho mọi nguồn ----------
+@dataclass
+class MeasurementBatch:
+    """N tag cùng 1 anchor set tại thời điểm t -> đưa thẳng vào hybrid_solve_LM_batch(anchors, S)."""
+    t: float
+    tags: np.ndarray      # (N,) int
+    anchors: np.ndarray   # (K,3)
+    S: np.ndarray         # (N,M)
+    zone: int = 0
+
+
+def batch_from_frame(data: bytes) -> MeasurementBatch:
+    d = decode_measurements(data)
+    return MeasurementBatch(t=d["t"], tags=d["tags"], anchors=d["anchors"], S=d["S"], zone=d["zone"])
+
+
+# ---------- Base ----------
+class MeasurementSource(ABC):
+    """
+    Nguồn đo: poll() trả về các batch đã sẵn sàng, không chặn (timeout=0).
+    Lặp `for batch in source` chạy tới khi nguồn hết dữ liệu (exhausted).
+    """
+
+    exhausted = False
+
+    @abstractmethod
+    def poll(self, timeout: float = 0.0) -> List[MeasurementBatch]:
+        """Các batch đã sẵn sàng; chờ tối đa timeout giây nếu chưa có."""
+
+    def __iter__(self):
+        while not self.exhausted:
+            for batch in self.poll(timeout=0.05):
+                yield batch
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- Simulator (scenarios.get_measure) ----------
+class SimulatorSource(MeasurementSource):
+    """
+    Bọc hàm mô phỏng measure_fn(step, t) -> (anchors, S (N,M)) thành nguồn đo.
+    realtime=True: mỗi poll chỉ phát các frame đã tới hạn theo đồng hồ thực;
+    realtime=False: mỗi poll phát 1 frame ngay (load test).
+    """
+
+    def __init__(self, measure_fn: Callable, period: float = 0.1, tags=None,
+                 n_frames: Optional[int] = None, realtime: bool = True):
+        self.measure_fn = measure_fn
+        self.period = float(period)
+        self.tags = None if tags is None else np.asarray(tags, dtype=np.int64)
+        self.n_frames = n_frames
+        self.realtime = realtime
+        self.step = 0
+        self._t0 = time.perf_counter()
+
+    @classmethod
+    def from_get_measure(cls, get_measure: Callable, tag: int = 0, **kw) -> "SimulatorSource":
+        """Adapter cho scenarios.get_measure(step, t) -> (scenario, seg_t, anchors, s, gt) của 1 tag."""
+
+        def measure(step, t):
+            scenario_idx, _, anchors, s, _ = get_measure(step, t)
+            A = np.array([[a.x, a.y, a.z] for a in anchors])
+            return A, np.asarray(s, dtype=float).reshape(1, -1), scenario_idx
+
+        return cls(measure, tags=[tag], **kw)
+
+    def _emit(self) -> MeasurementBatch:
+        self.step += 1
+        t = self.step * self.period
+        out = self.measure_fn(self.step, t)
+        A, S = out[0], out[1]
+        zone = out[2] if len(out) > 2 else 0
+        S = np.asarray(S, dtype=float)
+        tags = self.tags if self.tags is not None else np.arange(S.shape[0])
+        if self.n_frames is not None and self.step >= self.n_frames:
+            self.exhausted = True
+        return MeasurementBatch(t=t, tags=tags, anchors=np.asarray(A, dtype=float), S=S, zone=zone)
+
+    def poll(self, timeout: float = 0.0) -> List[MeasurementBatch]:
+        if self.exhausted:
+            return []
+        if not self.realtime:
+            return [self._emit()]
+        due = int((time.perf_counter() - self._t0) // self.period)
+        if due <= self.step and timeout > 0:
+            time.sleep(min(timeout, (self.step + 1) * self.period - (time.perf_counter() - self._t0)))
+            due = int((time.perf_counter() - self._t0) // self.period)
+        out = []
+        while self.step < due and not self.exhausted:
+            out.append(self._emit())
+        return out
+
+
+# ---------- Capture file (kiểu PCAP: timestamp + payload thô) ----------
+CAPTURE_MAGIC = b"UWCAP1\n\0"
+_CAP_REC = struct.Struct("<dI")     # t_recv (s) | len payload
+
+
+class CaptureWriter:
+    """Ghi từng datagram thô kèm thời điểm nhận -> ReplaySource phát lại đúng nhịp."""
+
+    def __init__(self, path: str):
+        self._f = open(path, "wb")
+        self._f.write(CAPTURE_MAGIC)
+        self._t0 = None
+
+    def write(self, payload: bytes, t: Optional[float] = None) -> None:
+        if t is None:
+            t = time.perf_counter()
+            if self._t0 is None:
+                self._t0 = t
+            t -= self._t0
+        self._f.write(_CAP_REC.pack(t, len(payload)))
+        self._f.write(payload)
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_capture(path: str):
+    """Sinh (t, payload) theo thứ tự trong file."""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("not a UWB capture file")
+        while True:
+            hdr = f.read(_CAP_REC.size)
+            if len(hdr) < _CAP_REC.size:
+                return
+            t, n = _CAP_REC.unpack(hdr)
+            payload = f.read(n)
+            if len(payload) < n:
+                return
+            yield t, payload
+
+
+# ---------- UDP listener ----------
+class UDPSource(MeasurementSource):
+    """
+    Nhận datagram measurement report (wire.encode_measurements) trên socket UDP non-blocking.
+    poll() đọc hết datagram đang chờ; gói hỏng chỉ bị đếm (bad_packets), không raise.
+    capture: CaptureWriter tùy chọn để ghi lại luồng thô cho ReplaySource.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 9500, max_packet: int = 65535,
+                 rcvbuf: int = 4 << 20, capture: Optional[CaptureWriter] = None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        except OSError:
+            pass
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.max_packet = int(max_packet)
+        self.capture = capture
+        self.packets = 0
+        self.bad_packets = 0
+
+    def poll(self, timeout: float = 0.0) -> List[MeasurementBatch]:
+        out = []
+        if timeout > 0:
+            self.sock.settimeout(timeout)
+            try:
+                out.extend(self._handle(self.sock.recv(self.max_packet)))
+            except (socket.timeout, BlockingIOError):
+                pass
+            finally:
+                self.sock.setblocking(False)
+        while True:
+            try:
+                data = self.sock.recv(self.max_packet)
+            except (BlockingIOError, InterruptedError):
+                break
+            out.extend(self._handle(data))
+        return out
+
+    def _handle(self, data: bytes) -> List[MeasurementBatch]:
+        self.packets += 1
+        if self.capture is not None:
+            self.capture.write(data)
+        try:
+            return [batch_from_frame(data)]
+        except ValueError:
+            self.bad_packets += 1
+            return []
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+def send_measurements_udp(sock: socket.socket, address, batch: MeasurementBatch) -> None:
+    """Phía anchor/gateway (hoặc load test): gửi 1 batch thành 1 datagram."""
+    sock.sendto(encode_measurements(batch.t, batch.tags, batch.anchors, batch.S, zone=batch.zone), address)
+
+
+# ---------- Replay ----------
+class ReplaySource(MeasurementSource):
+    """
+    Phát lại file capture:
+    - speed=1.0: đúng nhịp ghi (2.0 = nhanh gấp đôi, ...)
+    - speed=None: nhanh nhất có thể, mỗi poll trả tối đa max_batches batch
+    """
+
+    def __init__(self, path: str, speed: Optional[float] = 1.0, max_batches: int = 256):
+        self.path = path
+        self.speed = speed
+        self.max_batches = int(max_batches)
+        self._it = read_capture(path)
+        self._next = next(self._it, None)
+        self._t0 = None
+        self._cap_t0 = None if self._next is None else self._next[0]
+        self.exhausted = self._next is None
+        self.packets = 0
+        self.bad_packets = 0
+
+    def poll(self, timeout: float = 0.0) -> List[MeasurementBatch]:
+        out = []
+        if self.exhausted:
+            return out
+        if self._t0 is None:
+            self._t0 = time.perf_counter()
+        if self.speed is not None:
+            wait = (self._next[0] - self._cap_t0) / self.speed - (time.perf_counter() - self._t0)
+            if wait > 0 and timeout > 0:
+                time.sleep(min(wait, timeout))
+        while self._next is not None and len(out) < self.max_batches:
+            t_cap, payload = self._next
+            if self.speed is not None:
+                if (t_cap - self._cap_t0) / self.speed > time.perf_counter() - self._t0:
+                    break
+            self.packets += 1
+            try:
+                out.append(batch_from_frame(payload))
+            except ValueError:
+                self.bad_packets += 1
+            self._next = next(self._it, None)
+        self.exhausted = self._next is None
+        return out
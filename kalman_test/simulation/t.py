@@ -7,12 +7,36 @@
 #          GMC kernel/weights, safe_gamma accuracy, reset/predict/update,
 #          update gating, outlier robustness, axis-wise weights check.
 
+import asyncio
+import http.client
+import json
 import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
 import random
+import threading
+import time
 import numpy as np
 
 import hybrid_scalable as hs
 import gmc_kalman_filter as gmc
+import tight_gmc_ekf as tight
+import publisher as pub
+import scheduler as sch
+import pipeline as pl
+import sharded as shd
+import async_runner as ar
+import wire
+import sources as src
+import sessionlog as slog
+import simgen
+import montecarlo as mc
+import scenarios
+import bench
+import instrument as ins
 
 
 # -----------------------------
@@ -62,6 +86,15 @@ def numeric_jacobian(anchors, s, x, eps=1e-6):
     return Jn
 
 
+def numeric_jacobian_meas(anchors, s, x, meas, eps=1e-6):
+    base_f, _ = hs.residual_and_jacobian_s(anchors, s, x, meas=meas)
+    Jn = np.zeros((len(base_f), 3), dtype=float)
+    for j, (dx, dy, dz) in enumerate([(eps, 0, 0), (0, eps, 0), (0, 0, eps)]):
+        fp, _ = hs.residual_and_jacobian_s(anchors, s, hs.Vec3(x.x + dx, x.y + dy, x.z + dz), meas=meas)
+        Jn[:, j] = (np.array(fp) - np.array(base_f)) / eps
+    return Jn
+
+
 def multi_start_solve(anchors, s, inits):
     # Run hs.hybrid_solve_LM with multiple initial guesses, pick smallest residual norm
     best = None
@@ -88,6 +121,12 @@ def make_anchors_noncoplanar_5x5():
     return [v3(0, 0, 2.0), v3(5, 0, 2.0), v3(0, 5, 2.0), v3(5, 5, 2.6)]
 
 
+def make_anchors_hall_8():
+    # 8 anchor trần + tường, 10x10 m
+    return [v3(0, 0, 2.8), v3(5, 0, 2.4), v3(10, 0, 2.8), v3(0, 10, 2.8),
+            v3(5, 10, 2.4), v3(10, 10, 2.8), v3(0, 5, 2.2), v3(10, 5, 2.6)]
+
+
 def rand_tag_in_box(xmin, xmax, ymin, ymax, zmin, zmax):
     return v3(
         random.uniform(xmin, xmax),
@@ -371,6 +410,1121 @@ def main():
     print(f"Mean EST  error = {sum(est_errs)/len(est_errs):.3f} m")
     assert_true("EST mean error < MEAS mean error", (sum(est_errs) / len(est_errs)) < (sum(meas_errs) / len(meas_errs)))
 
+    # ========== TEST 16: hybrid_solve_LM_batch() == hybrid_solve_LM() ==========
+    print("\n=== TEST 16: hybrid_solve_LM_batch() matches scalar solver ===")
+    anchors16 = make_anchors_noncoplanar_5x5()
+    S16 = [hs.s_from_groundtruth(anchors16, rand_tag_in_box(0.6, 4.4, 0.6, 4.4, 0.6, 2.0), noise_std_m=0.05)
+           for _ in range(60)]
+    S16.append(s)  # + 1 ca bad init giống TEST 7
+    inits16 = np.array([[2.5, 2.5, 1.5]] * 60 + [[bad_init.x, bad_init.y, bad_init.z]])
+    est_b, it_b, ok_b, cost_b = hs.hybrid_solve_LM_batch(anchors16, S16, init=inits16)
+    okB = True
+    for k, s_k in enumerate(S16):
+        est_k, it_k, ok_k, cost_k = hs.hybrid_solve_LM(anchors16, s_k, init=v3(*inits16[k]))
+        dx = np.max(np.abs(est_b[k] - [est_k.x, est_k.y, est_k.z]))
+        if dx > 1e-9 or it_b[k] != it_k or bool(ok_b[k]) != ok_k or abs(cost_b[k] - cost_k) > 1e-9:
+            okB = False
+            print(f"[{k}] batch={est_b[k]} it={it_b[k]} ok={ok_b[k]} | scalar={fmt_v(est_k)} it={it_k} ok={ok_k}")
+    print(f"N={len(S16)} conv={int(ok_b.sum())} mean_it={it_b.mean():.1f}")
+    assert_true("batch == scalar (est/it/ok/cost)", okB)
+
+    # ========== TEST 17: residual_and_jacobian_into() with ndarray buffers ==========
+    print("\n=== TEST 17: residual_and_jacobian_into() (4,3) array + caller buffers ===")
+    A17 = hs.anchors_to_array(anchors_nc)
+    f_buf = np.zeros(5)
+    J_buf = np.zeros((5, 3))
+    x17 = v3(1.3, 3.1, 1.1)
+    s17 = hs.s_from_groundtruth(anchors_nc, v3(2.0, 2.0, 1.4), noise_std_m=0.02)
+    f_ret, J_ret = hs.residual_and_jacobian_into(A17, s17, np.array([x17.x, x17.y, x17.z]), f_buf, J_buf)
+    f_ref, J_ref = hs.residual_and_jacobian_s(anchors_nc, s17, x17)
+    assert_true("writes into caller buffers", (f_ret is f_buf) and (J_ret is J_buf))
+    assert_true("matches residual_and_jacobian_s",
+                np.allclose(f_buf, f_ref, atol=1e-12) and np.allclose(J_buf, J_ref, atol=1e-12))
+
+    # ========== TEST 18: N anchors + measurement descriptor ==========
+    print("\n=== TEST 18: 8 anchors, TDoA vs A0 + ranges A0/A4 (meas descriptor) ===")
+    assert_true("make_measurement_set(4) == HYBRID_MEAS_4", hs.make_measurement_set(4) == hs.HYBRID_MEAS_4)
+    est_d, it_d, ok_d, _ = hs.hybrid_solve_LM(anchors, s, meas=hs.HYBRID_MEAS_4)
+    est_f, it_f, ok_f, _ = hs.hybrid_solve_LM(anchors, s)
+    assert_true("general path == fast path (4 anchors)", dist3(est_d, est_f) < 1e-9 and it_d == it_f and ok_d == ok_f)
+
+    hall = make_anchors_hall_8()
+    meas8 = hs.make_measurement_set(len(hall), ref=0, ranges=(0, 4))
+    x18 = v3(3.0, 6.0, 1.2)
+    s18 = hs.s_from_groundtruth(hall, v3(4.0, 4.0, 1.5), noise_std_m=0.02, meas=meas8)
+    _, J18 = hs.residual_and_jacobian_s(hall, s18, x18, meas=meas8)
+    diffJ = np.max(np.abs(np.array(J18) - numeric_jacobian_meas(hall, s18, x18, meas8)))
+    print(f"M={len(meas8)} rows, max|J_ana - J_num| = {diffJ:.3e}")
+    assert_true("8-anchor Jacobian matches finite-diff", diffJ <= 5e-3)
+
+    errs18 = []
+    S18, G18 = [], []
+    for _ in range(40):
+        gt18 = rand_tag_in_box(1.0, 9.0, 1.0, 9.0, 0.8, 2.0)
+        s_k = hs.s_from_groundtruth(hall, gt18, noise_std_m=0.02, meas=meas8)
+        est18, it18, ok18, _ = hs.hybrid_solve_LM(hall, s_k, init=v3(5.0, 5.0, 1.5), meas=meas8)
+        errs18.append(dist3(gt18, est18))
+        S18.append(s_k)
+        G18.append([gt18.x, gt18.y, gt18.z])
+    est_b18, _, ok_b18, _ = hs.hybrid_solve_LM_batch(hall, S18, init=[5.0, 5.0, 1.5], meas=meas8)
+    errs_b18 = np.linalg.norm(est_b18 - np.array(G18), axis=1)
+    print(f"scalar mean={np.mean(errs18):.3f} max={np.max(errs18):.3f} | batch mean={errs_b18.mean():.3f} conv={int(ok_b18.sum())}/40")
+    assert_true("8-anchor mean err < 0.10m", np.mean(errs18) < 0.10)
+    assert_true("batch == scalar (8 anchors)", np.allclose(errs_b18, errs18, atol=1e-9))
+
+    # ========== TEST 19: hybrid_solve_tracking() warm start + fallback ==========
+    print("\n=== TEST 19: hybrid_solve_tracking() warm start from prior, cold fallback ===")
+    anchors19 = make_anchors_noncoplanar_5x5()
+    it_cold_sum = it_warm_sum = 0
+    warm_cnt = 0
+    for _ in range(30):
+        gt19 = rand_tag_in_box(0.8, 4.2, 0.8, 4.2, 0.8, 1.8)
+        s19 = hs.s_from_groundtruth(anchors19, gt19, noise_std_m=0.02)
+        prior19 = v3(gt19.x + 0.05, gt19.y - 0.05, gt19.z + 0.03)  # ~ dự đoán Kalman
+        _, it_c, _, _ = hs.hybrid_solve_LM(anchors19, s19, init=v3(2.5, 2.5, 1.5))  # điểm giữa anchor cũ
+        est_w, it_w, ok_w, _, seed_w = hs.hybrid_solve_tracking(anchors19, s19, prior=prior19)
+        it_cold_sum += it_c
+        it_warm_sum += it_w
+        warm_cnt += seed_w == "warm"
+    print(f"mean it: midpoint={it_cold_sum / 30:.1f} warm={it_warm_sum / 30:.1f} | warm accepted {warm_cnt}/30")
+    assert_true("warm start needs fewer iterations", it_warm_sum < it_cold_sum)
+
+    est_fb, it_fb, ok_fb, cost_fb, seed_fb = hs.hybrid_solve_tracking(anchors, s, prior=bad_init)
+    print(f"bad prior -> seed={seed_fb} ok={ok_fb} it_total={it_fb} ERR={dist3(gt, est_fb):.3f}")
+    assert_true("bad prior falls back to cold start", seed_fb == "cold" and ok_fb)
+
+    # ========== TEST 20: closed-form initial guess ==========
+    print("\n=== TEST 20: hybrid_linear_init() closed-form start (coplanar + non-coplanar) ===")
+    for name, anc in [("COP", make_anchors_coplanar_5x5(2.0)), ("NONCOP", make_anchors_noncoplanar_5x5())]:
+        errs0, errs_n, it_lin, it_mid, above = [], [], 0, 0, 0
+        for _ in range(40):
+            gt20 = rand_tag_in_box(0.6, 4.4, 0.6, 4.4, 0.6, 1.8)
+            x_exact = hs.hybrid_linear_init(anc, hs.s_from_groundtruth(anc, gt20, noise_std_m=0.0))
+            errs0.append(dist3(gt20, x_exact))
+            s20 = hs.s_from_groundtruth(anc, gt20, noise_std_m=0.05)
+            x_lin = hs.hybrid_linear_init(anc, s20)
+            errs_n.append(dist3(gt20, x_lin))
+            above += x_lin.z > 2.0
+            it_lin += hs.hybrid_solve_LM(anc, s20, init=x_lin)[1]
+            it_mid += hs.hybrid_solve_LM(anc, s20, init=v3(2.5, 2.5, 1.5))[1]
+        print(f"{name}: exact max err={max(errs0):.2e} | noisy mean err={np.mean(errs_n):.3f} "
+              f"| mean it: linear={it_lin / 40:.1f} midpoint={it_mid / 40:.1f} | above plane={above}")
+        assert_true(f"{name}: noise-free init exact", max(errs0) < 1e-6)
+        assert_true(f"{name}: linear init cuts LM iterations", it_lin < it_mid)
+        assert_true(f"{name}: picks below-ceiling root", above == 0)
+
+    X20, valid20 = hs.hybrid_linear_init_batch(anchors16, S16)
+    x20 = hs.hybrid_linear_init(anchors16, S16[0])
+    assert_true("batch init == scalar init", valid20.all() and np.allclose(X20[0], [x20.x, x20.y, x20.z], atol=1e-9))
+
+    # y là trục cao (như main.py): anchor đồng phẳng tại y=2.8, chọn nghiệm dưới theo up
+    anc20y = [v3(0, 2.8, 0), v3(12, 2.8, 0), v3(0, 2.8, 12), v3(12, 2.8, 12)]
+    kw20y = {"z_min": 0.0, "z_max": 12.0, "up": (0.0, 1.0, 0.0)}
+    below20, err20_up, err20_z = 0, [], []
+    for _ in range(60):
+        gt20 = v3(random.uniform(0.6, 11.4), random.uniform(1.2, 2.2), random.uniform(0.6, 11.4))
+        s20 = hs.s_from_groundtruth(anc20y, gt20, noise_std_m=0.05)
+        x20y = hs.hybrid_linear_init(anc20y, s20, up=kw20y["up"])
+        X20y, _ = hs.hybrid_linear_init_batch(anc20y, [s20], up=kw20y["up"])
+        below20 += x20y.y < 2.8 and np.allclose(X20y[0], [x20y.x, x20y.y, x20y.z], atol=1e-9)
+        err20_up.append(dist3(gt20, hs.hybrid_solve_LM(anc20y, s20, **kw20y)[0]))
+        err20_z.append(dist3(gt20, hs.hybrid_solve_LM(anc20y, s20, z_min=0.0, z_max=12.0)[0]))
+    print(f"y-up coplanar: below={below20}/60 | cold LM mean err up=y {np.mean(err20_up):.3f} "
+          f"vs up=z {np.mean(err20_z):.3f}")
+    assert_true("y-up: init below anchor plane (scalar == batch)", below20 == 60)
+    assert_true("y-up: cold LM avoids mirror", np.mean(err20_up) < 0.3 and np.mean(err20_up) < np.mean(err20_z))
+
+    # ========== TEST 21: built-in batched multi-start + mirror ambiguity ==========
+    print("\n=== TEST 21: hybrid_solve_multistart() (batched seeds, floor/ceiling prior) ===")
+    est_ms, it_ms, ok_ms, cost_ms, amb_ms = hs.hybrid_solve_multistart(anchors, s, seeds=rescue_inits)
+    print(f"rescue seeds -> EST={fmt_v(est_ms)} ERR={dist3(gt, est_ms):.3f} it={it_ms} ok={ok_ms} amb={amb_ms:.2f}")
+    assert_true("same pick as test-only multi_start_solve", dist3(est_ms, est_r) < 1e-6)
+
+    est_md, _, ok_md, _, amb_md = hs.hybrid_solve_multistart(anchors, s)
+    print(f"default seeds (COP) -> EST={fmt_v(est_md)} ERR={dist3(gt, est_md):.3f} ok={ok_md} amb={amb_md:.2f}")
+    assert_true("default seeds ok + below ceiling", ok_md and est_md.z <= z_plane + 1e-6)
+    assert_true("coplanar mirror flagged ambiguous (amb > 0.5)", amb_md > 0.5)
+
+    est_m8, _, ok_m8, _, amb_m8 = hs.hybrid_solve_multistart(anchors8, s8)
+    print(f"default seeds (NONCOP) -> EST={fmt_v(est_m8)} ERR={dist3(gt8, est_m8):.3f} ok={ok_m8} amb={amb_m8:.2f}")
+    assert_true("non-coplanar multi-start err < 0.30m", ok_m8 and dist3(gt8, est_m8) < 0.30)
+
+    # layout của main (trục cao y, trần 2.8 m): seed gương + sàn/trần phải theo up, không theo z
+    worst21 = 0.0
+    all_ok21 = True
+    for k21 in (0, 1, 4, 5):
+        anchors21 = scenarios.anchors_for_scenario(k21)
+        for ang21 in (0.3, 1.7, 3.5, 5.0):
+            gt21 = hs.Vec3(6.0 + 5.0 * math.cos(ang21), 1.55 + 0.18 * math.sin(ang21), 6.0 + 2.5 * math.sin(ang21))
+            est21, _, ok21, _, _ = hs.hybrid_solve_multistart(anchors21, hs.s_from_groundtruth(anchors21, gt21), **scenarios.LM_KW)
+            all_ok21 = all_ok21 and ok21 and est21.y <= 2.8 + 1e-6
+            worst21 = max(worst21, dist3(gt21, est21))
+    print(f"main layouts (y-up) -> all ok below ceiling={all_ok21} worst ERR={worst21:.4f}")
+    assert_true("y-up multi-start: ok, below ceiling, err < 1cm", all_ok21 and worst21 < 0.01)
+
+    # ========== TEST 22: GMCKalmanBank == N x AdaptiveGMCKalman3D ==========
+    print("\n=== TEST 22: GMCKalmanBank vs per-tag AdaptiveGMCKalman3D (gating + mask) ===")
+    n22 = 25
+    starts = np.random.uniform(0.5, 4.5, (n22, 3))
+    bank = gmc.GMCKalmanBank(n22, process_var=0.9, meas_var=0.25, alpha=1.0, beta_init=1.0)
+    bank.reset(starts)
+    kfs = [gmc.AdaptiveGMCKalman3D(process_var=0.9, meas_var=0.25, alpha=1.0, beta_init=1.0) for _ in range(n22)]
+    for kf_i, x_i in zip(kfs, starts):
+        kf_i.reset(gmc.Vec3(*x_i))
+
+    for step in range(15):
+        Z = starts + np.random.normal(0.0, 0.2, (n22, 3))
+        Z[step % n22, 2] += 1.8                       # outlier z
+        costs = np.random.uniform(0.0, 4.0, n22)      # ~1/4 bị gate
+        mask = np.random.uniform(size=n22) > 0.1      # ~10% mất đo
+        bank.predict(0.1)
+        _, upd = bank.update(Z, hybrid_cost=costs, hybrid_max_cost=3.0, mask=mask)
+        for i, kf_i in enumerate(kfs):
+            kf_i.predict(0.1)
+            if mask[i]:
+                kf_i.update(gmc.Vec3(*Z[i]), hybrid_cost=costs[i], hybrid_max_cost=3.0)
+
+    X_ref = np.array([kf_i.x.reshape(-1) for kf_i in kfs])
+    P_ref = np.array([kf_i.P for kf_i in kfs])
+    print(f"max|x_bank - x_ref|={np.max(np.abs(bank.x - X_ref)):.2e} max|P_bank - P_ref|={np.max(np.abs(bank.P - P_ref)):.2e}")
+    assert_true("bank matches per-tag filters", np.allclose(bank.x, X_ref, atol=1e-12) and np.allclose(bank.P, P_ref, atol=1e-12))
+
+    # ========== TEST 23: update_fast() == update() ==========
+    print("\n=== TEST 23: AdaptiveGMCKalman3D.update_fast() vs reference update() ===")
+    kf_ref = gmc.AdaptiveGMCKalman3D(process_var=0.9, meas_var=0.25, alpha=1.0, beta_init=1.0)
+    kf_fast = gmc.AdaptiveGMCKalman3D(process_var=0.9, meas_var=0.25, alpha=1.0, beta_init=1.0, fast_update=True)
+    kf_ref.reset(true_pos)
+    kf_fast.reset(true_pos)
+    meas23 = []
+    for i in range(200):
+        m = gmc.Vec3(true_pos.x + random.gauss(0, 0.2), true_pos.y + random.gauss(0, 0.2), true_pos.z + random.gauss(0, 0.2))
+        if i % 17 == 0:
+            m.z += 1.8
+        meas23.append(m)
+    max_dx = max_dP = 0.0
+    for m in meas23:
+        kf_ref.predict(0.1)
+        kf_fast.predict(0.1)
+        kf_ref.update(m, hybrid_cost=0.1)
+        kf_fast.update(m, hybrid_cost=0.1)
+        max_dx = max(max_dx, float(np.max(np.abs(kf_ref.x - kf_fast.x))))
+        max_dP = max(max_dP, float(np.max(np.abs(kf_ref.P - kf_fast.P))))
+
+    t_ref = time.perf_counter()
+    for m in meas23:
+        kf_ref.update(m)
+    t_ref = time.perf_counter() - t_ref
+    t_fast = time.perf_counter()
+    for m in meas23:
+        kf_fast.update(m)
+    t_fast = time.perf_counter() - t_fast
+    print(f"max|dx|={max_dx:.2e} max|dP|={max_dP:.2e} | update {t_ref / 200 * 1e6:.1f}us -> fast {t_fast / 200 * 1e6:.1f}us")
+    assert_true("fast path matches reference (<=1e-12)", max_dx <= 1e-12 and max_dP <= 1e-12)
+
+    # ========== TEST 24: CV / CA motion models ==========
+    print("\n=== TEST 24: constant-velocity / constant-acceleration GMC filter ===")
+    F_cv, Q_cv = gmc.motion_model_matrices("cv", 0.1, 1.0)
+    assert_true("CV F/Q shapes 6x6, Q symmetric", F_cv.shape == (6, 6) and np.allclose(Q_cv, Q_cv.T))
+    F_ca, _ = gmc.motion_model_matrices("ca", 0.1, 1.0)
+    assert_true("CA F: p += v dt + a dt^2/2", abs(F_ca[0, 3] - 0.1) < 1e-12 and abs(F_ca[0, 6] - 0.005) < 1e-12)
+
+    kf_cv = gmc.AdaptiveGMCKalmanMotion3D(process_var=2.0, meas_var=0.01, model="cv")
+    kf_cv.reset(gmc.Vec3(1.0, 1.0, 1.5), v0=gmc.Vec3(1.0, 0.0, 0.0))
+    kf_cv.predict(0.5)
+    assert_true("CV predict moves state (x += v dt)", abs(kf_cv.get_state_vec3().x - 1.5) < 1e-12)
+
+    def circle(t):
+        return np.array([2.5 + 1.5 * math.sin(0.8 * t), 2.5 + 1.5 * math.cos(0.8 * t), 1.5])
+
+    rng24 = np.random.default_rng(20251230)
+    filters24 = {
+        "rw": gmc.AdaptiveGMCKalman3D(process_var=0.8, meas_var=0.01),
+        "cv": gmc.AdaptiveGMCKalmanMotion3D(process_var=8.0, meas_var=0.01, model="cv"),
+        "ca": gmc.AdaptiveGMCKalmanMotion3D(process_var=1.0, meas_var=0.01, model="ca"),
+    }
+    for kf_m in filters24.values():
+        kf_m.reset(gmc.Vec3(*circle(0.0)))
+    bank24 = gmc.GMCKalmanBank(4, process_var=8.0, meas_var=0.01, model="cv")
+    bank24.reset(np.tile(circle(0.0), (4, 1)))
+    drop_errs = {m: [] for m in filters24}
+    for k in range(1, 300):
+        t24 = k * 0.1
+        dropped = 6.0 <= t24 % 10.0 <= 6.8
+        z24 = circle(t24) + rng24.normal(0.0, 0.07, 3)
+        for m, kf_m in filters24.items():
+            kf_m.predict(0.1)
+            if not dropped:
+                kf_m.update(gmc.Vec3(*z24))
+            if dropped:
+                e24 = kf_m.get_state_vec3()
+                drop_errs[m].append(np.linalg.norm(np.array([e24.x, e24.y, e24.z]) - circle(t24)))
+        bank24.predict(0.1)
+        if not dropped:
+            bank24.update(np.tile(z24, (4, 1)))
+    print("mean err during dropouts: " + " ".join(f"{m}={np.mean(v):.3f}" for m, v in drop_errs.items()))
+    assert_true("CV coasts better than RW through dropouts", np.mean(drop_errs["cv"]) < np.mean(drop_errs["rw"]))
+    assert_true("CA coasts better than RW through dropouts", np.mean(drop_errs["ca"]) < np.mean(drop_errs["rw"]))
+    assert_true("GMCKalmanBank(cv) == AdaptiveGMCKalmanMotion3D(cv)",
+                np.allclose(bank24.x[0], filters24["cv"].x.reshape(-1), atol=1e-9))
+
+    # ========== TEST 25: tightly-coupled GMC-EKF ==========
+    print("\n=== TEST 25: tightly-coupled GMC-EKF on raw s ===")
+    anchors25 = [hs.Vec3(0, 0, 2.0), hs.Vec3(5, 0, 2.0), hs.Vec3(0, 5, 2.0), hs.Vec3(5, 5, 2.7)]
+    mask25 = hs.measurement_rows_available(hs.HYBRID_MEAS_4, [True, True, True, False])
+    assert_true("rows touching missing A3 dropped", list(mask25) == [True, True, False, True, True])
+
+    def path25(t):
+        return hs.Vec3(2.5 + 1.2 * math.sin(0.6 * t), 2.5 + 1.2 * math.cos(0.6 * t), 1.5)
+
+    random.seed(20251231)
+    ekf25 = tight.TightGMCEKF(process_var=2.0, meas_var=0.0025, model="cv")
+    p0 = path25(0.0)
+    ekf25.reset(gmc.Vec3(p0.x, p0.y, p0.z))
+    errs25, errs25_miss, rows25_miss = [], [], []
+    for k in range(1, 121):
+        t25 = k * 0.1
+        gt25 = path25(t25)
+        s25 = hs.s_from_groundtruth(anchors25, gt25, 0.05)
+        a3_ok = not (5.0 <= t25 <= 6.0)
+        ekf25.predict(0.1)
+        e25, used25 = ekf25.update_raw(anchors25, s25, anchor_ok=[True, True, True, a3_ok])
+        err25 = hs.dist(gt25, hs.Vec3(e25.x, e25.y, e25.z))
+        errs25.append(err25)
+        if not a3_ok:
+            errs25_miss.append(err25)
+            rows25_miss.append(used25)
+    print(f"tight EKF mean err={np.mean(errs25):.3f} m | A3 missing: err={np.mean(errs25_miss):.3f} m")
+    assert_true("tight EKF tracks circle (mean err < 0.2 m)", np.mean(errs25) < 0.2)
+    assert_true("A3 missing -> 4 rows used", all(r == 4 for r in rows25_miss))
+    assert_true("A3 missing -> still tracking (mean err < 0.3 m)", np.mean(errs25_miss) < 0.3)
+
+    # ========== TEST 26: non-blocking position publisher ==========
+    print("\n=== TEST 26: PositionPublisher (bounded queue, coalescing) ===")
+    sent26 = []
+
+    def slow_send(batch):
+        time.sleep(0.2)                     # backend chậm
+        sent26.append(list(batch))
+
+    pub26 = pub.PositionPublisher(slow_send, max_queue=8, flush_interval=0.0).start()
+    t_pub = time.perf_counter()
+    for k in range(200):
+        pub26.publish(f"T{k % 3}", k, 0.0, 0.0, ts=float(k))
+    t_pub = time.perf_counter() - t_pub
+    pub26.stop(timeout=2.0)
+    st26 = pub26.stats()
+    print(f"200 publish in {t_pub * 1e3:.2f} ms | stats={st26}")
+    assert_true("publish never blocks on slow sender (< 50 ms for 200)", t_pub < 0.05)
+    assert_true("queue full -> oldest dropped", st26["dropped"] > 0 and st26["pending"] == 0)
+    last26 = {p["id"]: p["x"] for b in sent26 for p in b}
+    assert_true("newest position of each tag delivered", last26 == {"T0": 198.0, "T1": 199.0, "T2": 197.0})
+    assert_true("coalesced: one entry per tag per batch",
+                st26["coalesced"] > 0 and all(len(b) == len({p["id"] for p in b}) for b in sent26))
+    assert_true("counters consistent",
+                st26["enqueued"] == st26["dropped"] + st26["coalesced"] + st26["sent_positions"])
+
+    def fail_send(batch):
+        raise ConnectionError("backend down")
+
+    pub26b = pub.PositionPublisher(fail_send)
+    pub26b.publish("T0", 1.0, 2.0, 3.0)
+    pub26b.flush()
+    assert_true("send errors counted, not raised", pub26b.stats()["send_errors"] == 1)
+
+    # ========== TEST 27: versioned anchor broadcast ==========
+    print("\n=== TEST 27: AnchorBroadcaster (change-only, versioned) ===")
+    emitted27 = []
+    link27 = {"up": True}
+
+    def emit27(event, payload):
+        if not link27["up"]:
+            raise ConnectionError("down")
+        emitted27.append((event, payload))
+
+    bc27 = pub.AnchorBroadcaster(emit27)
+    layout_a = [v3(0, 0, 2), v3(5, 0, 2), v3(0, 5, 2), v3(5, 5, 2.7)]
+    layout_b = [v3(1, 1, 2), v3(6, 1, 2), v3(1, 6, 2), v3(6, 6, 2.7)]
+    versions27 = [bc27.update(layout_a, zone="S0") for _ in range(100)]
+    assert_true("100 frames, same anchors -> 1 broadcast", len(emitted27) == 1 and set(versions27) == {1})
+    assert_true("payload carries A0..A3 + version",
+                emitted27[0][1]["version"] == 1 and emitted27[0][1]["A3"] == {"x": 5.0, "y": 5.0, "z": 2.7})
+    v_b = bc27.update(layout_b, zone="S1")
+    v_a = bc27.update(layout_a, zone="S0")
+    assert_true("new zone -> new unique version, old zone keeps its version", v_b == 2 and v_a == 1)
+    moved = list(layout_b)
+    moved[2] = v3(1, 6.5, 2)
+    assert_true("moved anchor -> version bump", bc27.update(moved, zone="S1") == 3 and len(emitted27) == 3)
+
+    link27["up"] = False
+    bc27.update(layout_b, zone="S1")
+    n_before = len(emitted27)
+    link27["up"] = True
+    bc27.update(layout_b, zone="S1")
+    assert_true("failed emit retried on next frame", len(emitted27) == n_before + 1)
+    assert_true("reconnect -> resend all zones", bc27.resend_all() == 2)
+
+    pub27 = pub.PositionPublisher(lambda b: emitted27.append(("pos", b)))
+    pub27.publish("T0", 1.0, 2.0, 3.0, anchor_version=v_a)
+    pub27.flush()
+    assert_true("position carries only anchor version",
+                emitted27[-1][1][0]["av"] == 1 and "A0" not in emitted27[-1][1][0])
+
+    # ========== TEST 28: deadline-driven scheduler ==========
+    print("\n=== TEST 28: FrameScheduler (absolute deadlines, skip/merge) ===")
+
+    class FakeClock:
+        def __init__(self):
+            self.now = 100.0
+
+        def __call__(self):
+            return self.now
+
+        def sleep(self, s):
+            self.now += s
+
+    def run_sched(policy, work):
+        clk = FakeClock()
+        sc = sch.FrameScheduler(period=0.1, policy=policy, spin=0.0, clock=clk, sleep=clk.sleep)
+        ticks = []
+        for w in work:
+            ticks.append(sc.wait())
+            clk.now += w                    # thời gian xử lý của frame
+        return sc, ticks
+
+    sc28, ticks28 = run_sched("skip", [0.03] * 50)
+    assert_close("no drift: tick 50 at t=5.0 s", ticks28[-1].t, 5.0, 1e-9)
+    assert_true("dt = period when keeping up", all(abs(tk.dt - 0.1) < 1e-9 for tk in ticks28))
+
+    work28 = [0.03] * 10 + [0.35] + [0.03] * 10
+    sc_skip, tk_skip = run_sched("skip", work28)
+    sc_merge, tk_merge = run_sched("merge", work28)
+    print(f"skip : {[(tk.index, round(tk.dt, 3), tk.missed) for tk in tk_skip[10:13]]} stats={sc_skip.stats()}")
+    print(f"merge: {[(tk.index, round(tk.dt, 3), tk.missed) for tk in tk_merge[10:13]]}")
+    assert_true("overrun detected", sc_skip.overruns == 1 and sc_merge.overruns == 1)
+    assert_true("skip: waits for next grid point, 3 deadlines dropped",
+                tk_skip[11].index == 15 and tk_skip[11].missed == 3 and abs(tk_skip[11].dt - 0.4) < 1e-9)
+    assert_true("merge: runs at once with merged dt, 2 deadlines merged",
+                tk_merge[11].index == 14 and tk_merge[11].missed == 2 and abs(tk_merge[11].dt - 0.35) < 1e-9)
+    assert_true("both back on the grid afterwards",
+                abs(tk_skip[-1].t - tk_skip[-1].index * 0.1) < 1e-9 and abs(tk_merge[-1].t - tk_merge[-1].index * 0.1) < 1e-9)
+    assert_true("merge lateness shows in jitter stats", sc_merge.stats()["jitter_max_ms"] > 40.0)
+
+    sc_rt = sch.FrameScheduler(period=0.005)
+    for _ in range(40):
+        sc_rt.wait()
+    st28 = sc_rt.stats()
+    print(f"real clock 200 Hz: {st28}")
+    assert_true("real clock 200 Hz: p95 jitter < 5 ms", st28["jitter_p95_ms"] < 5.0)
+
+    # ========== TEST 29: pipelined solve -> filter stages ==========
+    print("\n=== TEST 29: Pipeline (bounded queues, per-tag ordering) ===")
+    anchors29 = [v3(0, 0, 2.0), v3(5, 0, 2.0), v3(0, 5, 2.0), v3(5, 5, 2.7)]
+    random.seed(29)
+    items29 = []
+    for k in range(40):
+        for tag in range(6):
+            gt29 = v3(1.0 + 0.05 * k, 1.0 + 0.5 * tag, 1.5)
+            items29.append({"tag": f"T{tag}", "seq": k, "t": 0.1 * k,
+                            "anchors": anchors29, "s": hs.s_from_groundtruth(anchors29, gt29, 0.03)})
+
+    def make_stages(mode, workers):
+        return [pl.Stage("solve", pl.SolveStage(), workers=workers, mode=mode),
+                pl.Stage("filter", pl.FilterStage(process_var=0.8, meas_var=0.7), workers=workers, mode=mode)]
+
+    serial_solve, serial_filter = pl.SolveStage(), pl.FilterStage(process_var=0.8, meas_var=0.7)
+    ref29 = {(it["tag"], it["seq"]): serial_filter(serial_solve(dict(it))) for it in items29}
+
+    for mode29, workers29 in (("thread", 3), ("process", 2)):
+        pipe29 = pl.Pipeline(make_stages(mode29, workers29), queue_size=16, collect=True).start()
+        for it in items29:
+            pipe29.submit(dict(it))
+        pipe29.close(timeout=10.0)
+        out29 = pipe29.drain_results()
+        seqs = {}
+        for o in out29:
+            seqs.setdefault(o["tag"], []).append(o["seq"])
+        same = all(
+            abs(o["pos"].x - ref29[(o["tag"], o["seq"])]["pos"].x) < 1e-12
+            and abs(o["pos"].z - ref29[(o["tag"], o["seq"])]["pos"].z) < 1e-12
+            for o in out29
+        )
+        print(f"{mode29} x{workers29}: {len(out29)} results, stats={pipe29.stats()['stages']}")
+        assert_true(f"{mode29}: all frames through solve + filter", len(out29) == len(items29))
+        assert_true(f"{mode29}: per-tag order kept", all(v == sorted(v) for v in seqs.values()))
+        assert_true(f"{mode29}: == serial solve + filter", same)
+
+    gate29 = threading.Event()
+
+    def blocked(item):
+        gate29.wait()
+        return item
+
+    pipe29b = pl.Pipeline([pl.Stage("slow", blocked)], queue_size=4, backpressure="drop_newest").start()
+    for k in range(20):
+        pipe29b.submit({"tag": "T0", "seq": k})
+    gate29.set()
+    pipe29b.close(timeout=2.0)
+    st29 = pipe29b.stats()
+    print(f"drop_newest: {st29}")
+    assert_true("backpressure drop_newest never blocks submit",
+                st29["submit_dropped"] > 0 and st29["submit_dropped"] + st29["stages"]["slow"]["processed"] == 20)
+
+    # drop_oldest sau tầng nhiều worker: sentinel của worker xong trước không được bị bỏ
+    hung29 = 0
+    for _ in range(10):
+        gate29c = threading.Event()
+
+        def held(item, gate=gate29c):
+            gate.wait()
+            return item
+
+        def uneven(item):
+            time.sleep(0.0005 * (item["tag"] % 3))
+            return item
+
+        pipe29c = pl.Pipeline([pl.Stage("up", uneven, workers=3), pl.Stage("down", held)],
+                              queue_size=2, backpressure="drop_oldest").start()
+        for k in range(60):
+            pipe29c.submit({"tag": k % 3, "seq": k})
+        threading.Timer(0.05, gate29c.set).start()
+        pipe29c.close(timeout=1.0)
+        hung29 += any(w.is_alive() for w in pipe29c._workers)
+    assert_true("drop_oldest with 3 upstream workers: close() never hangs", hung29 == 0)
+
+    f29 = pl.FilterStage(default_dt=0.1, process_var=0.8, meas_var=0.7)
+    it29 = {"tag": "T0", "ok": True, "cost": 0.0, "est": v3(1.0, 1.0, 1.5)}
+    f29(dict(it29))
+    p29 = f29(dict(it29, est=v3(1.1, 1.0, 1.5)))
+    assert_true("FilterStage: item without t / dt uses default_dt", p29 is not None and p29["pos"].x > 1.0)
+
+    # ========== TEST 30: multi-process sharded tracking ==========
+    print("\n=== TEST 30: ShardedTracker (process shards, shared-memory rings) ===")
+    rng30 = np.random.default_rng(30)
+    A30 = np.array([[0, 0, 2.0], [8, 0, 2.0], [0, 8, 2.0], [8, 8, 2.7]])
+    n30 = 60
+    P30 = np.column_stack([rng30.uniform(1, 7, n30), rng30.uniform(1, 7, n30), np.full(n30, 1.5)])
+    V30 = rng30.normal(0, 0.3, (n30, 3)) * [1, 1, 0]
+
+    def s30(P):
+        d = np.linalg.norm(P[:, None, :] - A30[None, :, :], axis=2)
+        S = np.column_stack([d[:, 1] - d[:, 0], d[:, 2] - d[:, 0], d[:, 3] - d[:, 0], d[:, 0], d[:, 1]])
+        return S + rng30.normal(0, 0.03, S.shape)
+
+    frames30 = [(0.1 * k, P30 + V30 * 0.1 * k) for k in range(15)]
+    S30 = [s30(P) for _, P in frames30]
+    res30 = {}
+    for nw in (1, 3):
+        with shd.ShardedTracker(nw, n30, max_batch=16, kf_kwargs={"process_var": 0.8, "meas_var": 0.05}) as tr30:
+            for (t30, _), S in zip(frames30, S30):
+                out30 = tr30.track(np.arange(n30), t30, A30, S)
+        res30[nw] = out30
+    err30 = np.linalg.norm(res30[3][:, 2:5] - frames30[-1][1], axis=1)
+    print(f"3 shards: mean err={err30.mean():.3f} m, max={err30.max():.3f} m, updated={int(res30[3][:, 7].sum())}/{n30}")
+    assert_true("results sorted by tag, one row per tag", np.array_equal(res30[3][:, 0], np.arange(n30)))
+    assert_true("3 shards == 1 shard (state owned per tag)", np.allclose(res30[1], res30[3], atol=1e-9))
+
+    # batch >> n_slots * max_batch: 1 shard, 25 chunk qua ring 4 ô -> submit phải đọc bớt ring ra
+    n30b = 400
+    P30b = np.column_stack([rng30.uniform(1, 7, n30b), rng30.uniform(1, 7, n30b), np.full(n30b, 1.5)])
+    d30b = np.linalg.norm(P30b[:, None, :] - A30[None, :, :], axis=2)
+    S30b = np.column_stack([d30b[:, 1] - d30b[:, 0], d30b[:, 2] - d30b[:, 0], d30b[:, 3] - d30b[:, 0],
+                            d30b[:, 0], d30b[:, 1]])
+    with shd.ShardedTracker(1, n30b, max_batch=16, n_slots=4) as tr30b:
+        tr30b.track(np.arange(n30b), 0.0, A30, S30b)
+        out30b = tr30b.track(np.arange(n30b), 0.1, A30, S30b)
+    assert_true("tags >> n_slots*max_batch: no deadlock, every tag returned",
+                np.array_equal(out30b[:, 0], np.arange(n30b)) and np.abs(out30b[:, 2:5] - P30b).max() < 1e-6)
+    assert_true("sharded tracking accurate (mean err < 0.15 m)", err30.mean() < 0.15)
+
+    tr30b = shd.ShardedTracker(2, 10).start()
+    try:
+        tr30b.submit([1, 1], 0.0, A30, np.zeros((2, 5)))
+        dup_ok = False
+    except ValueError:
+        dup_ok = True
+    tr30b.close()
+    assert_true("duplicate tag in a batch rejected", dup_ok)
+
+    # ========== TEST 31: asyncio runner, dead backend ==========
+    print("\n=== TEST 31: AsyncRealtimeRunner (reconnect with backoff off the frame path) ===")
+
+    class FakeAsyncClient:
+        backend_up = False
+
+        def __init__(self):
+            self.connected = False
+            self.events = []
+
+        async def connect(self, url):
+            if not FakeAsyncClient.backend_up:
+                await asyncio.sleep(0.5)        # backend chết: connect treo tới timeout
+                raise ConnectionError("refused")
+            self.connected = True
+
+        async def emit(self, event, payload):
+            self.events.append((event, payload))
+
+        async def disconnect(self):
+            self.connected = False
+
+    anchors31 = [v3(0, 0, 2.0), v3(5, 0, 2.0), v3(0, 5, 2.0), v3(5, 5, 2.7)]
+
+    def measure31(step, t):
+        gt = v3(2.5 + math.sin(t), 2.5 + math.cos(t), 1.5)
+        return 0, t, anchors31, hs.s_from_groundtruth(anchors31, gt, 0.02), gt
+
+    def solve31(anchors, s, prior):
+        est, it, ok, cost, _ = hs.hybrid_solve_tracking(anchors, s, prior=prior)
+        return est, it, ok, cost
+
+    def bring_up(runner, tick, pos):
+        if runner.frames == 40:
+            FakeAsyncClient.backend_up = True
+
+    kf31 = gmc.AdaptiveGMCKalman3D(process_var=0.8, meas_var=0.05, fast_update=True)
+    kf31.reset(gmc.Vec3(2.5, 3.5, 1.5))
+    runner31 = ar.AsyncRealtimeRunner(measure31, solve31, kf31, frame_hz=50.0, make_client=FakeAsyncClient,
+                                      connect_timeout=0.2, backoff_min=0.05, backoff_max=0.4, on_frame=bring_up)
+    t31 = time.perf_counter()
+    asyncio.run(runner31.run(n_frames=100))
+    t31 = time.perf_counter() - t31
+    st31 = runner31.stats()
+    print(f"100 frames @50 Hz in {t31:.2f} s | {st31}")
+    assert_true("dead backend adds no frame latency (100 frames in ~2 s)", t31 < 2.3 and st31["missed"] == 0)
+    assert_true("connect failures retried with backoff (few attempts)", 1 <= st31["connect_failures"] <= 8)
+    assert_true("offline positions dropped, not queued", st31["offline_dropped"] > 0)
+    events31 = runner31.client.events
+    assert_true("after reconnect: anchors resent + positions emitted",
+                any(e == "anchors-update" for e, _ in events31) and any(e == "tags-update" for e, _ in events31))
+    assert_true("positions carry anchor version only",
+                all("A0" not in p for e, b in events31 if e == "tags-update" for p in b["positions"]))
+
+    # anchor set đã enqueue nhưng emit lỗi -> zone được gửi lại ở frame sau, không đợi reconnect
+    class FlakyAsyncClient(FakeAsyncClient):
+        fail_anchor_emits = 1
+
+        async def connect(self, url):
+            self.connected = True
+
+        async def emit(self, event, payload):
+            if event == "anchors-update" and FlakyAsyncClient.fail_anchor_emits > 0:
+                FlakyAsyncClient.fail_anchor_emits -= 1
+                raise ConnectionError("emit failed")
+            self.events.append((event, payload))
+
+    kf31b = gmc.AdaptiveGMCKalman3D(process_var=0.8, meas_var=0.05, fast_update=True)
+    kf31b.reset(gmc.Vec3(2.5, 3.5, 1.5))
+    runner31b = ar.AsyncRealtimeRunner(measure31, solve31, kf31b, frame_hz=100.0, make_client=FlakyAsyncClient,
+                                       backoff_min=0.01)
+    asyncio.run(runner31b.run(n_frames=30))
+    st31b = runner31b.stats()
+    anchors31b = [b for e, b in runner31b.client.events if e == "anchors-update"]
+    print(f"flaky anchor emit: control_lost={st31b['control_lost']} emit_errors={st31b['emit_errors']} "
+          f"anchors delivered={len(anchors31b)}")
+    assert_true("failed anchor emit is retried on a later frame",
+                st31b["control_lost"] >= 1 and len(anchors31b) >= 1 and anchors31b[-1]["version"] == 1)
+
+    # ========== TEST 32: binary wire format ==========
+    print("\n=== TEST 32: binary position frames (fixed-point mm) ===")
+    rng32 = np.random.default_rng(32)
+    n32 = 500
+    tags32 = rng32.integers(0, 2 ** 31, n32)
+    ts32 = 1.7e9 + rng32.uniform(0, 100, n32)
+    pos32 = rng32.uniform(-50, 50, (n32, 3))
+    std32 = rng32.uniform(0.0, 0.5, (n32, 3))
+    std32[0] = 100.0                                 # > 65.535 m -> bão hòa
+    b32 = wire.encode_positions(tags32, ts32, pos32, std=std32, anchor_version=7)
+    d32 = wire.decode_positions(b32)
+    assert_true("frame size = 12 + 30 B/record", len(b32) == 12 + 30 * n32)
+    assert_true("round trip tag/ts exact, av kept",
+                np.array_equal(d32["tag"], tags32) and np.array_equal(d32["ts"], ts32) and d32["av"] == 7)
+    assert_true("round trip pos within 0.5 mm", np.max(np.abs(d32["pos"] - pos32)) <= 0.0005 + 1e-12)
+    assert_true("std saturates at 65.535 m", abs(d32["std"][0, 0] - 65.535) < 1e-9)
+    items32 = [{"id": 3, "x": 1.0, "y": 2.0, "z": -3.5, "ts": 10.0, "av": 4}]
+    d32b = wire.decode_positions(wire.encode_items(items32))
+    assert_true("encode_items (publisher batch)", d32b["av"] == 4 and d32b["std"] is None
+                and np.allclose(d32b["pos"][0], [1.0, 2.0, -3.5]))
+    try:
+        wire.decode_positions(b32[:-1])
+        bad32 = False
+    except ValueError:
+        bad32 = True
+    assert_true("truncated frame rejected", bad32)
+    bench32 = wire.benchmark(1000, repeat=3)
+    print("  ".join(f"{k}: enc={v['enc_us']:.3f} dec={v['dec_us']:.3f} µs/rec {v['bytes']:.0f} B"
+                    for k, v in bench32.items()))
+    assert_true("binary encode faster than JSON (1000 rec/msg)", bench32["binary"]["enc_us"] < bench32["json"]["enc_us"])
+
+    # ========== TEST 33: pluggable measurement sources ==========
+    print("\n=== TEST 33: measurement sources (UDP / capture replay / simulator) ===")
+    A33 = np.array([[0, 0, 2.0], [8, 0, 2.0], [0, 8, 2.0], [8, 8, 2.7]])
+    rng33 = np.random.default_rng(33)
+
+    def measure33(step, t):
+        P = np.column_stack([4 + 2 * np.cos(0.5 * t + np.arange(20)), 4 + 2 * np.sin(0.5 * t + np.arange(20)),
+                             np.full(20, 1.5)])
+        d = np.linalg.norm(P[:, None, :] - A33[None, :, :], axis=2)
+        S = np.column_stack([d[:, 1] - d[:, 0], d[:, 2] - d[:, 0], d[:, 3] - d[:, 0], d[:, 0], d[:, 1]])
+        return A33, S + rng33.normal(0, 0.02, S.shape)
+
+    sim33 = src.SimulatorSource(measure33, period=0.02, n_frames=30, realtime=False)
+    batches33 = list(sim33)
+    assert_true("simulator: 30 batches of (20,5)", len(batches33) == 30 and batches33[0].S.shape == (20, 5))
+
+    cap_path = os.path.join(tempfile.mkdtemp(), "session.uwcap")
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    with src.CaptureWriter(cap_path) as cap33, src.UDPSource("127.0.0.1", 0, capture=cap33) as udp33:
+        for b in batches33:
+            src.send_measurements_udp(tx, udp33.address, b)
+            time.sleep(0.002)
+        tx.sendto(b"garbage", udp33.address)
+        got33 = []
+        t_end = time.perf_counter() + 2.0
+        while len(got33) < 30 and time.perf_counter() < t_end:
+            got33.extend(udp33.poll(timeout=0.05))
+        udp33.poll()
+        bad33 = udp33.bad_packets
+    tx.close()
+    assert_true("UDP: all batches decoded", len(got33) == 30
+                and all(np.array_equal(g.S, b.S) and g.t == b.t for g, b in zip(got33, batches33)))
+    assert_true("UDP: bad packet counted, not raised", bad33 == 1)
+
+    fast33 = [b for b in src.ReplaySource(cap_path, speed=None)]
+    assert_true("replay (fast): same batches as live", len(fast33) == 30
+                and all(np.array_equal(f.S, b.S) for f, b in zip(fast33, batches33)))
+    cap_path2 = os.path.join(os.path.dirname(cap_path), "timed.uwcap")
+    with src.CaptureWriter(cap_path2) as cap33b:
+        for k, b in enumerate(batches33):
+            cap33b.write(wire.encode_measurements(b.t, b.tags, b.anchors, b.S), t=0.01 * k)
+    cap_span = 0.01 * (len(batches33) - 1)
+    t33 = time.perf_counter()
+    timed33 = list(src.ReplaySource(cap_path2, speed=1.0))
+    t33 = time.perf_counter() - t33
+    print(f"replay speed=1.0 took {t33:.3f} s for a {cap_span:.3f} s capture")
+    assert_true("replay (timed): keeps capture timing", len(timed33) == 30 and cap_span * 0.95 <= t33 < cap_span + 0.2)
+
+    t33 = time.perf_counter()
+    n_sol = 0
+    for b in src.ReplaySource(cap_path, speed=None):
+        X33, _, ok33, _ = hs.hybrid_solve_LM_batch(b.anchors, b.S)
+        n_sol += int(ok33.sum())
+    print(f"replay -> batch LM: {n_sol / (time.perf_counter() - t33):,.0f} solutions/s")
+    assert_true("replayed batches feed hybrid_solve_LM_batch directly", n_sol == 600)
+
+    try:
+        src.MeasurementSource()
+        abstract33 = False
+    except TypeError:
+        abstract33 = True
+    assert_true("MeasurementSource is abstract (poll required)", abstract33)
+
+    # ========== TEST 34: record / replay session log ==========
+    print("\n=== TEST 34: columnar session log + bulk replay ===")
+    anchors34 = [v3(0, 0, 2.0), v3(6, 0, 2.0), v3(0, 6, 2.0), v3(6, 6, 2.7)]
+    random.seed(34)
+    tmp34 = tempfile.mkdtemp()
+    paths34 = {c: os.path.join(tmp34, f"sess_{c}") for c in ("raw", "npz")}
+    writers34 = {c: slog.SessionLogWriter(paths34[c], chunk_rows=128, compress=(c == "npz"),
+                                          extra_meta={"lm_kwargs": {}}) for c in paths34}
+    kf34 = gmc.AdaptiveGMCKalman3D(process_var=0.8, meas_var=0.7, fast_update=True)
+    t_hot = 0.0
+    for k in range(600):
+        t34 = 0.1 * k
+        gt34 = v3(3 + 2 * math.cos(0.3 * t34), 3 + 2 * math.sin(0.3 * t34), 1.4)
+        s34 = hs.s_from_groundtruth(anchors34, gt34, 0.04)
+        if k == 0:
+            est34, it34, ok34, cost34 = hs.hybrid_solve_LM(anchors34, s34)
+            kf34.reset(gmc.Vec3(est34.x, est34.y, est34.z))
+            pos34 = kf34.get_state_vec3()
+        else:
+            kf34.predict(0.1)
+            est34, it34, ok34, cost34, _ = hs.hybrid_solve_tracking(anchors34, s34, prior=kf34.get_state_vec3())
+            m34 = gmc.Vec3(est34.x, est34.y, est34.z)
+            pos34 = kf34.update(m34, hybrid_cost=cost34) if ok34 else kf34.get_state_vec3()
+        t0_hot = time.perf_counter()
+        for w in writers34.values():
+            w.append(t34, 7, anchors34, s34, est34, ok34, cost34, it34, pos34)
+        t_hot += time.perf_counter() - t0_hot
+    for w in writers34.values():
+        w.close()
+    print(f"hot-path append: {t_hot / 1200 * 1e6:.2f} µs/row")
+
+    log34 = slog.SessionLog(paths34["raw"])
+    cols34 = log34.load()
+    assert_true("600 rows in 5 chunks, mmap-able columns",
+                log34.rows == 600 and len(log34.chunks) == 5
+                and isinstance(next(log34.iter_chunks())["s"], np.memmap))
+    cols34z = slog.SessionLog(paths34["npz"]).load()
+    assert_true("compressed log == raw log", all(np.array_equal(cols34[c], cols34z[c], equal_nan=True)
+                                                  for c in ("t", "s", "est", "filt", "anchors")))
+    rep34 = slog.replay_session(paths34["npz"])
+    print(f"replay: {rep34['rows']} rows, span {rep34['span_s']:.1f}s in {rep34['elapsed_s'] * 1e3:.1f} ms "
+          f"(x{rep34['speedup']:.0f}) | max |Δest|={rep34['est_diff']:.1e} |Δfilt|={rep34['filt_diff']:.1e}")
+    assert_true("replay reproduces recorded LM + Kalman", rep34["est_diff"] < 1e-9 and rep34["filt_diff"] < 1e-9)
+    assert_true("bulk replay >> realtime (x100)", rep34["speedup"] > 100)
+
+    # Ghi kiểu main.main(): reset KF từ frame 1 không ghi, dt theo tick, warm start với max_cost riêng,
+    # kf.update(est, hybrid_cost=cost) (main) hoặc không kèm cost; meta như main.make_recorder
+    anchors34m = [v3(0, 2.8, 0), v3(12, 2.8, 0), v3(0, 2.8, 12), v3(12, 2.4, 12)]
+    lm34m = {"z_min": 0.0, "z_max": 12.0, "up": (0.0, 1.0, 0.0)}
+    kf34m_kw = {"process_var": 0.8, "meas_var": 0.7, "alpha": 1.0, "beta_init": 1.0}
+
+    def gt34m(t):
+        return v3(6 + 4 * math.cos(0.4 * t), 1.5 + 0.2 * math.sin(t), 6 + 3 * math.sin(0.4 * t))
+
+    for gate34 in ("cost", "none"):
+        kf34m = gmc.AdaptiveGMCKalman3D(**kf34m_kw, fast_update=True)
+        s0 = hs.s_from_groundtruth(anchors34m, gt34m(0.0), 0.05)
+        est0, _, ok0, _ = hs.hybrid_solve_LM(anchors34m, s0, **lm34m)
+        kf34m.reset(est0 if ok0 else v3(6.0, 1.6, 6.0))
+        p0 = kf34m.get_state_vec3()
+        meta34m = {"lm_kwargs": lm34m, "kf_kwargs": kf34m_kw, "warm_start": True, "warm_max_cost": 0.02,
+                   "kf_gate": gate34, "kf_init": {"0": {"t": 0.0, "pos": [p0.x, p0.y, p0.z]}}}
+        path34m = os.path.join(tmp34, f"sess_main_{gate34}")
+        last34m = 0.0
+        with slog.SessionLogWriter(path34m, chunk_rows=128, extra_meta=meta34m) as w34m:
+            for k in range(1, 300):
+                t34 = 0.1 * k + random.uniform(0.0, 0.004)      # tick.t lệch deadline
+                kf34m.predict(t34 - last34m)
+                last34m = t34
+                s34 = hs.s_from_groundtruth(anchors34m, gt34m(t34), 0.05)
+                if k % 50 == 0:
+                    s34[1] += 4.0                                # outlier -> cost > 2, gate có việc làm
+                est34, it34, ok34, cost34, _ = hs.hybrid_solve_tracking(
+                    anchors34m, s34, prior=kf34m.get_state_vec3(), max_cost=0.02, **lm34m)
+                if not ok34:
+                    pos34 = kf34m.get_state_vec3()
+                elif gate34 == "cost":
+                    pos34 = kf34m.update(est34, hybrid_cost=cost34)
+                else:
+                    pos34 = kf34m.update(est34)
+                w34m.append(t34, 0, anchors34m, s34, est34, ok34, cost34, it34, pos34)
+        rep34m = slog.replay_session(path34m)
+        print(f"main-style replay (kf_gate={gate34}, gated={kf34m.gated}): "
+              f"max |Δest|={rep34m['est_diff']:.1e} |Δfilt|={rep34m['filt_diff']:.1e}")
+        assert_true(f"replay reproduces a main()-style recording (kf_gate={gate34})",
+                    rep34m["est_diff"] < 1e-9 and rep34m["filt_diff"] < 1e-9 and np.isfinite(rep34m["filt"]).all())
+        assert_true(f"kf.gated counts outliers only when cost is passed (kf_gate={gate34})",
+                    (kf34m.gated > 0) == (gate34 == "cost"))
+
+    with slog.SessionLogWriter(os.path.join(tmp34, "batch"), chunk_rows=64) as wb34:
+        wb34.append_batch(1.0, np.arange(100), np.zeros((4, 3)), np.ones((100, 5)))
+    lb34 = slog.SessionLog(os.path.join(tmp34, "batch")).load()
+    assert_true("append_batch spans chunks", len(lb34["tag"]) == 100 and np.array_equal(lb34["tag"], np.arange(100)))
+
+    # ========== TEST 35: vectorized measurement generator ==========
+    print("\n=== TEST 35: vectorized ground-truth generator (T,N,M) ===")
+    anchors35 = [v3(0, 0, 2.0), v3(6, 0, 2.0), v3(0, 6, 2.0), v3(6, 6, 2.7)]
+    A35 = hs.anchors_to_array(anchors35)
+    rng35 = np.random.default_rng(35)
+    P35 = np.column_stack([rng35.uniform(0.5, 5.5, (50, 2)), rng35.uniform(0.5, 2.5, 50)])
+    S35 = hs.s_from_groundtruth_batch(A35, P35)
+    ref35 = np.array([hs.s_from_groundtruth(anchors35, v3(*p)) for p in P35])
+    assert_true("noise-free batch == scalar forward model", np.allclose(S35, ref35, atol=1e-12))
+    meas35 = hs.make_measurement_set(4, ref=1, ranges=(0, 2, 3))
+    ref35m = np.array([hs.s_from_groundtruth(anchors35, v3(*p), meas=meas35) for p in P35])
+    assert_true("custom measurement set", np.allclose(hs.s_from_groundtruth_batch(A35, P35, meas=meas35), ref35m))
+
+    T35, N35 = 2000, 500
+    t35 = np.arange(T35) * 0.01
+    Pt35 = np.broadcast_to(P35[None, :10], (T35, 10, 3))
+    Pt35 = np.tile(Pt35, (1, N35 // 10, 1))
+    nlos35 = [simgen.NLOSWindow(4.0, 7.0, bias_m=0.6, extra_noise_std=0.12)]
+    bursts35 = [(1.8, 3.6), (10.6, 12.6)]
+    t0 = time.perf_counter()
+    sim35 = simgen.generate_measurements(A35, Pt35, t35, noise_std_m=0.05, seed=7,
+                                         nlos=nlos35, bursts=bursts35, drop_prob=0.02)
+    el35 = time.perf_counter() - t0
+    print(f"{T35 * N35:,} tag-frames in {el35:.3f}s")
+    assert_true("shape (T,N,5)", sim35.S.shape == (T35, N35, 5) and sim35.dropped.shape == (T35, N35))
+    clean35 = hs.s_from_groundtruth_batch(A35, Pt35)
+    err35 = sim35.S - clean35
+    win35 = (t35 >= 4.0) & (t35 <= 7.0)
+    assert_close("LOS noise std", float(err35[~win35].std()), 0.05, tol=2e-3)
+    assert_close("NLOS bias on d3,d4", float(err35[win35][:, :, 1:3].mean()), 0.6, tol=5e-3)
+    assert_true("NLOS only inside window on rows 1,2",
+                np.abs(err35[win35][:, :, [0, 3, 4]].mean()) < 5e-3 and np.abs(err35[~win35].mean()) < 5e-3
+                and sim35.nlos[win35][:, :, 1:3].all() and not sim35.nlos[~win35].any())
+    burst35 = np.array([any(a <= t <= b for a, b in bursts35) for t in t35])
+    assert_true("dropout covers every burst frame", sim35.dropped[burst35].all())
+    assert_close("random drop rate outside bursts", float(sim35.dropped[~burst35].mean()), 0.02, tol=2e-3)
+    sim35b = simgen.generate_measurements(A35, Pt35, t35, noise_std_m=0.05, seed=7,
+                                          nlos=nlos35, bursts=bursts35, drop_prob=0.02)
+    assert_true("same seed -> identical tensors",
+                np.array_equal(sim35.S, sim35b.S) and np.array_equal(sim35.dropped, sim35b.dropped))
+    assert_true("1M tag-frames in < 5 s", el35 < 5.0)
+
+    # ========== TEST 36: Monte Carlo harness ==========
+    print("\n=== TEST 36: parallel Monte Carlo sweep (layout x noise x condition) ===")
+    rng36 = np.random.default_rng(36)
+    e36 = rng36.gamma(2.0, 0.1, 50000)
+    st36a, st36b = mc.ErrorStats(), mc.ErrorStats()
+    st36a.add(e36[:20000], np.ones(20000, bool), np.zeros(20000, bool))
+    st36b.add(e36[20000:], np.ones(30000, bool), np.zeros(30000, bool), lost=5)
+    st36a.merge(st36b)
+    assert_close("streaming p95 vs exact", st36a.quantile(0.95), float(np.percentile(e36, 95)), tol=1.5e-3)
+    assert_true("merged counters", st36a.trials == 50005 and st36a.lost == 5
+                and abs(st36a.summary()["mean"] - e36.mean()) < 1e-12 and st36a.err_max == e36.max())
+
+    lay36 = [
+        mc.Layout("box", np.array([[0, 0, 2.0], [6, 0, 2.0], [0, 6, 2.0], [6, 6, 2.7]]),
+                  lo=(0.5, 0.5, 0.5), hi=(5.5, 5.5, 1.8)),
+        mc.Layout("flat", np.array([[0, 0, 2.5], [6, 0, 2.5], [0, 6, 2.5], [6, 6, 2.5]]),
+                  lo=(0.5, 0.5, 0.5), hi=(5.5, 5.5, 1.8)),
+    ]
+    cond36 = [mc.Condition("LOS"), mc.Condition("drop10%", drop_prob=0.1)]
+    t0 = time.perf_counter()
+    r36 = mc.run_sweep(lay36, (0.02, 0.1), cond36, n_trials=6000, chunk=2500, workers=1, seed=3)
+    el36 = time.perf_counter() - t0
+    print(mc.format_table(r36))
+    print(f"{sum(r.stats.trials for r in r36):,} trials in {el36:.2f}s (1 process)")
+    rows36 = {(r.layout, r.noise_std_m, r.condition): r.row() for r in r36}
+    assert_true("8 cells x 6000 trials", len(r36) == 8 and all(r.stats.trials == 6000 for r in r36))
+    assert_true("more noise -> larger mean error",
+                rows36[("box", 0.1, "LOS")]["mean"] > rows36[("box", 0.02, "LOS")]["mean"])
+    assert_true("low noise: p95 < 0.2 m, mirror hits < 2%",
+                all(rows36[(l, 0.02, "LOS")]["p95"] < 0.2 and rows36[(l, 0.02, "LOS")]["mirror_rate"] < 0.02
+                    for l in ("box", "flat")))
+    # còn >= 3 hàng đo khi A0 còn và: không mất, mất 1 anchor khác, hoặc mất đúng {A2, A3}
+    lost36 = 1 - 0.9 * (0.9 ** 3 + 3 * 0.1 * 0.9 ** 2 + 0.1 ** 2 * 0.9)
+    assert_close("dropout lost rate", rows36[("box", 0.02, "drop10%")]["lost_rate"], lost36, tol=0.01)
+    r36p = mc.run_sweep(lay36, (0.02, 0.1), cond36, n_trials=6000, chunk=2500, workers=2, seed=3)
+    assert_true("process pool == serial (per-chunk seeding)",
+                all(np.array_equal(a.stats.hist, b.stats.hist) and a.stats.mirror == b.stats.mirror
+                    for a, b in zip(r36, r36p)))
+    csv36 = os.path.join(tempfile.mkdtemp(), "mc.csv")
+    mc.write_table(r36, csv36)
+    with open(csv36) as f36:
+        assert_true("csv table: header + 1 row / cell", len(f36.read().strip().splitlines()) == 9)
+
+    lay36m = mc.main_layouts()
+    assert_true("main layouts: 6, y-up LM kwargs", len(lay36m) == 6 and tuple(lay36m[0].lm_kwargs["up"]) == (0.0, 1.0, 0.0))
+    probe36 = subprocess.run(
+        [sys.executable, "-c", "import sys, montecarlo as mc; mc.main_layouts(); print(sorted(sys.modules))"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=60)
+    assert_true("main_layouts() does not import main (no Socket.IO / global KF side effects)",
+                probe36.returncode == 0 and "'main'" not in probe36.stdout and probe36.stderr == "")
+
+    # ========== TEST 37: benchmark suite ==========
+    print("\n=== TEST 37: benchmark suite (metrics, stand-in server, regression flag) ===")
+    m37 = bench.bench_lm(n=200)
+    m37.update(bench.bench_kf(n=200))
+    m37.update(bench.bench_batch(tag_counts=(1, 100), repeat=1))
+    print(f"LM p50 {m37['lm_solve_p50_us']:.1f} µs (mean it {m37['lm_iters_mean']:.1f}) | "
+          f"KF update fast {m37['kf_update_fast_p50_us']:.1f} µs | batch 100: {m37['batch_frame_100_tags_per_s']:,.0f} tag/s")
+    assert_true("latency / iteration / throughput metrics present",
+                all(k in m37 for k in ("lm_solve_p99_us", "lm_iters_p95", "kf_predict_p50_us",
+                                       "kf_update_full_mean_us", "batch_lm_1_tags_per_s")))
+    assert_true("batched path scales with tag count",
+                m37["batch_frame_100_tags_per_s"] > 5 * m37["batch_frame_1_tags_per_s"])
+
+    base37 = {"a_p50_us": 10.0, "b_tags_per_s": 1000.0, "c_ok_rate": 1.0, "d_p99_us": 10.0}
+    now37 = {"a_p50_us": 13.0, "b_tags_per_s": 700.0, "c_ok_rate": 0.5, "d_p99_us": 5.0, "new_us": 1.0}
+    cmp37 = {c["name"]: c["regression"] for c in bench.compare(now37, base37, threshold=0.2)}
+    assert_true("regression flags: slower latency + lower throughput, not improvements / info",
+                cmp37 == {"a_p50_us": True, "b_tags_per_s": True, "d_p99_us": False})
+    assert_true("threshold is configurable",
+                not any(c["regression"] for c in bench.compare(now37, base37, threshold=0.5)))
+    path37 = os.path.join(tempfile.mkdtemp(), "baseline.json")
+    bench.save_baseline({"meta": {}, "metrics": base37}, path37)
+    assert_true("baseline file round-trip", bench.load_baseline(path37)["metrics"] == base37)
+
+    with bench.PushStandIn() as srv37:
+        send37 = bench.stdlib_batch_sender(srv37.url + "/push-batch")
+        send37([{"id": "T0", "x": 1, "y": 2, "z": 3, "ts": time.time()} for _ in range(3)])
+        send37([{"id": "T1", "x": 1, "y": 2, "z": 3, "ts": time.time()}])
+        conn37 = http.client.HTTPConnection("127.0.0.1", srv37.server.server_address[1])
+        conn37.request("GET", f"/push?x=1&y=2&z=3&ts={time.time()}")
+        code37 = conn37.getresponse().status
+        conn37.close()
+    assert_true("stand-in receives /push-batch (keep-alive) and /push",
+                code37 == 200 and srv37.requests == 3 and srv37.positions == 5
+                and max(srv37.latencies) < 1.0)
+
+    probe37 = subprocess.run(
+        [sys.executable, "-c", "import sys, bench; m = bench.bench_e2e(n_frames=20); "
+                               "print(sorted(sys.modules), m['e2e_delivered_rate'] > 0)"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=120)
+    assert_true("bench_e2e() runs without importing main (no Socket.IO / global KF side effects)",
+                probe37.returncode == 0 and "'main'" not in probe37.stdout
+                and probe37.stdout.strip().endswith("True"))
+
+    # ========== TEST 38: hot-path instrumentation ==========
+    print("\n=== TEST 38: stage timers, HDR histograms, counters, snapshot export ===")
+    h38 = ins.LatencyHistogram()
+    v38 = np.random.default_rng(38).lognormal(11.0, 1.0, 20000).astype(np.int64)   # ~60 µs (ns)
+    for v in v38.tolist():
+        h38.record(v)
+    rel38 = max(abs(h38.percentile(q) / np.percentile(v38, q) - 1.0) for q in (50, 90, 99))
+    print(f"HDR p50/p90/p99 max rel err = {rel38 * 100:.2f}% | buckets={len(h38.counts)}")
+    assert_true("HDR percentiles within 3.2%", rel38 < 0.032)
+    assert_true("bucket bounds invert index",
+                all(h38._index(h38._lower(i)) == i and h38._index(h38._lower(i + 1) - 1) == i
+                    for i in range(len(h38.counts) - 1)))
+    assert_true("exact below 2^sub_bits", ins.LatencyHistogram()._index(63) == 63)
+
+    off38 = ins.Instrumentation(enabled=False)
+    fn38 = lambda: 1
+    t0 = time.perf_counter()
+    for _ in range(100000):
+        with off38.stage("solve"):
+            pass
+        off38.count("x")
+    dis38 = (time.perf_counter() - t0) / 100000 * 1e6
+    print(f"disabled stage+count overhead: {dis38:.3f} µs / frame")
+    assert_true("disabled: no-op, fn unwrapped, < 1 µs",
+                off38.wrap("push", fn38) is fn38 and not off38.stages and not off38.counters and dis38 < 1.0)
+
+    on38 = ins.Instrumentation()
+    for i in range(200):
+        with on38.stage("solve"):
+            sum(range(200))
+        on38.observe("lm_iters", 5 + i % 7)
+        if i % 50 == 0:
+            on38.count("lm_not_converged")
+
+    def bad_send38(batch):
+        raise ConnectionError("down")
+
+    pub38 = pub.PositionPublisher(on38.wrap("http_push", bad_send38))
+    pub38.publish("T0", 1, 2, 3)
+    pub38.flush()
+    kf38 = gmc.AdaptiveGMCKalman3D(fast_update=True)
+    kf38.reset(gmc.Vec3(0, 0, 0))
+    kf38.update(gmc.Vec3(1, 1, 1), hybrid_cost=5.0)
+    kf38.update(gmc.Vec3(1, 1, 1), hybrid_cost=0.1)
+    on38.add_source("kf", lambda: {"gated": kf38.gated})
+    snap38 = on38.snapshot(reset=True)
+    print(ins.format_snapshot(snap38))
+    assert_true("stage / value / counter / source in snapshot",
+                snap38["stages"]["solve"]["count"] == 200 and snap38["values"]["lm_iters"]["max"] == 11
+                and snap38["counters"] == {"lm_not_converged": 4, "http_push_errors": 1}
+                and snap38["stages"]["http_push"]["count"] == 1 and snap38["kf"] == {"gated": 1})
+    assert_true("publish failure counted, publisher still swallows", pub38.stats()["send_errors"] == 1)
+    assert_true("snapshot(reset=True) clears window",
+                on38.snapshot()["stages"]["solve"]["count"] == 0 and not on38.counters)
+
+    path38 = os.path.join(tempfile.mkdtemp(), "metrics.jsonl")
+    on38.count("frames", 3)
+    exp38 = ins.SnapshotExporter(on38, interval=0.05, path=path38, port=0).start()
+    time.sleep(0.2)
+    port38 = exp38.address[1]
+    conn38 = http.client.HTTPConnection("127.0.0.1", port38, timeout=2)
+    conn38.request("GET", "/metrics")
+    http38 = json.loads(conn38.getresponse().read())
+    conn38.close()
+    exp38.stop()
+    with open(path38) as f38:
+        lines38 = [json.loads(l) for l in f38]
+    assert_true("periodic JSON-lines export + /metrics endpoint",
+                len(lines38) >= 3 and lines38[-1]["counters"]["frames"] == 3 and http38["counters"]["frames"] == 3)
+
+    # ========== TEST 39: LM solver diagnostics ==========
+    print("\n=== TEST 39: LM diagnostics (trace + aggregate counters) ===")
+    anchors39 = [v3(0, 0, 2.0), v3(6, 0, 2.0), v3(0, 6, 2.0), v3(6, 6, 2.7)]
+    random.seed(39)
+    d39 = hs.LMDiagnostics()
+    same39 = True
+    for _ in range(300):
+        s39 = hs.s_from_groundtruth(anchors39, rand_tag_in_box(0.6, 5.4, 0.6, 5.4, 0.6, 2.0), 0.05)
+        r_plain = hs.hybrid_solve_LM(anchors39, s39)
+        r_diag = hs.hybrid_solve_LM(anchors39, s39, diag=d39)
+        same39 &= r_plain[1:] == r_diag[1:] and dist3(r_plain[0], r_diag[0]) == 0.0
+    sm39 = d39.summary()
+    print(f"solves={sm39['solves']} it mean={sm39['it_mean']:.2f} p95={sm39['it_p95']:.0f} "
+          f"p99={sm39['it_p99']:.0f} | reject={sm39['reject_rate']:.3f} clip={sm39['clip_rate']:.3f} "
+          f"reasons={sm39['reasons']}")
+    assert_true("diag does not change the solve", same39)
+    # dừng theo "step" không tính residual ở vòng cuối -> evals = tổng vòng - số lần dừng "step"
+    assert_true("counters consistent", sm39["solves"] == 300 and sum(sm39["reasons"].values()) == 300
+                and d39.evals == d39.iterations - sm39["reasons"]["step"])
+
+    # start xa (8 m): cắt trust region + lambda giảm dần trên các bước được nhận
+    d39.reset_counters()
+    s39 = hs.s_from_groundtruth(anchors39, v3(3.0, 3.0, 1.2), 0.0)
+    est39, it39, ok39, _ = hs.hybrid_solve_LM(anchors39, s39, init=v3(9.0, -3.0, 3.4), diag=d39)
+    tr39 = d39.trace()
+    acc39 = tr39["accepted"]
+    assert_true("trace length == evaluated steps, init='given'",
+                len(tr39["lam"]) == d39.evals and tr39["init"] == "given" and ok39)
+    assert_true("far start hits max_step clip", tr39["clipped"][:5].all() and d39.clip_hits >= 5)
+    assert_true("lambda x0.7 after accepted step",
+                all(abs(tr39["lam"][i + 1] - max(tr39["lam"][i] * 0.7, 1e-7)) < 1e-15
+                    for i in range(len(acc39) - 1) if acc39[i]))
+    est39b, it39b, _, _ = hs.hybrid_solve_LM(anchors39, s39, init=v3(9.0, -3.0, 3.4), max_step=1.0)
+    print(f"far start: it={it39} (max_step 0.25) vs it={it39b} (max_step 1.0)")
+    assert_true("max_step is tunable (larger step -> fewer iterations)", it39b < it39)
+
+    d39.reset_counters()
+    s39 = hs.s_from_groundtruth(anchors39, v3(3.0, 3.0, 0.3), 0.0)
+    hs.hybrid_solve_LM(anchors39, s39, init=v3(3.0, 3.0, 3.0), z_min=1.0, diag=d39)
+    assert_true("z-clamp events recorded", d39.z_clamps > 0 and d39.trace()["z_clamped"].any())
+
+    d39.reset_counters()
+    s39 = hs.s_from_groundtruth(anchors39, v3(3.0, 3.0, 1.2), 0.0)
+    s39[0] += 0.15
+    _, it39r, ok39r, cost39r = hs.hybrid_solve_LM(anchors39, s39, max_iter=3, diag=d39)
+    assert_true("rescue fallback (cost < 0.05) flagged",
+                ok39r and d39.rescued and d39.rescues == 1 and d39.reason == "max_iter" and it39r == 3)
+
+    # ========== TEST 40: trust-region strategies ==========
+    print("\n=== TEST 40: LM strategies (lm / nielsen / dogleg / geodesic) ===")
+    variants40 = (("lm", False), ("lm", True), ("nielsen", False), ("nielsen", True), ("dogleg", False))
+    random.seed(40)
+    for name40, anchors40 in (("noncoplanar_5x5", make_anchors_noncoplanar_5x5()), ("hall_8", make_anchors_hall_8())):
+        meas40 = None if len(anchors40) == 4 else hs.make_measurement_set(len(anchors40))
+        worst40 = 0.0
+        for _ in range(50):
+            s40 = hs.s_from_groundtruth(anchors40, rand_tag_in_box(0.5, 4.5, 0.5, 4.5, 0.5, 1.8), 0.05, meas=meas40)
+            ref40 = hs.hybrid_solve_LM(anchors40, s40, meas=meas40)
+            for strategy, geodesic in variants40[1:]:
+                e40, _, ok40, _ = hs.hybrid_solve_LM(anchors40, s40, meas=meas40, strategy=strategy, geodesic=geodesic)
+                worst40 = max(worst40, dist3(e40, ref40[0]) if ok40 else math.inf)
+        print(f"{name40}: max |x - x_lm| over strategies = {worst40 * 1000:.2f} mm")
+        assert_true(f"{name40}: every strategy reaches the lm solution", worst40 < 5e-3)
+
+    anchors40 = [v3(0, 0, 2.0), v3(6, 0, 2.0), v3(0, 6, 2.0), v3(6, 6, 2.7)]
+    s40 = hs.s_from_groundtruth(anchors40, v3(3.0, 3.0, 1.2), 0.0)
+    its40 = {}
+    for strategy, geodesic in variants40:
+        e40, its40[(strategy, geodesic)], ok40, _ = hs.hybrid_solve_LM(
+            anchors40, s40, init=v3(9.0, -3.0, 3.4), strategy=strategy, geodesic=geodesic)
+        assert_true(f"far start converges ({strategy}, geodesic={geodesic})",
+                    ok40 and dist3(e40, v3(3.0, 3.0, 1.2)) < 5e-3)
+    print("far start iterations:", {f"{k[0]}{'+geo' if k[1] else ''}": v for k, v in its40.items()})
+    assert_true("nielsen / dogleg need fewer iterations than lm from a far start",
+                its40[("nielsen", False)] < its40[("lm", False)] and its40[("dogleg", False)] < its40[("lm", False)])
+
+    d40 = hs.LMDiagnostics()
+    hs.hybrid_solve_LM(anchors40, s40, init=v3(9.0, -3.0, 3.4), strategy="dogleg", diag=d40)
+    tr40 = d40.trace()
+    assert_true("diag records dogleg radius in lam column",
+                tr40["lam"][0] == 0.25 and len(tr40["lam"]) == d40.evals and d40.solves == 1)
+    for bad40 in ({"strategy": "bfgs"}, {"strategy": "dogleg", "geodesic": True}):
+        try:
+            hs.hybrid_solve_LM(anchors40, s40, **bad40)
+            assert_true(f"rejects {bad40}", False)
+        except ValueError:
+            assert_true(f"rejects {bad40}", True)
+
+    # gia tốc geodesic cộng vào trước khi cắt -> mỗi bước lm+geo vẫn <= max_step
+    moved40 = 0.0
+    for init40 in (v3(9.0, -3.0, 1.0), v3(-4.0, 8.0, 0.5), v3(12.0, 12.0, 3.0)):
+        for n_it in range(1, 6):
+            e40, _, _, _ = hs.hybrid_solve_LM(anchors40, s40, init=init40, max_iter=n_it, tol_res=0.0,
+                                              strategy="lm", geodesic=True, z_min=-10.0, z_max=10.0)
+            moved40 = max(moved40, dist3(e40, init40) / n_it)
+    assert_true("lm+geodesic steps stay within max_step", moved40 <= 0.25 + 1e-9)
+
+    rows40 = bench.bench_strategies(n=40, seed=40)
+    print(bench.format_strategies(rows40))
+    assert_true("strategy benchmark covers every scene/start/variant",
+                len(rows40) == len(bench.STRATEGY_SCENES) * 2 * len(bench.STRATEGY_VARIANTS))
+    succ40 = {(r["scene"], r["start"], r["strategy"]): r["success_rate"] for r in rows40}
+    assert_true("far start (tag side) reaches ground truth as often as cold start (nielsen / dogleg)",
+                all(succ40[(sc, "far", st)] >= succ40[(sc, "cold", st)] - 0.03
+                    for sc in bench.STRATEGY_SCENES for st in ("nielsen", "dogleg")))
+
     print("\nDone.")
 
 
@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+
+from hybrid_scalable import (
+    anchors_to_array,
+    make_measurement_set,
+    measurement_index,
+    measurement_rows_available,
+    residual_and_jacobian_meas,
+)
+from gmc_kalman_filter import (
+    Vec3,
+    AdaptiveGMCKalmanMotion3D,
+)
+
+
+# ---------- Tightly-coupled robust EKF (raw TDoA / range) ----------
+class TightGMCEKF(AdaptiveGMCKalmanMotion3D):
+    """
+    EKF hấp thụ trực tiếp vector s thô (mặc định [d2, d3, d4, d01, d02]) thay vì
+    vị trí đã giải bằng LM: mỗi frame chỉ 1 lần tính residual + Jacobian tại x dự đoán.
+
+    - Trọng số GMC áp dụng trên từng hàng đo (MAD sigma + beta adaptive như bản 3D)
+    - meas_var ở đây là phương sai của MỘT hàng đo (m^2), không phải của vị trí
+    - Hàng dùng anchor bị mất được bỏ qua -> vẫn update khi còn < 4 anchor
+    - model: "rw" / "cv" / "ca" như AdaptiveGMCKalmanMotion3D
+    """
+
+    def __init__(
+            self,
+            process_var: float = 0.9,
+            meas_var: float = 0.01,
+            alpha: float = 1.0,
+            beta_init: float = 1.0,
+            model: str = "cv",
+            vel_var: float = 1.0,
+            acc_var: float = 1.0,
+            min_rows: int = 1,
+    ):
+        super().__init__(process_var, meas_var, alpha, beta_init, model, vel_var, acc_var)
+        self.min_rows = int(min_rows)
+
+    def update_raw(
+            self,
+            anchors,
+            s,
+            meas=None,
+            anchor_ok=None,
+            row_ok=None,
+    ):
+        """
+        anchors: list K Vec3 / (K,3); s: (M,) theo descriptor meas (None -> mặc định cho K anchor)
+        anchor_ok: (K,) bool - anchor nhận được ở frame này; row_ok: (M,) bool - hàng hợp lệ.
+        Trả về (vị trí Vec3, số hàng đã dùng).
+        """
+        A = anchors_to_array(anchors)
+        K = A.shape[0]
+        if meas is None:
+            meas = make_measurement_set(K)
+        s = np.asarray(s, dtype=float)
+
+        keep = np.ones(len(meas), dtype=bool) if row_ok is None else np.asarray(row_ok, dtype=bool).copy()
+        if anchor_ok is not None:
+            keep &= measurement_rows_available(meas, anchor_ok)
+        keep &= np.isfinite(s)
+        m = int(keep.sum())
+        if m < self.min_rows:
+            return self.get_state_vec3(), 0
+
+        rows = [mr for mr, k in zip(meas, keep) if k]
+        f = np.empty(m)
+        J = np.empty((m, 3))
+        residual_and_jacobian_meas(A, s[keep], self.x[0:3, 0], measurement_index(rows, K), f, J)
+        v = -f                                     # innovation = s - h(x)
+
+        # GMC theo từng hàng đo
+        sigma = max(float(np.median(np.abs(v))) / 0.6745, 0.1)
+        ratio = self._gamma_beta_ratio()
+        beta = max(sigma * ratio, 0.3) if ratio is not None else self.beta_init
+        w = np.exp(-(np.abs(v) / beta) ** self.alpha)
+
+        eps = 1e-8
+        r_diag = self.r / (w + eps)
+
+        # H = [J 0 ...]
+        P = self.P
+        PHt = P[:, 0:3] @ J.T                      # (d,m)
+        S = J @ PHt[0:3, :] + np.diag(r_diag)
+        try:
+            S_inv = np.linalg.inv(S)
+        except np.linalg.LinAlgError:
+            S_inv = np.linalg.pinv(S)
+
+        K_gain = PHt @ S_inv                       # (d,m)
+        self.x = self.x + K_gain @ v.reshape(-1, 1)
+        self.P = P - K_gain @ (J @ P[0:3, :])
+
+        return self.get_state_vec3(), m
+
+
+if __name__ == "__main__":
+    import random
+
+    from hybrid_scalable import Vec3 as HVec3, s_from_groundtruth, hybrid_solve_LM, dist
+    from gmc_kalman_filter import AdaptiveGMCKalman3D
+
+    print("===== Tightly-coupled GMC-EKF (raw s) vs LM + GMC-KF =====")
+
+    anchors = [HVec3(0, 0, 2.0), HVec3(5, 0, 2.0), HVec3(0, 5, 2.0), HVec3(5, 5, 2.7)]
+    random.seed(20251231)
+
+    def gt_path(t):
+        return HVec3(2.5 + 1.2 * math.sin(0.6 * t), 2.5 + 1.2 * math.cos(0.6 * t), 1.5)
+
+    est0, _, _, _ = hybrid_solve_LM(anchors, s_from_groundtruth(anchors, gt_path(0.0), 0.05))
+    ekf = TightGMCEKF(process_var=2.0, meas_var=0.0025, model="cv")
+    ekf.reset(Vec3(est0.x, est0.y, est0.z))
+    kf = AdaptiveGMCKalman3D(process_var=0.8, meas_var=0.7, fast_update=True)
+    kf.reset(Vec3(est0.x, est0.y, est0.z))
+
+    errs_tight, errs_loose = [], []
+    for i in range(1, 61):
+        t = i * 0.1
+        gt = gt_path(t)
+        s = s_from_groundtruth(anchors, gt, 0.05)
+        a3_ok = not (3.0 <= t <= 4.0)                 # A3 mất 1s
+
+        ekf.predict(0.1)
+        est, used = ekf.update_raw(anchors, s, anchor_ok=[True, True, True, a3_ok])
+
+        kf.predict(0.1)
+        if a3_ok:   # LM cần đủ 4 anchor
+            est_lm, _, ok, cost = hybrid_solve_LM(anchors, s)
+            if ok:
+                kf.update(Vec3(est_lm.x, est_lm.y, est_lm.z), hybrid_cost=cost)
+        loose = kf.get_state_vec3()
+
+        errs_tight.append(dist(gt, HVec3(est.x, est.y, est.z)))
+        errs_loose.append(dist(gt, HVec3(loose.x, loose.y, loose.z)))
+        if i % 5 == 0:
+            print(f"[{i:02d}] rows={used} TIGHT err={errs_tight[-1]:.3f} | LOOSE err={errs_loose[-1]:.3f}")
+
+    print(f"mean err: TIGHT={sum(errs_tight) / len(errs_tight):.3f} m | LOOSE={sum(errs_loose) / len(errs_loose):.3f} m")
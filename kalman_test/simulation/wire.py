@@ -0,0 +1,201 @@
+from typing import List, Optional
+
+import numpy as np
+
+
+# ---------- Binary frame format (little-endian) ----------
+# Header 12 byte: magic "UW" | version u8 | flags u8 | count u32 | anchor_version u32
+# Record 24 byte: tag u32 | ts f64 (s) | x, y, z i32 (mm)
+#      + 6 byte nếu FLAG_STD: std_x, std_y, std_z u16 (mm, bão hòa 65535)
+WIRE_MAGIC = b"UW"
+WIRE_VERSION = 1
+FLAG_STD = 0x01
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("count", "<u4"), ("av", "<u4"),
+])
+RECORD_DTYPE = np.dtype([("tag", "<u4"), ("ts", "<f8"), ("pos", "<i4", (3,))])
+RECORD_STD_DTYPE = np.dtype([("tag", "<u4"), ("ts", "<f8"), ("pos", "<i4", (3,)), ("std", "<u2", (3,))])
+
+
+def encode_positions(tags, ts, pos, std=None, anchor_version: int = 0) -> bytes:
+    """
+    Đóng gói N vị trí vào 1 frame nhị phân, trực tiếp từ mảng NumPy.
+    tags: (N,) int, ts: scalar hoặc (N,) giây, pos: (N,3) m, std: None hoặc (N,3) m (độ lệch chuẩn / trục).
+    """
+    pos = np.asarray(pos, dtype=float).reshape(-1, 3)
+    n = pos.shape[0]
+    rec_dtype = RECORD_DTYPE if std is None else RECORD_STD_DTYPE
+
+    buf = bytearray(HEADER_DTYPE.itemsize + n * rec_dtype.itemsize)
+    hdr = np.frombuffer(buf, dtype=HEADER_DTYPE, count=1)
+    hdr["magic"] = WIRE_MAGIC
+    hdr["version"] = WIRE_VERSION
+    hdr["flags"] = 0 if std is None else FLAG_STD
+    hdr["count"] = n
+    hdr["av"] = anchor_version
+
+    rec = np.frombuffer(buf, dtype=rec_dtype, count=n, offset=HEADER_DTYPE.itemsize)
+    rec["tag"] = tags
+    rec["ts"] = ts
+    rec["pos"] = np.rint(pos * 1000.0)
+    if std is not None:
+        rec["std"] = np.clip(np.rint(np.asarray(std, dtype=float).reshape(-1, 3) * 1000.0), 0, 65535)
+    return bytes(buf)
+
+
+def decode_positions(data: bytes) -> dict:
+    """
+    Giải 1 frame -> dict mảng (tag, ts zero-copy trên data):
+    {"av", "tag" (N,), "ts" (N,), "pos" (N,3) m, "std" (N,3) m hoặc None}
+    """
+    if len(data) < HEADER_DTYPE.itemsize:
+        raise ValueError("wire frame too short")
+    hdr = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+    if hdr["magic"] != WIRE_MAGIC or hdr["version"] != WIRE_VERSION:
+        raise ValueError("bad wire frame magic/version")
+    has_std = bool(hdr["flags"] & FLAG_STD)
+    rec_dtype = RECORD_STD_DTYPE if has_std else RECORD_DTYPE
+    n = int(hdr["count"])
+    if len(data) != HEADER_DTYPE.itemsize + n * rec_dtype.itemsize:
+        raise ValueError("wire frame length does not match record count")
+
+    rec = np.frombuffer(data, dtype=rec_dtype, count=n, offset=HEADER_DTYPE.itemsize)
+    return {
+        "av": int(hdr["av"]),
+        "tag": rec["tag"],
+        "ts": rec["ts"],
+        "pos": rec["pos"] * 1e-3,
+        "std": rec["std"] * 1e-3 if has_std else None,
+    }
+
+
+def encode_items(items: List[dict], anchor_version: Optional[int] = None) -> bytes:
+    """Batch dict của PositionPublisher ({"id", "x", "y", "z", "ts", "av"}) -> frame nhị phân (id phải là số)."""
+    n = len(items)
+    tags = np.fromiter((int(it["id"]) for it in items), dtype=np.int64, count=n)
+    ts = np.fromiter((it["ts"] for it in items), dtype=float, count=n)
+    pos = np.array([(it["x"], it["y"], it["z"]) for it in items], dtype=float).reshape(n, 3)
+    if anchor_version is None:
+        anchor_version = items[-1].get("av", 0) if items else 0
+    return encode_positions(tags, ts, pos, anchor_version=anchor_version or 0)
+
+
+# ---------- Measurement report (anchor -> server, UDP) ----------
+# Header 24 byte: magic "UM" | version u8 | K u8 | M u8 | pad u8 | count u32 | t f64 | zone u32 | pad u32
+# Tiếp theo K*3 f64: toạ độ anchor dùng chung cho cả batch
+# Record: tag u32 | s M * f64
+MEAS_MAGIC = b"UM"
+
+MEAS_HEADER_DTYPE = np.dtype([
+    ("magic", "S2"), ("version", "u1"), ("k", "u1"), ("m", "u1"), ("pad0", "u1"),
+    ("count", "<u4"), ("t", "<f8"), ("zone", "<u4"), ("pad1", "<u4"),
+])
+
+
+def meas_record_dtype(m: int) -> np.dtype:
+    return np.dtype([("tag", "<u4"), ("s", "<f8", (m,))])
+
+
+def encode_measurements(t: float, tags, anchors, S, zone: int = 0) -> bytes:
+    """Batch đo của nhiều tag cùng 1 anchor set: tags (N,), anchors (K,3), S (N,M)."""
+    A = np.asarray(anchors, dtype=float).reshape(-1, 3)
+    S = np.asarray(S, dtype=float)
+    S = S.reshape(S.shape[0] if S.ndim > 1 else 1, -1)
+    n, m = S.shape
+    k = A.shape[0]
+    rec_dtype = meas_record_dtype(m)
+
+    off_a = MEAS_HEADER_DTYPE.itemsize
+    off_r = off_a + A.nbytes
+    buf = bytearray(off_r + n * rec_dtype.itemsize)
+    hdr = np.frombuffer(buf, dtype=MEAS_HEADER_DTYPE, count=1)
+    hdr["magic"] = MEAS_MAGIC
+    hdr["version"] = WIRE_VERSION
+    hdr["k"] = k
+    hdr["m"] = m
+    hdr["count"] = n
+    hdr["t"] = t
+    hdr["zone"] = zone
+    np.frombuffer(buf, dtype="<f8", count=3 * k, offset=off_a)[:] = A.reshape(-1)
+    rec = np.frombuffer(buf, dtype=rec_dtype, count=n, offset=off_r)
+    rec["tag"] = tags
+    rec["s"] = S
+    return bytes(buf)
+
+
+def decode_measurements(data: bytes) -> dict:
+    """-> {"t", "zone", "tags" (N,), "anchors" (K,3), "S" (N,M)}; raise ValueError nếu frame hỏng."""
+    if len(data) < MEAS_HEADER_DTYPE.itemsize:
+        raise ValueError("measurement frame too short")
+    hdr = np.frombuffer(data, dtype=MEAS_HEADER_DTYPE, count=1)[0]
+    if hdr["magic"] != MEAS_MAGIC or hdr["version"] != WIRE_VERSION:
+        raise ValueError("bad measurement frame magic/version")
+    k, m, n = int(hdr["k"]), int(hdr["m"]), int(hdr["count"])
+    rec_dtype = meas_record_dtype(m)
+    off_a = MEAS_HEADER_DTYPE.itemsize
+    off_r = off_a + 3 * k * 8
+    if len(data) != off_r + n * rec_dtype.itemsize:
+        raise ValueError("measurement frame length does not match header")
+    rec = np.frombuffer(data, dtype=rec_dtype, count=n, offset=off_r)
+    return {
+        "t": float(hdr["t"]),
+        "zone": int(hdr["zone"]),
+        "tags": rec["tag"].astype(np.int64),
+        "anchors": np.frombuffer(data, dtype="<f8", count=3 * k, offset=off_a).reshape(k, 3),
+        "S": rec["s"].reshape(n, m),
+    }
+
+
+# ---------- Benchmark so với format hiện tại ----------
+def benchmark(n_records: int = 1000, repeat: int = 20) -> dict:
+    """Thời gian encode/decode (µs / record) của query string, JSON và frame nhị phân."""
+    import json
+    import time
+    from urllib.parse import urlencode, parse_qsl
+
+    rng = np.random.default_rng(0)
+    tags = np.arange(n_records)
+    ts = 1.7e9 + rng.uniform(0, 1, n_records)
+    pos = rng.uniform(0, 12, (n_records, 3))
+    std = rng.uniform(0.01, 0.3, (n_records, 3))
+
+    def bench(fn):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            best = min(best, time.perf_counter() - t0)
+        return best / n_records * 1e6, out
+
+    def enc_query():
+        # /push: mỗi vị trí 1 query string (3 số lẻ)
+        return [urlencode({"x": round(float(p[0]), 3), "y": round(float(p[1]), 3),
+                           "z": round(float(p[2]), 3), "ts": round(float(t), 3)})
+                for p, t in zip(pos, ts)]
+
+    def enc_json():
+        return json.dumps({"positions": [
+            {"id": int(i), "x": round(float(p[0]), 3), "y": round(float(p[1]), 3),
+             "z": round(float(p[2]), 3), "ts": round(float(t), 3)}
+            for i, p, t in zip(tags, pos, ts)
+        ]})
+
+    res = {}
+    us, q = bench(enc_query)
+    res["query"] = {"enc_us": us, "dec_us": bench(lambda: [dict(parse_qsl(s)) for s in q])[0],
+                    "bytes": sum(len(s) for s in q) / n_records}
+    us, js = bench(enc_json)
+    res["json"] = {"enc_us": us, "dec_us": bench(lambda: json.loads(js))[0], "bytes": len(js) / n_records}
+    us, b = bench(lambda: encode_positions(tags, ts, pos))
+    res["binary"] = {"enc_us": us, "dec_us": bench(lambda: decode_positions(b))[0], "bytes": len(b) / n_records}
+    us, b = bench(lambda: encode_positions(tags, ts, pos, std=std))
+    res["binary+std"] = {"enc_us": us, "dec_us": bench(lambda: decode_positions(b))[0], "bytes": len(b) / n_records}
+    return res
+
+
+if __name__ == "__main__":
+    for n in (1, 100, 10000):
+        print(f"===== {n} records / message =====")
+        for name, r in benchmark(n, repeat=5 if n > 1000 else 20).items():
+            print(f"{name:>11}: enc {r['enc_us']:7.3f} µs/rec | dec {r['dec_us']:7.3f} µs/rec | {r['bytes']:6.1f} B/rec")